@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+"""
+Decode Benchmark
+
+Measures the examples/sec of ExtractFromTensorFlow under different read options. A synthetic EuroSAT-shaped image
+dataset is prepared into a temporary TFDS data_dir, so nothing is downloaded. Pass --data-dir and --name to measure a
+dataset that is already prepared instead.
+"""
+
+import argparse
+import os
+import tempfile
+import time
+import uuid
+
+import numpy as np
+import tensorflow as tf
+import tensorflow_datasets as tfds
+
+from src.model import DTO
+from src.pipeline.stages.extract_from_tensorflow import ExtractFromTensorFlow, DatasetSplit
+
+
+class SyntheticImages(tfds.core.GeneratorBasedBuilder):
+    """Random 64x64 RGB PNGs with ten labels, written as several shards like EuroSAT."""
+
+    VERSION = tfds.core.Version("1.0.0")
+    EXAMPLES = 5000
+
+    def _info(self) -> tfds.core.DatasetInfo:
+        return tfds.core.DatasetInfo(
+            builder=self,
+            features=tfds.features.FeaturesDict({
+                "image": tfds.features.Image(shape=(64, 64, 3)),
+                "label": tfds.features.ClassLabel(num_classes=10),
+            }),
+            supervised_keys=("image", "label"),
+        )
+
+    def _split_generators(self, dl_manager):
+        return {"train": self._generate_examples()}
+
+    def _generate_examples(self):
+        rng = np.random.default_rng(0)
+        for i in range(self.EXAMPLES):
+            yield i, {
+                "image": rng.integers(0, 256, (64, 64, 3), dtype=np.uint8),
+                "label": int(rng.integers(0, 10)),
+            }
+
+
+def throughput(stage: ExtractFromTensorFlow, limit: int) -> float:
+    """Examples per second over one pass, after a warm-up batch."""
+    dataset = stage.run(DTO(uuid=uuid.uuid4())).raw_data.take(limit)
+    iterator = iter(dataset)
+    next(iterator)
+
+    count = 1
+    start = time.perf_counter()
+    for _ in iterator:
+        count += 1
+    return count / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Decode Benchmark")
+    parser.add_argument("--name", default=None, help="Prepared TFDS dataset to read, e.g. eurosat/rgb")
+    parser.add_argument("--data-dir", default=None, help="TFDS data_dir holding the dataset")
+    parser.add_argument("--examples", type=int, default=SyntheticImages.EXAMPLES,
+                        help="Synthetic examples to generate, or examples to read from --name")
+    parser.add_argument("--cycle-length", type=int, default=os.cpu_count(), help="Interleave cycle length")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        name, data_dir = args.name, args.data_dir
+        if name is None:
+            SyntheticImages.EXAMPLES = args.examples
+            data_dir = temp_dir
+            builder = SyntheticImages(data_dir=data_dir)
+            builder.download_and_prepare(
+                download_config=tfds.download.DownloadConfig(max_examples_per_split=None, num_shards=8))
+            name = builder.name
+
+        variants = {
+            "defaults": {},
+            "interleave": {"read_config": tfds.ReadConfig(interleave_cycle_length=args.cycle_length,
+                                                          num_parallel_calls_for_decode=tf.data.AUTOTUNE,
+                                                          try_autocache=False)},
+            "skip decoding": {"skip_decoding": ["image"],
+                              "read_config": tfds.ReadConfig(interleave_cycle_length=args.cycle_length,
+                                                             try_autocache=False)},
+        }
+
+        print(f"Reading {args.examples} examples of {name} from {data_dir}")
+        print(f"{'variant':<16}{'examples/s':>14}")
+        for label, options in variants.items():
+            stage = ExtractFromTensorFlow(name=name, split=DatasetSplit.TRAIN.value, with_info=True,
+                                          data_dir=data_dir, **options)
+            print(f"{label:<16}{throughput(stage, args.examples):>14,.0f}")
+
+
+if __name__ == "__main__":
+    main()
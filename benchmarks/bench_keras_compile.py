@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+"""
+Keras Compile Options Benchmark
+
+Measures training steps/sec of ApplyKerasSequential for every combination of XLA compilation, steps_per_execution
+and mixed precision, on synthetic 64x64 RGB tiles. The first epoch compiles and is excluded, the second is timed.
+"""
+
+import argparse
+import itertools
+import time
+import uuid
+
+import tensorflow as tf
+
+from benchmarks.suite import small_cnn
+from benchmarks.synthetic import synthetic_tiles
+from src.model import DTO, SplitEnum
+from src.pipeline.stages.apply_keras_sequential import ApplyKerasSequential, KerasConfig
+from src.utils.hardware import supports_bfloat16
+
+
+def steps_per_sec(config: KerasConfig, train: tf.data.Dataset) -> float:
+    dto = DTO(uuid=uuid.uuid4())
+    dto.class_names = [str(i) for i in range(10)]
+    dto.split_data = {SplitEnum.TRAIN.value: train}
+    stage = ApplyKerasSequential(config, [tf.keras.Input(shape=(64, 64, 3))] + small_cnn())
+    model = stage.run(dto).keras_model
+
+    steps = int(train.cardinality())
+    start = time.perf_counter()
+    model.fit(train, epochs=1, verbose=0)
+    return steps / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Keras Compile Options Benchmark")
+    parser.add_argument("--tiles", type=int, default=4096, help="Synthetic training tiles")
+    parser.add_argument("--batch-size", type=int, default=32, help="Batch size")
+    parser.add_argument("--steps-per-execution", type=int, nargs="+", default=[1, 16],
+                        help="steps_per_execution values to try")
+    args = parser.parse_args()
+
+    train = synthetic_tiles(args.tiles).batch(args.batch_size).cache()
+    policies = [None, "mixed_bfloat16"]
+    print(f"Native bfloat16: {supports_bfloat16()}")
+    print(f"{'jit_compile':<13}{'steps/exec':>11}  {'precision':<16}{'steps/s':>10}")
+
+    for jit_compile, steps, policy in itertools.product([False, True], args.steps_per_execution, policies):
+        config = KerasConfig(epochs=1, use_cache=False, jit_compile=jit_compile, steps_per_execution=steps,
+                             mixed_precision=policy)
+        try:
+            result = f"{steps_per_sec(config, train):10,.1f}"
+        except Exception as e:
+            result = f"failed: {type(e).__name__}"
+        print(f"{str(jit_compile):<13}{steps:>11}  {policy or 'float32':<16}{result:>10}", flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+"""
+Sink Benchmark
+
+Compares the rows/sec of LoadToClickHouse against LoadToGeoJSON on synthetic predictions. ClickHouse is replaced by a
+local HTTP endpoint that reads and discards the request body, so the numbers cover encoding and transfer only.
+"""
+
+import argparse
+import tempfile
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from benchmarks.synthetic import synthetic_predictions
+from src.model import DTO
+from src.pipeline.stages.load_to_clickhouse import LoadToClickHouse, ClickHouseConfig
+from src.pipeline.stages.load_to_geojson import LoadToGeoJSON
+
+
+class DiscardHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+def timed(stage, dto: DTO) -> float:
+    start = time.perf_counter()
+    stage.run(dto)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sink Benchmark")
+    parser.add_argument("--rows", type=int, default=200_000, help="Number of synthetic predictions")
+    parser.add_argument("--batch-size", type=int, default=50_000, help="Rows per ClickHouse insert")
+    args = parser.parse_args()
+
+    dto = DTO(uuid=uuid.uuid4())
+    dto.processed_data = synthetic_predictions(args.rows)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), DiscardHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    clickhouse = LoadToClickHouse(ClickHouseConfig(
+        table="predictions",
+        columns=[("tile_id", "UInt64"), ("label", "UInt8"), ("probability", "Float32"),
+                 ("lon", "Float64"), ("lat", "Float64")],
+        url=f"http://127.0.0.1:{server.server_address[1]}",
+        batch_size=args.batch_size,
+    ))
+    clickhouse_wkt = LoadToClickHouse(ClickHouseConfig(
+        table="predictions",
+        columns=[("tile_id", "UInt64"), ("label", "UInt8"), ("probability", "Float32"), ("geometry", "String")],
+        url=f"http://127.0.0.1:{server.server_address[1]}",
+        batch_size=args.batch_size,
+    ))
+
+    results = {
+        "LoadToClickHouse (lon/lat)": timed(clickhouse, dto),
+        "LoadToClickHouse (WKT)": timed(clickhouse_wkt, dto),
+    }
+    with tempfile.TemporaryDirectory() as temp_dir:
+        results["LoadToGeoJSON"] = timed(LoadToGeoJSON(temp_dir), dto)
+
+    server.shutdown()
+
+    print(f"{args.rows} rows")
+    for name, elapsed in results.items():
+        print(f"{name:<28} {elapsed:8.3f}s {args.rows / elapsed:12,.0f} rows/s")
+
+
+if __name__ == "__main__":
+    main()
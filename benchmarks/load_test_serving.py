@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+"""
+Serving Load Test
+
+Sends concurrent single-tile requests to a prediction server and reports client-side p50/p99 latency and throughput,
+together with the server's own batching metrics. Without --url, starts an in-process server around a small synthetic
+model, so it runs without a trained cache.
+"""
+
+import argparse
+import http.client
+import json
+import tempfile
+import threading
+import time
+from urllib.parse import urlparse
+
+import numpy as np
+import tensorflow as tf
+
+from src.serving.server import PredictionService, make_server
+from src.utils.model_cache import ModelCache
+
+
+def synthetic_model_hash(cache: ModelCache) -> str:
+    """Cache a small CNN over 64x64 RGB tiles and return its hash."""
+    model = tf.keras.Sequential([
+        tf.keras.Input(shape=(64, 64, 3)),
+        tf.keras.layers.Conv2D(8, 3, strides=2, activation="relu"),
+        tf.keras.layers.GlobalAveragePooling2D(),
+        tf.keras.layers.Dense(10, activation="softmax"),
+    ])
+    return cache.save_model(model, [{"class_name": "synthetic"}], {}, {"input_shape": [64, 64, 3]})
+
+
+def worker(url: str, model_hash: str, requests: int, latencies: list) -> None:
+    parsed = urlparse(url)
+    conn = http.client.HTTPConnection(parsed.hostname, parsed.port)
+    rng = np.random.default_rng()
+    for _ in range(requests):
+        body = json.dumps({"instance": rng.integers(0, 255, (64, 64, 3)).tolist()})
+        start = time.perf_counter()
+        conn.request("POST", f"/models/{model_hash}/predict", body=body,
+                     headers={"Content-Type": "application/json"})
+        response = conn.getresponse()
+        response.read()
+        latencies.append(time.perf_counter() - start)
+        if response.status != 200:
+            raise RuntimeError(f"Request failed with {response.status}")
+    conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serving Load Test")
+    parser.add_argument("--url", help="Running prediction server. Starts a local one if omitted")
+    parser.add_argument("--model-hash", help="Model to query on the running server")
+    parser.add_argument("--clients", type=int, default=16, help="Concurrent clients")
+    parser.add_argument("--requests", type=int, default=50, help="Requests per client")
+    parser.add_argument("--max-batch-size", type=int, default=32, help="Local server: maximum rows per model call")
+    parser.add_argument("--max-wait-ms", type=float, default=5.0, help="Local server: maximum batching wait")
+    args = parser.parse_args()
+
+    server = None
+    url, model_hash = args.url, args.model_hash
+    if url is None:
+        cache = ModelCache(tempfile.mkdtemp(), dedupe=True)
+        model_hash = synthetic_model_hash(cache)
+        service = PredictionService(cache, max_batch_size=args.max_batch_size, max_wait_ms=args.max_wait_ms)
+        server = make_server(service, port=0)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    latencies: list = []
+    threads = [threading.Thread(target=worker, args=(url, model_hash, args.requests, latencies))
+               for _ in range(args.clients)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    ms = np.asarray(latencies) * 1000
+    print(f"{len(latencies)} requests from {args.clients} clients in {elapsed:.2f}s")
+    print(f"Throughput: {len(latencies) / elapsed:.1f} req/s")
+    print(f"Latency p50: {np.percentile(ms, 50):.1f} ms, p99: {np.percentile(ms, 99):.1f} ms")
+
+    parsed = urlparse(url)
+    conn = http.client.HTTPConnection(parsed.hostname, parsed.port)
+    conn.request("GET", "/metrics")
+    print(f"Server metrics: {json.loads(conn.getresponse().read())}")
+
+    if server is not None:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
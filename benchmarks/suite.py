@@ -0,0 +1,410 @@
+#!/usr/bin/env python
+"""
+Benchmark Suite
+
+Runs every stage against deterministic synthetic data, with no downloads, and stores the throughputs as JSON. A second
+command compares two result files and exits non-zero when a metric dropped by more than a threshold, so it can gate a
+CI job.
+
+    python -m benchmarks.suite run --out results.json
+    python -m benchmarks.suite compare baseline.json results.json --threshold 0.1
+
+Every metric is a rate, so higher is always better.
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import threading
+import time
+import traceback
+import uuid
+from datetime import datetime, timezone
+from http.server import ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional
+
+import geopandas as gpd
+import numpy as np
+import shapely
+import tensorflow as tf
+
+from benchmarks.bench_sinks import DiscardHandler
+from benchmarks.synthetic import synthetic_geotiff, synthetic_predictions, synthetic_tiles
+from src.model import DTO, SplitEnum
+from src.pipeline.stages.apply_keras_sequential import ApplyKerasSequential, KerasConfig
+from src.pipeline.stages.apply_sliding_window import ApplySlidingWindow, SlidingWindowConfig, load_scene
+from src.pipeline.stages.extract_from_shards import ExtractFromShards, ShardConfig, ShardFormat
+from src.pipeline.stages.filter_tiles import FilterTiles, TileFilterConfig
+from src.pipeline.stages.join_spatial_attributes import JoinSpatialAttributes, JoinSpatialAttributesConfig
+from src.pipeline.stages.load_to_clickhouse import LoadToClickHouse, ClickHouseConfig
+from src.pipeline.stages.load_to_geojson import LoadToGeoJSON
+from src.pipeline.stages.load_to_sqlite import LoadToSQLite, SQLiteConfig
+from src.pipeline.stages.load_to_vector_tiles import LoadToVectorTiles, VectorTileConfig
+from src.pipeline.stages.split_tf_dataset import SplitTFDataset, SplitConfig
+from src.utils.model_cache import ModelCache
+
+# Data sizes per scale. "quick" finishes in about a minute on a laptop, "full" gives steadier numbers.
+SCALES: Dict[str, Dict[str, int]] = {
+    "quick": {"tiles": 2048, "scene": 512, "rows": 20_000},
+    "full": {"tiles": 16384, "scene": 2048, "rows": 200_000},
+}
+
+DEFAULT_THRESHOLD = 0.10
+
+Benchmark = Callable[[Dict[str, int]], Dict[str, float]]
+BENCHMARKS: Dict[str, Benchmark] = {}
+
+
+def benchmark(name: str) -> Callable[[Benchmark], Benchmark]:
+    def register(fn: Benchmark) -> Benchmark:
+        BENCHMARKS[name] = fn
+        return fn
+    return register
+
+
+def rate(count: float, fn: Callable[[], Any]) -> float:
+    start = time.perf_counter()
+    fn()
+    return count / (time.perf_counter() - start)
+
+
+def small_cnn(classes: int = 10) -> List[tf.keras.layers.Layer]:
+    return [
+        tf.keras.layers.Rescaling(1. / 255),
+        tf.keras.layers.Conv2D(16, 3, strides=2, activation="relu"),
+        tf.keras.layers.Conv2D(32, 3, strides=2, activation="relu"),
+        tf.keras.layers.GlobalAveragePooling2D(),
+        tf.keras.layers.Dense(classes, activation="softmax"),
+    ]
+
+
+def trained_dto(tiles: int) -> DTO:
+    """DTO holding a small CNN trained for one epoch on synthetic tiles."""
+    dto = DTO(uuid=uuid.uuid4())
+    dto.class_names = [str(i) for i in range(10)]
+    dto.keras_inputs = tf.keras.Input(shape=(64, 64, 3))
+    dto.split_data = {SplitEnum.TRAIN.value: synthetic_tiles(tiles).batch(32).cache()}
+    stage = ApplyKerasSequential(KerasConfig(epochs=1, use_cache=False),
+                                 [tf.keras.Input(shape=(64, 64, 3))] + small_cnn())
+    return stage.run(dto)
+
+
+@benchmark("split_tf_dataset")
+def bench_split_tf_dataset(scale: Dict[str, int]) -> Dict[str, float]:
+    dto = DTO(uuid=uuid.uuid4())
+    dto.raw_data = synthetic_tiles(scale["tiles"]).cache()
+    # Fill the cache, so the benchmark measures the split and not tile generation.
+    dto.raw_data.reduce(0, lambda count, _: count)
+
+    def split_and_read():
+        split = SplitTFDataset(SplitConfig(size=int(scale["tiles"] * 0.8))).run(dto).split_data
+        for dataset in split.values():
+            dataset.reduce(0, lambda count, _: count)
+
+    return {"elements_per_sec": rate(scale["tiles"], split_and_read)}
+
+
+@benchmark("extract_from_shards")
+def bench_extract_from_shards(scale: Dict[str, int]) -> Dict[str, float]:
+    images, labels = zip(*synthetic_tiles(scale["tiles"]).as_numpy_iterator())
+    shards = 8
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for i, (shard_images, shard_labels) in enumerate(zip(np.array_split(np.stack(images), shards),
+                                                             np.array_split(np.array(labels), shards))):
+            np.save(os.path.join(temp_dir, f"image-{i:05d}.npy"), shard_images)
+            np.save(os.path.join(temp_dir, f"label-{i:05d}.npy"), shard_labels)
+            with tf.io.TFRecordWriter(os.path.join(temp_dir, f"train-{i:05d}.tfrecord")) as writer:
+                for image, label in zip(shard_images, shard_labels):
+                    writer.write(tf.train.Example(features=tf.train.Features(feature={
+                        "image": tf.train.Feature(bytes_list=tf.train.BytesList(
+                            value=[tf.io.serialize_tensor(image).numpy()])),
+                        "label": tf.train.Feature(int64_list=tf.train.Int64List(value=[int(label)])),
+                    })).SerializeToString())
+
+        def read(pattern: str, shard_format: ShardFormat) -> float:
+            dto = ExtractFromShards(ShardConfig(os.path.join(temp_dir, pattern), shard_format=shard_format)).run(
+                DTO(uuid=uuid.uuid4()))
+            return rate(scale["tiles"], lambda: dto.raw_data.reduce(0, lambda count, _: count))
+
+        tfrecord = read("train-*.tfrecord", ShardFormat.TFRECORD)
+        npy = read("image-*.npy", ShardFormat.NPY)
+    # The .npy path skips parsing, so it should keep up with TFRecord
+    return {"tfrecord_elements_per_sec": tfrecord, "npy_elements_per_sec": npy, "npy_to_tfrecord": npy / tfrecord}
+
+
+@benchmark("apply_keras_sequential")
+def bench_apply_keras_sequential(scale: Dict[str, int]) -> Dict[str, float]:
+    dto = trained_dto(scale["tiles"])
+    train = dto.split_data[SplitEnum.TRAIN.value]
+    steps = int(train.cardinality())
+    images = synthetic_tiles(scale["tiles"], seed=1).map(lambda image, _: image).batch(256).cache()
+    dto.keras_model.predict(images.take(1), verbose=0)
+
+    return {
+        "train_steps_per_sec": rate(steps, lambda: dto.keras_model.fit(train, epochs=1, verbose=0)),
+        "predict_tiles_per_sec": rate(scale["tiles"], lambda: dto.keras_model.predict(images, verbose=0)),
+    }
+
+
+def bench_model_cache(scale: Dict[str, int], dedupe: bool) -> Dict[str, float]:
+    model = trained_dto(256).keras_model
+    rounds = max(1, scale["tiles"] // 512)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        cache = ModelCache(temp_dir, dedupe=dedupe)
+
+        def save():
+            for i in range(rounds):
+                cache.save_model(model, [{"class_name": "small_cnn"}], {"round": i}, {"input_shape": [64, 64, 3]})
+
+        def load():
+            for model_hash in list(cache.metadata):
+                if cache.get_model(model_hash) is None:
+                    raise RuntimeError(f"Model {model_hash} failed to load")
+
+        return {"saves_per_sec": rate(rounds, save), "loads_per_sec": rate(rounds, load)}
+
+
+@benchmark("model_cache")
+def bench_model_cache_plain(scale: Dict[str, int]) -> Dict[str, float]:
+    return bench_model_cache(scale, dedupe=False)
+
+
+@benchmark("model_cache_dedupe")
+def bench_model_cache_dedupe(scale: Dict[str, int]) -> Dict[str, float]:
+    return bench_model_cache(scale, dedupe=True)
+
+
+@benchmark("apply_sliding_window")
+def bench_apply_sliding_window(scale: Dict[str, int]) -> Dict[str, float]:
+    model = trained_dto(256).keras_model
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = synthetic_geotiff(os.path.join(temp_dir, "scene.tif"), scale["scene"], scale["scene"])
+        stage = ApplySlidingWindow(SlidingWindowConfig(window=64, stride=32), scene_path=path)
+        scene, _, _ = stage.load_scene(DTO(uuid=uuid.uuid4()))
+        pixels = scene.shape[0] * scene.shape[1]
+        return {"megapixels_per_sec": rate(pixels / 1e6, lambda: stage.predict_cells(model, scene))}
+
+
+@benchmark("filter_tiles")
+def bench_filter_tiles(scale: Dict[str, int]) -> Dict[str, float]:
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = synthetic_geotiff(os.path.join(temp_dir, "scene.tif"), scale["scene"], scale["scene"])
+        scene, _, _ = load_scene(path, DTO(uuid=uuid.uuid4()))
+        stage = FilterTiles(TileFilterConfig(window=64, stride=32, min_brightness=16, min_variance=1.0))
+        pixels = scene.shape[0] * scene.shape[1]
+        return {"megapixels_per_sec": rate(pixels / 1e6, lambda: stage.window_labels(stage.window_stats(scene)))}
+
+
+def predictions_dto(rows: int) -> DTO:
+    dto = DTO(uuid=uuid.uuid4())
+    dto.processed_data = synthetic_predictions(rows)
+    return dto
+
+
+@benchmark("load_to_geojson")
+def bench_load_to_geojson(scale: Dict[str, int]) -> Dict[str, float]:
+    dto = predictions_dto(scale["rows"])
+    with tempfile.TemporaryDirectory() as temp_dir:
+        return {"rows_per_sec": rate(scale["rows"], lambda: LoadToGeoJSON(temp_dir).run(dto))}
+
+
+@benchmark("load_to_sqlite")
+def bench_load_to_sqlite(scale: Dict[str, int]) -> Dict[str, float]:
+    dto = predictions_dto(scale["rows"])
+    with tempfile.TemporaryDirectory() as temp_dir:
+        stage = LoadToSQLite(SQLiteConfig(os.path.join(temp_dir, "predictions.sqlite"),
+                                          columns=["label", "probability"]))
+        return {"rows_per_sec": rate(scale["rows"], lambda: stage.run(dto))}
+
+
+@benchmark("load_to_clickhouse")
+def bench_load_to_clickhouse(scale: Dict[str, int]) -> Dict[str, float]:
+    dto = predictions_dto(scale["rows"])
+    server = ThreadingHTTPServer(("127.0.0.1", 0), DiscardHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        stage = LoadToClickHouse(ClickHouseConfig(
+            table="predictions",
+            columns=[("tile_id", "UInt64"), ("label", "UInt8"), ("probability", "Float32"),
+                     ("lon", "Float64"), ("lat", "Float64")],
+            url=f"http://127.0.0.1:{server.server_address[1]}",
+        ))
+        return {"rows_per_sec": rate(scale["rows"], lambda: stage.run(dto))}
+    finally:
+        server.shutdown()
+
+
+@benchmark("load_to_vector_tiles")
+def bench_load_to_vector_tiles(scale: Dict[str, int]) -> Dict[str, float]:
+    dto = predictions_dto(scale["rows"])
+    with tempfile.TemporaryDirectory() as temp_dir:
+        stage = LoadToVectorTiles(VectorTileConfig(temp_dir, max_zoom=8, cluster_max_zoom=6))
+        return {"rows_per_sec": rate(scale["rows"], lambda: stage.run(dto))}
+
+
+@benchmark("spatial_join")
+def bench_spatial_join(scale: Dict[str, int]) -> Dict[str, float]:
+    dto = predictions_dto(scale["rows"])
+    # A 1 degree grid over the world, about as many polygons as the admin regions of a large country.
+    lon, lat = np.meshgrid(np.arange(-180, 180), np.arange(-85, 85))
+    regions = gpd.GeoDataFrame({"region_id": np.arange(lon.size)},
+                               geometry=shapely.box(lon.ravel(), lat.ravel(), lon.ravel() + 1, lat.ravel() + 1),
+                               crs="EPSG:4326")
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, "regions.geojson")
+        regions.to_file(path, driver="GeoJSON")
+        stage = JoinSpatialAttributes(JoinSpatialAttributesConfig(path, ["region_id"]))
+        stage.load()
+        return {"rows_per_sec": rate(scale["rows"], lambda: stage.run(dto))}
+
+
+def run_suite(scale: str, names: List[str], repeat: int) -> Dict[str, Any]:
+    """
+    Run benchmarks and keep the best of `repeat` runs per metric. A failing benchmark is recorded with its error and
+    does not stop the others.
+
+    Args:
+        scale: Key of SCALES.
+        names: Benchmarks to run.
+        repeat: Runs per benchmark.
+
+    Returns:
+        Result document with run metadata and metrics per benchmark.
+    """
+    results: Dict[str, Any] = {}
+    for name in names:
+        print(f"Running {name}...", flush=True)
+        best: Dict[str, float] = {}
+        try:
+            for _ in range(repeat):
+                for metric, value in BENCHMARKS[name](SCALES[scale]).items():
+                    best[metric] = max(best.get(metric, 0.0), value)
+            results[name] = best
+        except Exception as e:
+            traceback.print_exc()
+            results[name] = {"error": f"{type(e).__name__}: {e}"}
+
+    return {
+        "meta": {
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "scale": scale,
+            "repeat": repeat,
+            "python": platform.python_version(),
+            "tensorflow": tf.__version__,
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "results": results,
+    }
+
+
+def compare_results(baseline: Dict[str, Any], current: Dict[str, Any],
+                    threshold: float = DEFAULT_THRESHOLD) -> List[Dict[str, Any]]:
+    """
+    Compare every metric present in both result documents.
+
+    Args:
+        baseline: Earlier result document.
+        current: Newer result document.
+        threshold: Relative drop, e.g. 0.1 for 10%, beyond which a metric counts as a regression.
+
+    Returns:
+        One row per metric with both values, the relative change and whether it regressed. Benchmarks that errored
+        in the current run are reported as regressions, also when they errored in the baseline too, so a benchmark
+        that never runs can't go unnoticed. Benchmarks that only errored in the baseline are reported, but don't
+        count as regressions.
+    """
+    rows = []
+    for name, metrics in baseline["results"].items():
+        current_metrics = current["results"].get(name)
+        if current_metrics is None:
+            continue
+        if "error" in current_metrics or "error" in metrics:
+            rows.append({"benchmark": name, "metric": "error", "baseline": metrics.get("error"),
+                         "current": current_metrics.get("error"), "change": None,
+                         "regression": "error" in current_metrics})
+            continue
+
+        for metric, value in metrics.items():
+            new_value = current_metrics.get(metric)
+            if metric == "error" or new_value is None or not value:
+                continue
+            change = (new_value - value) / value
+            rows.append({"benchmark": name, "metric": metric, "baseline": value, "current": new_value,
+                         "change": change, "regression": change < -threshold})
+    return rows
+
+
+def print_results(document: Dict[str, Any]) -> None:
+    for name, metrics in document["results"].items():
+        for metric, value in metrics.items():
+            shown = value if isinstance(value, str) else f"{value:14,.2f}"
+            print(f"{name:<26}{metric:<24}{shown}")
+
+
+def print_comparison(rows: List[Dict[str, Any]], threshold: float) -> None:
+    for row in rows:
+        flag = "REGRESSION" if row["regression"] else ""
+        if row["change"] is None:
+            status = f"failed: {row['current']}" if row["current"] is not None else f"fixed, was: {row['baseline']}"
+            print(f"{row['benchmark']:<26}{status:<24}  {flag}")
+            continue
+        print(f"{row['benchmark']:<26}{row['metric']:<24}{row['baseline']:14,.2f}{row['current']:14,.2f}"
+              f"{row['change']:+9.1%}  {flag}")
+
+    regressions = sum(row["regression"] for row in rows)
+    print(f"{regressions} of {len(rows)} metrics regressed by more than {threshold:.0%}")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark Suite")
+    subparsers = parser.add_subparsers(dest="command", help="Command to execute")
+
+    run_parser = subparsers.add_parser("run", help="Run benchmarks and write the results as JSON")
+    run_parser.add_argument("--scale", choices=sorted(SCALES), default="quick", help="Size of the synthetic data")
+    run_parser.add_argument("--only", nargs="+", choices=sorted(BENCHMARKS), help="Benchmarks to run")
+    run_parser.add_argument("--repeat", type=int, default=3, help="Runs per benchmark, the best one is kept")
+    run_parser.add_argument("--out", default="benchmark_results.json", help="Result file")
+
+    compare_parser = subparsers.add_parser("compare", help="Compare two result files and flag regressions")
+    compare_parser.add_argument("baseline", help="Earlier result file")
+    compare_parser.add_argument("current", help="Newer result file")
+    compare_parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                                help="Relative drop that counts as a regression")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "run":
+        document = run_suite(args.scale, args.only or list(BENCHMARKS), args.repeat)
+        with open(args.out, "w") as f:
+            json.dump(document, f, indent=2)
+        print_results(document)
+        print(f"Results written to {args.out}")
+        return 0
+
+    if args.command == "compare":
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        with open(args.current) as f:
+            current = json.load(f)
+
+        if baseline["meta"].get("scale") != current["meta"].get("scale"):
+            print("Warning: the result files were run at different scales")
+        if baseline["meta"].get("cpu_count") != current["meta"].get("cpu_count"):
+            print("Warning: the result files were run on machines with different CPU counts")
+
+        rows = compare_results(baseline, current, args.threshold)
+        print_comparison(rows, args.threshold)
+        return 1 if any(row["regression"] for row in rows) else 0
+
+    parser.print_help()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,78 @@
+"""
+Deterministic synthetic data for benchmarks: labeled RGB tiles, GeoTIFF scenes and prediction tables. The same seed
+always gives the same data, so results are comparable across runs and machines.
+"""
+
+from typing import Any, Dict
+
+import numpy as np
+import rasterio
+import tensorflow as tf
+from rasterio.transform import from_origin
+from shapely.geometry import Point
+
+
+def synthetic_tiles(count: int, size: int = 64, classes: int = 10, seed: int = 0) -> tf.data.Dataset:
+    """
+    Random uint8 RGB tiles with integer labels, shaped like EuroSAT as loaded with as_supervised.
+
+    Args:
+        count: Number of tiles.
+        size: Tile width and height in pixels.
+        classes: Number of labels.
+        seed: Random seed.
+
+    Returns:
+        Dataset of (image, label) pairs.
+    """
+    rng = np.random.default_rng(seed)
+    images = rng.integers(0, 256, (count, size, size, 3), dtype=np.uint8)
+    labels = rng.integers(0, classes, count, dtype=np.int64)
+    return tf.data.Dataset.from_tensor_slices((images, labels))
+
+
+def synthetic_geotiff(path: str, width: int = 1024, height: int = 1024, bands: int = 3, seed: int = 0) -> str:
+    """
+    Write a random uint8 GeoTIFF in UTM zone 32N with 10 m pixels.
+
+    Args:
+        path: Output file.
+        width: Width in pixels.
+        height: Height in pixels.
+        bands: Number of bands.
+        seed: Random seed.
+
+    Returns:
+        The output path.
+    """
+    rng = np.random.default_rng(seed)
+    data = rng.integers(0, 256, (bands, height, width), dtype=np.uint8)
+    with rasterio.open(path, "w", driver="GTiff", width=width, height=height, count=bands, dtype="uint8",
+                       crs="EPSG:32632", transform=from_origin(500000, 5600000, 10, 10),
+                       tiled=True, blockxsize=256, blockysize=256) as dst:
+        dst.write(data)
+    return path
+
+
+def synthetic_predictions(rows: int, seed: int = 0) -> Dict[str, Any]:
+    """
+    Random labeled points with a class probability, in the layout of `dto.processed_data`.
+
+    Args:
+        rows: Number of predictions.
+        seed: Random seed.
+
+    Returns:
+        Column name to values.
+    """
+    rng = np.random.default_rng(seed)
+    lon = rng.uniform(-180, 180, rows)
+    lat = rng.uniform(-85, 85, rows)
+    return {
+        "tile_id": np.arange(rows, dtype=np.uint64),
+        "label": rng.integers(0, 10, rows).astype(np.uint8),
+        "probability": rng.random(rows, dtype=np.float32),
+        "lon": lon,
+        "lat": lat,
+        "geometry": [Point(x, y) for x, y in zip(lon, lat)],
+    }
@@ -47,6 +47,9 @@ def main():
     
     # Info command
     info_parser = subparsers.add_parser('info', help='Show detailed information about the cache')
+
+    # Prune command
+    prune_parser = subparsers.add_parser('prune', help='Delete weight chunks no longer used by any model')
     
     # Parse arguments
     args = parser.parse_args()
@@ -73,25 +76,25 @@ def main():
         else:
             logging.error(f"Failed to delete model {args.model_hash}")
     
+    elif args.command == 'prune':
+        cache = ModelCache(args.cache_dir)
+        deleted = cache.prune_chunks()
+        logging.info(f"Pruned {deleted} unused weight chunks")
+    
     elif args.command == 'info':
         cache = ModelCache(args.cache_dir)
         models = list_cached_models(args.cache_dir)
         
         # Calculate storage usage
-        total_size = 0
-        for model_hash in cache.metadata:
-            model_path = cache.get_model_path(model_hash)
-            if os.path.exists(model_path):
-                total_size += sum(
-                    os.path.getsize(os.path.join(dirpath, filename))
-                    for dirpath, _, filenames in os.walk(model_path)
-                    for filename in filenames
-                )
+        stats = cache.get_storage_stats()
         
         # Print cache information
         print(f"Cache directory: {args.cache_dir}")
         print(f"Total models: {len(models)}")
-        print(f"Total storage: {total_size / (1024*1024):.2f} MB")
+        print(f"Total storage: {stats['disk_bytes'] / (1024*1024):.2f} MB")
+        if stats["chunks"]:
+            print(f"Weight chunks: {stats['chunks']} "
+                  f"({stats['logical_bytes'] / (1024*1024):.2f} MB before deduplication)")
         
     else:
         # No command specified, show help
@@ -13,6 +13,7 @@ from src.pipeline.stages.apply_keras_sequential import ApplyKerasSequential, Ker
 from src.pipeline.stages.extract_from_tensorflow import ExtractFromTensorFlow, DatasetSplit
 from src.pipeline.pipeline import Pipeline
 from src.pipeline.stages.split_tf_dataset import SplitTFDataset, SplitConfig
+from src.utils.model_cache import ModelCache
 
 
 def main():
@@ -30,21 +31,23 @@ def main():
                                                    weights='imagenet')
     base_model.trainable = False
 
+    split_config = SplitConfig(
+        batch=32,
+        shuffle=1024,
+        train_ratio=0.8,
+        valid_ratio=0.2
+    )
+    extract = ExtractFromTensorFlow(name="eurosat/rgb", split=DatasetSplit.TRAIN, with_info=True, as_supervised=True)
+    # Load training and validation as the 80% / 20% TFDS slices of the train split, so each only reads its own shards.
+    # Before, training took the first 20000 examples and validation the remaining ones.
+    extract.push_split(split_config.train_ratio, split_config.valid_ratio)
+
     # Define an ETL pipeline for image classification with EuroSAT dataset
     es_pipe = Pipeline(
         stages=[
-            ExtractFromTensorFlow(name="eurosat/rgb", split=DatasetSplit.TRAIN, with_info=True, as_supervised=True),
-            # Split the dataset into training and validation sets
-            SplitTFDataset(
-                config=SplitConfig(
-                    batch=32,
-                    count=20000,
-                    shuffle=1024,
-                    size=20000,
-                    train_ratio=0.8,
-                    valid_ratio=0.2
-                )
-            ),
+            extract,
+            # Batch the training and validation slices loaded by the extractor
+            SplitTFDataset(config=split_config),
             # Train the model with Keras, with caching enabled
             ApplyKerasSequential(
                 config=KerasConfig(
@@ -62,8 +65,8 @@ def main():
                     tf.keras.layers.Dense(128, activation='relu'),
                     tf.keras.layers.Dense(len(dto.class_names), activation='softmax')
                 ],
-                # Optionally specify a custom cache directory
-                cache_dir=os.path.join(os.path.dirname(__file__), "model_cache")
+                # Store weights as deduplicated chunks so every cached head shares one copy of the frozen backbone
+                model_cache=ModelCache(os.path.join(os.path.dirname(__file__), "model_cache"), dedupe=True)
             ),
         ]
     )
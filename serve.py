@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+"""
+Prediction Server
+
+Serves predictions from models in the model cache over HTTP, coalescing concurrent requests into micro-batches.
+"""
+
+import os
+import argparse
+import logging
+
+from src.serving.server import PredictionService, make_server
+from src.utils.model_cache import ModelCache
+
+
+def main():
+    """Run the prediction server."""
+    parser = argparse.ArgumentParser(description="Prediction Server")
+    parser.add_argument(
+        "--cache-dir",
+        default=os.path.join(os.path.dirname(__file__), "model_cache"),
+        help="Directory where models are cached"
+    )
+    parser.add_argument("--host", default="127.0.0.1", help="Interface to bind to")
+    parser.add_argument("--port", type=int, default=8080, help="Port to bind to")
+    parser.add_argument("--max-batch-size", type=int, default=32, help="Maximum rows per model call")
+    parser.add_argument("--max-wait-ms", type=float, default=5.0, help="Maximum time a request waits to be batched")
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s'
+    )
+
+    service = PredictionService(ModelCache(args.cache_dir),
+                                max_batch_size=args.max_batch_size,
+                                max_wait_ms=args.max_wait_ms)
+    server = make_server(service, args.host, args.port)
+    logging.info(f"Serving models from {args.cache_dir} on http://{args.host}:{args.port}")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+
+
+if __name__ == "__main__":
+    main()
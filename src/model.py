@@ -1,10 +1,15 @@
 import uuid
 from enum import Enum
-from typing import Any, Dict, Optional
+from typing import Any, Dict, Optional, Tuple
 import tensorflow as tf
 import keras
 from tensorflow.python.types.data import DatasetV2
 
+from src.utils.memory import estimate_size
+
+# CRS of the geometries in processed_data when the DTO does not name one.
+DEFAULT_CRS = "EPSG:4326"
+
 
 class SplitEnum(Enum):
     """
@@ -29,8 +34,34 @@ class DTO:
         keras_base_model (tf.keras.Model): The base Keras model to be used for training.
         keras_inputs (tf.keras.Input): The inputs for the Keras model.
         processed_data (Any): Data to be loaded into the data sink.
+        prediction_raster (np.ndarray): Per-cell class map of a scene classified with sliding windows.
+        model_hash (str): Model cache hash of keras_model, when it was loaded from or saved to the model cache.
+        crs (str): CRS of the geometries in processed_data, e.g. "EPSG:32633". None means DEFAULT_CRS.
+        window_labels (np.ndarray): Per-window class decided before sliding-window inference, -1 where the model runs.
+
+    The DTO uses `__slots__`, so only the attributes above can be set. Fields in `TRANSIENT_FIELDS` are intermediate
+    results: the pipeline releases them once the last stage that consumes them has run, so datasets and the resources
+    behind them don't stay alive for the rest of the run.
     """
 
+    __slots__ = (
+        "run_id",
+        "raw_data",
+        "class_names",
+        "split_data",
+        "keras_base_model",
+        "keras_inputs",
+        "keras_model",
+        "processed_data",
+        "prediction_raster",
+        "model_hash",
+        "crs",
+        "window_labels",
+    )
+
+    # Fields that are only inputs to later stages and can be dropped once no remaining stage reads them.
+    TRANSIENT_FIELDS: Tuple[str, ...] = ("raw_data", "split_data", "keras_base_model", "keras_inputs", "window_labels")
+
     def __init__(self,
                  uuid: uuid.UUID,
                  raw_data: tf.data.Dataset = None,
@@ -47,6 +78,25 @@ class DTO:
         self.keras_inputs: Optional[keras.Input] = None
         self.keras_model: Optional[keras.Model] = None
         self.processed_data = None
+        self.prediction_raster = None
+        self.model_hash: Optional[str] = None
+        self.crs: Optional[str] = None
+        self.window_labels = None
+
+    def release(self, *fields: str) -> None:
+        """
+        Drops the references held by the given fields.
+        :param fields: Names of the fields to reset to None.
+        """
+        for field in fields:
+            setattr(self, field, None)
+
+    def memory_report(self) -> Dict[str, int]:
+        """
+        Estimates the memory held by each field.
+        :return: Mapping of field name to estimated size in bytes.
+        """
+        return {field: estimate_size(getattr(self, field)) for field in self.__slots__}
 
 
 class SkipStageError(Exception):
@@ -65,3 +115,21 @@ class SkipPipelineError(Exception):
 
     def __init__(self, message: str):
         super().__init__(message)
+
+
+class StageTimeoutError(Exception):
+    """
+    Exception raised when a stage exceeds its wall-clock timeout.
+    """
+
+    def __init__(self, message: str):
+        super().__init__(message)
+
+
+class CircuitOpenError(SkipStageError):
+    """
+    Exception raised instead of running a stage whose circuit breaker is open. The pipeline skips the stage.
+    """
+
+    def __init__(self, message: str):
+        super().__init__(message)
@@ -0,0 +1,114 @@
+from typing import Any, List, Optional, Iterable
+from concurrent.futures import Executor
+import asyncio
+import contextvars
+import functools
+import inspect
+
+from src.model import DTO, SkipPipelineError, SkipStageError
+from src.pipeline.pipeline import Pipeline, Option
+from src.pipeline.stage import Stage
+from src.utils.tracing import CATEGORY_STAGE
+from src.pipeline.stages.fan_out import FanOut
+
+# Default number of DTOs processed concurrently by AsyncPipeline.run_many.
+DEFAULT_CONCURRENCY = 8
+
+
+class AsyncPipeline(Pipeline):
+    """
+    Pipeline runner for an asyncio event loop.
+
+    Stages that define an `async def run_async(self, dto)` hook are awaited directly, all other stages run in an
+    executor so blocking I/O does not stall the loop. `FanOut` branches run concurrently, and `run_many` processes
+    many DTOs in one loop with a concurrency limit.
+    """
+
+    def __init__(self, stages: List[Stage], *options: Option):
+        self.executor: Optional[Executor] = None
+        self.concurrency = DEFAULT_CONCURRENCY
+        super().__init__(stages, *options)
+
+    async def run_async(self, dto: DTO) -> DTO:
+        """
+        Runs the pipeline for a single DTO.
+        :param dto: Data transfer object (DTO) for the data pipeline.
+        :return: DTO
+        """
+        release_plan = self.release_plan()
+        run_name = self.run_name(dto)
+        self.trace_start()
+
+        try:
+            for i, s in enumerate(self.stages):
+                dto = await self._run_stage_async(s, dto)
+                self.after_stage(s, dto, release_plan[i])
+        finally:
+            self.trace_stop(run_name)
+
+        return dto
+
+    async def run_many(self, dtos: Iterable[DTO], return_exceptions: bool = False) -> List[Any]:
+        """
+        Runs the pipeline for many DTOs concurrently, at most `concurrency` at a time.
+        :param dtos: DTOs to process.
+        :param return_exceptions: Return failures in place of their DTO instead of raising the first one.
+        :return: The resulting DTOs, in input order.
+        """
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def bounded(dto: DTO) -> DTO:
+            async with semaphore:
+                return await self.run_async(dto)
+
+        return await asyncio.gather(*(bounded(dto) for dto in dtos), return_exceptions=return_exceptions)
+
+    async def _run_stage_async(self, s: Stage, dto: DTO) -> DTO:
+        """
+        Runs a single stage with the same skip semantics as `Pipeline.run`.
+        :param s: Stage to run.
+        :param dto: Input DTO.
+        :return: Output DTO, or the input DTO if the stage was skipped.
+        """
+        try:
+            if isinstance(s, FanOut):
+                await asyncio.gather(*(self._run_stage_async(branch, dto) for branch in s.stages))
+                return dto
+
+            run_async = getattr(s, "run_async", None)
+            if inspect.iscoroutinefunction(run_async):
+                with self.trace_span(s.__class__.__name__, CATEGORY_STAGE):
+                    return await run_async(dto)
+
+            # Executors don't carry the context over, which holds this run's trace
+            run_stage = functools.partial(contextvars.copy_context().run, self.run_stage, s, dto)
+            return await asyncio.get_running_loop().run_in_executor(self.executor, run_stage)
+        except SkipStageError as e:
+            self.log(f"Hiccup, skipping stage {s.__class__.__name__}: {e}")
+            return dto
+        except SkipPipelineError as e:
+            self.log(f"Show stopper! Skipping pipeline: {e}")
+            raise e
+
+
+def with_executor(executor: Executor) -> Option:
+    """
+    Sets the executor blocking stages run in. Defaults to the event loop's default thread pool.
+    :param executor: Executor for synchronous stages.
+    """
+    def option(instance: AsyncPipeline) -> None:
+        instance.executor = executor
+    return option
+
+
+def with_concurrency(limit: int) -> Option:
+    """
+    Sets how many DTOs `AsyncPipeline.run_many` processes at the same time.
+    :param limit: Maximum number of concurrent pipeline runs.
+    """
+    if limit < 1:
+        raise ValueError("Concurrency limit must be at least 1.")
+
+    def option(instance: AsyncPipeline) -> None:
+        instance.concurrency = limit
+    return option
@@ -0,0 +1,132 @@
+from typing import Any, Dict, Iterable, List, Optional
+import hashlib
+import json
+import os
+import time
+
+# Bump when the layout of the manifest file changes, so old manifests are ignored instead of misread.
+MANIFEST_VERSION = 1
+
+# Read size when hashing input files.
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def content_hash(path: str) -> str:
+    """
+    SHA-256 of a file's contents, read in blocks so large scenes don't have to fit in memory.
+    :param path: File to hash.
+    :return: Hex digest.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class RunManifest:
+    """
+    Remembers which inputs earlier runs processed, so repeat runs over a growing archive only process the delta.
+
+    Every input is recorded with its size, modification time and content hash, plus the hash of the model it was
+    processed with. An input is unchanged while its size and modification time match, without reading it. When they
+    differ, e.g. after a copy that touched the file, the content hash decides, so only inputs whose bytes changed are
+    processed again.
+
+    The manifest is one JSON file, replaced atomically on every update.
+    """
+
+    def __init__(self, path: str):
+        """
+        :param path: JSON file holding the manifest. Created on the first record.
+        """
+        self.path = path
+        self.entries: Dict[str, Dict[str, Any]] = self.read()
+        # Fingerprints computed by `changed`, reused by `record` so no input is hashed twice in one run
+        self._fingerprints: Dict[str, Dict[str, Any]] = {}
+
+    def read(self) -> Dict[str, Dict[str, Any]]:
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, "r") as f:
+                manifest = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable run manifest {self.path}: {e}")
+            return {}
+        if manifest.get("version") != MANIFEST_VERSION:
+            print(f"Ignoring run manifest {self.path} with version {manifest.get('version')}")
+            return {}
+        return manifest["inputs"]
+
+    def write(self) -> None:
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump({"version": MANIFEST_VERSION, "inputs": self.entries}, f, indent=2, sort_keys=True)
+        os.replace(temp_path, self.path)
+
+    def fingerprint(self, path: str) -> Dict[str, Any]:
+        """
+        Size, modification time and content hash of an input. The recorded hash is reused while size and
+        modification time are unchanged.
+        :param path: Input file.
+        :return:
+        """
+        key = os.path.abspath(path)
+        stat = os.stat(key)
+        fingerprint = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+        entry = self.entries.get(key)
+        if entry is not None and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+            fingerprint["sha256"] = entry["sha256"]
+        else:
+            fingerprint["sha256"] = content_hash(key)
+        return fingerprint
+
+    def is_changed(self, path: str, model_hash: Optional[str] = None) -> bool:
+        """
+        Whether an input is new, has changed, or was processed with another model.
+        :param path: Input file.
+        :param model_hash: Hash of the model the input would be processed with. None matches any model.
+        :return:
+        """
+        key = os.path.abspath(path)
+        fingerprint = self.fingerprint(key)
+        self._fingerprints[key] = fingerprint
+
+        entry = self.entries.get(key)
+        if entry is None or entry["sha256"] != fingerprint["sha256"]:
+            return True
+        return model_hash is not None and entry.get("model_hash") != model_hash
+
+    def changed(self, paths: Iterable[str], model_hash: Optional[str] = None) -> List[str]:
+        """
+        The inputs that need processing: new, changed, or processed with another model.
+        :param paths: Input files.
+        :param model_hash: Hash of the model the inputs would be processed with. None matches any model.
+        :return: The inputs to process, in the given order.
+        """
+        return [path for path in paths if self.is_changed(path, model_hash)]
+
+    def record(self, paths: Iterable[str], model_hash: Optional[str] = None) -> None:
+        """
+        Record inputs as processed and write the manifest.
+        :param paths: Processed input files.
+        :param model_hash: Hash of the model they were processed with.
+        """
+        processed_at = time.time()
+        for path in paths:
+            key = os.path.abspath(path)
+            fingerprint = self._fingerprints.pop(key, None) or self.fingerprint(key)
+            self.entries[key] = {**fingerprint, "model_hash": model_hash, "processed_at": processed_at}
+        self.write()
+
+    def forget(self, paths: Iterable[str]) -> None:
+        """
+        Drop inputs from the manifest, so the next run processes them again.
+        :param paths: Input files.
+        """
+        for path in paths:
+            self.entries.pop(os.path.abspath(path), None)
+        self.write()
@@ -1,41 +1,509 @@
-from typing import Any, List, Dict, TypeVar, Callable, Optional
+from typing import Any, List, Dict, TypeVar, Callable, Optional, Iterable, Iterator
+from concurrent.futures import ProcessPoolExecutor, Future, wait, FIRST_COMPLETED
+import collections
+import contextlib
+import contextvars
 import logging
+import multiprocessing
+import os
+import queue
+import threading
+import time
+import uuid
 
 from numpy.f2py.auxfuncs import throw_error
 
 from src.model import DTO, SkipPipelineError, SkipStageError
+from src.utils.memory import format_memory_report
 from src.pipeline.stage import Stage
+from src.pipeline.stages.fan_out import FanOut
+from src.pipeline.policy import StagePolicy, RetryPolicy, CircuitBreaker
+from src.utils.tracing import Tracer, CATEGORY_RUN, CATEGORY_STAGE
+from src.pipeline.manifest import RunManifest
+from src.pipeline.resources import ResourceConfig, ResourceRegistry, apply_dataset_options, available_cpus, pinned, \
+    set_affinity
 
 # Functional option pattern in Python!
 T = TypeVar("T", bound="Pipeline")
 
 Option = Callable[[T], None]
 
+# Default number of DTO chunks buffered between two stages in streaming mode.
+DEFAULT_QUEUE_DEPTH = 4
+
+# How often blocked streaming workers wake up to check whether the stream was cancelled, in seconds.
+STREAM_POLL_INTERVAL = 0.1
+
+# Marks the end of a chunk stream on a queue.
+_END_OF_STREAM = object()
+
+# Number of DTOs submitted per worker ahead of the results being consumed in Pipeline.map.
+DEFAULT_MAP_PREFETCH = 2
+
+
+class MapStats:
+    """
+    Aggregate statistics of a `Pipeline.map` run.
+
+    Attributes:
+        workers (int): Number of worker processes.
+        completed (int): Number of DTOs that ran through the pipeline successfully.
+        failed (int): Number of DTOs whose pipeline run raised.
+        elapsed (float): Wall-clock seconds from the first submission to the last result.
+    """
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self.completed = 0
+        self.failed = 0
+        self.elapsed = 0.0
+
+    @property
+    def throughput(self) -> float:
+        """Completed DTOs per second."""
+        return self.completed / self.elapsed if self.elapsed > 0 else 0.0
+
+
 class Pipeline:
     def __init__(self, stages: List[Stage], *options:Option):
         self.stages = stages
         self.logger: Optional[logging.Logger] = None
+        self.queue_depth = DEFAULT_QUEUE_DEPTH
+        self.map_stats: Optional[MapStats] = None
+        self.policies: Dict[Stage, StagePolicy] = {}
+        self.memory_report_level: Optional[int] = None
+        self.tracer: Optional[Tracer] = None
+        self.resources: Dict[Stage, ResourceConfig] = {}
+        self.process_resources: Optional[ResourceConfig] = None
+        self.resource_registry: Optional[ResourceRegistry] = None
+        self.manifest: Optional[RunManifest] = None
+        self.manifest_extractor: Optional[Stage] = None
+        self.manifest_model_hash: Optional[str] = None
+
+        for option in options:
+            option(self)
 
     def run(self, dto: DTO) -> DTO:
         """
         Runs the pipeline.
         :return: None
         """
-        # For each stage in the pipline
-        for s in self.stages:
+        release_plan = self.release_plan()
+        run_name = self.run_name(dto)
+        self.trace_start()
+        self.register_resources(self.process_resources.planned_threads() if self.process_resources else None)
+
+        try:
+            inputs = self.select_inputs()
+            # Stages that raised SkipStageError, so the run's inputs aren't recorded as processed
+            skipped: List[Stage] = []
+            with self.trace_span(run_name, CATEGORY_RUN):
+                # For each stage in the pipline
+                for i, s in enumerate(self.stages):
+                    try:
+                        # Note that we replace the DTO at each pipeline stage. We can use this for playback by
+                        # persisting the DTO at each stage along with the stage name.
+                        if isinstance(s, FanOut):
+                            skipped.extend(self.run_fan_out(s, dto))
+                        else:
+                            dto = self.run_stage(s, dto)
+                        self.apply_process_dataset_options(dto)
+                    except SkipStageError as e:
+                        self.log(f"Hiccup, skipping stage {s.__class__.__name__}: {e}")
+                        skipped.append(s)
+                    except SkipPipelineError as e:
+                        self.log(f"Show stopper! Skipping pipeline: {e}")
+                        raise e # Send to the error handler in main.
+
+                    self.after_stage(s, dto, release_plan[i])
+
+            self.record_inputs(inputs, dto, skipped)
+        finally:
+            self.trace_stop(run_name)
+            self.unregister_resources()
+
+        return dto
+
+    def run_stream(self, dtos: Iterable[DTO]) -> Iterator[DTO]:
+        """
+        Runs the pipeline in streaming mode over an iterable of DTO chunks.
+
+        Every stage runs in its own thread and consumes the chunks of the previous stage through a bounded queue, so
+        extraction, inference and loading overlap and at most `queue_depth` chunks wait between any two stages. A slow
+        stage blocks its producers (backpressure) instead of letting chunks pile up in memory.
+        :param dtos: DTO chunks to feed into the first stage. Consumed lazily.
+        :return: Iterator over the DTO chunks produced by the last stage, in order.
+        """
+        stop = threading.Event()
+        errors: List[BaseException] = []
+        queues = [queue.Queue(maxsize=self.queue_depth) for _ in range(len(self.stages) + 1)]
+        release_plan = self.release_plan()
+
+        run_name = self.run_name(None)
+        self.trace_start()
+
+        # Workers run in copies of this context, so their spans land in this run's trace.
+        workers = [threading.Thread(target=contextvars.copy_context().run,
+                                    args=(self._feed_stream, dtos, queues[0], stop, errors), daemon=True)]
+        for i, s in enumerate(self.stages):
+            workers.append(threading.Thread(target=contextvars.copy_context().run,
+                                            args=(self._run_stream_stage, s, release_plan[i], queues[i],
+                                                  queues[i + 1], stop, errors),
+                                            name=f"pipeline-{s.__class__.__name__}",
+                                            daemon=True))
+        for w in workers:
+            w.start()
+
+        try:
+            yield from self._drain(queues[-1], stop)
+        finally:
+            # Unblock every worker, whether we finished, failed or the consumer stopped early.
+            stop.set()
+            for w in workers:
+                w.join()
+            self.trace_stop(run_name)
+
+        if errors:
+            raise errors[0]
+
+    def release_plan(self) -> List[List[str]]:
+        """
+        Works out which transient DTO fields can be released after each stage.
+
+        A field is released after the last stage that consumes it. Stages that don't declare `consumes` might read
+        anything, so nothing is released before they have run.
+        :return: For every stage, the fields to release once it has run.
+        """
+        plan: List[List[str]] = [[] for _ in self.stages]
+        needed_later = set()
+
+        for i in reversed(range(len(self.stages))):
+            consumes = getattr(self.stages[i], "consumes", None)
+            if not isinstance(consumes, tuple):
+                break
+            plan[i] = [f for f in DTO.TRANSIENT_FIELDS if f in consumes and f not in needed_later]
+            needed_later.update(consumes)
+
+        return plan
+
+    def after_stage(self, s: Stage, dto: DTO, release: List[str]) -> None:
+        """
+        Releases fields no later stage needs and logs the DTO memory report, if enabled.
+        :param s: Stage that just ran.
+        :param dto: Data transfer object (DTO) for the data pipeline.
+        :param release: Fields to release.
+        """
+        if not isinstance(dto, DTO):
+            return
+
+        if release:
+            dto.release(*release)
+
+        if self.memory_report_level is not None:
+            self.log(f"DTO after {s.__class__.__name__}: {format_memory_report(dto.memory_report())}",
+                     self.memory_report_level)
+
+    def apply_process_dataset_options(self, dto: DTO) -> None:
+        """
+        Applies the process tf.data options to the datasets in the DTO. Runs after every stage, because the datasets
+        only exist once the extractor has created them, and later stages may replace them.
+        :param dto: Data transfer object (DTO) for the data pipeline.
+        """
+        if self.process_resources is None or not isinstance(dto, DTO):
+            return
+        options = self.process_resources.dataset_options()
+        if options is not None:
+            apply_dataset_options(dto, options)
+
+    def run_stage(self, s: Stage, dto: DTO) -> DTO:
+        """
+        Runs a single stage under its retry, timeout and circuit breaker policy, if one is configured.
+        :param s: Stage to run.
+        :param dto: Data transfer object (DTO) for the data pipeline.
+        :return: DTO
+        """
+        resources = self.resources.get(s)
+        if resources is not None and isinstance(dto, DTO):
+            options = resources.dataset_options()
+            if options is not None:
+                apply_dataset_options(dto, options)
+
+        with self.trace_span(s.__class__.__name__, CATEGORY_STAGE), pinned(resources.cpus if resources else None):
+            policy = self.policies.get(s)
+            if policy is None:
+                return s.run(dto)
+            return policy.call(s, dto, self.log)
+
+    def run_fan_out(self, fan_out: FanOut, dto: DTO) -> List[Stage]:
+        """
+        Runs the branches of a FanOut one after another, each under its own policy, so a branch with a circuit
+        breaker or retries behaves as it would as a stage of its own. A skipped branch does not stop the others.
+        :param fan_out: FanOut stage.
+        :param dto: Data transfer object (DTO) for the data pipeline. Shared by the branches.
+        :return: The skipped branches.
+        """
+        skipped: List[Stage] = []
+        with self.trace_span(fan_out.__class__.__name__, CATEGORY_STAGE):
+            for branch in fan_out.stages:
+                try:
+                    if isinstance(branch, FanOut):
+                        skipped.extend(self.run_fan_out(branch, dto))
+                    else:
+                        self.run_stage(branch, dto)
+                except SkipStageError as e:
+                    self.log(f"Hiccup, skipping branch {branch.__class__.__name__}: {e}")
+                    skipped.append(branch)
+        return skipped
+
+    def select_inputs(self) -> Optional[List[str]]:
+        """
+        Restricts the extractor to the inputs the manifest has not seen, or saw with another model. Only active once
+        with_manifest configured a manifest.
+        :return: The selected inputs, or None without a manifest.
+        """
+        if self.manifest is None:
+            return None
+
+        inputs = self.manifest_extractor.inputs()
+        changed = self.manifest.changed(inputs, self.manifest_model_hash)
+        self.log(f"Run manifest: {len(changed)} of {len(inputs)} inputs are new or changed")
+        if not changed:
+            raise SkipPipelineError(f"All {len(inputs)} inputs are unchanged since the last run.")
+
+        self.manifest_extractor.select_inputs(changed)
+        return changed
+
+    def record_inputs(self, inputs: Optional[List[str]], dto: DTO, skipped: List[Stage]) -> None:
+        """
+        Records the inputs of a successful run in the manifest, with the hash of the model that processed them. A run
+        with skipped stages, e.g. a sink that was unreachable or behind an open circuit breaker, did not process its
+        inputs fully, so they stay unrecorded and the next run selects them again.
+        :param inputs: Inputs selected for the run.
+        :param dto: Data transfer object (DTO) for the data pipeline.
+        :param skipped: Stages skipped in the run.
+        """
+        if self.manifest is None or inputs is None:
+            return
+        if skipped:
+            self.log(f"Run manifest: not recording {len(inputs)} inputs, skipped "
+                     f"{', '.join(s.__class__.__name__ for s in skipped)}")
+            return
+        self.manifest.record(inputs, getattr(dto, "model_hash", None) or self.manifest_model_hash)
+
+    def register_resources(self, threads: Optional[int]) -> None:
+        """
+        Announces the threads this process plans to use and warns when the processes on this host together plan
+        more threads than there are CPUs. Only active once with_resources configured a registry.
+        :param threads: Planned busy threads of this process.
+        """
+        if self.resource_registry is None or threads is None:
+            return
+        self.resource_registry.register(threads)
+        warning = self.resource_registry.oversubscription()
+        if warning is not None:
+            self.log(f"CPU oversubscription: {warning}", logging.WARNING)
+
+    def unregister_resources(self) -> None:
+        if self.resource_registry is not None:
+            self.resource_registry.unregister()
+
+    @staticmethod
+    def run_name(dto: Optional[DTO]) -> str:
+        """
+        Names a run after its DTO, or uniquely for runs over many DTOs.
+        :param dto: DTO of a single run.
+        :return: Run name.
+        """
+        run_id = getattr(dto, "run_id", None)
+        return str(run_id) if run_id is not None else uuid.uuid4().hex
+
+    def trace_start(self) -> None:
+        """
+        Starts recording a run, if tracing is enabled and the run is sampled.
+        """
+        if self.tracer is not None:
+            self.tracer.start()
+
+    def trace_stop(self, run_name: str) -> None:
+        """
+        Stops recording a run and writes its trace.
+        :param run_name: Name of the run.
+        """
+        if self.tracer is None:
+            return
+        path = self.tracer.stop(run_name)
+        if path is not None:
+            self.log(f"Trace written to {path}")
+
+    def trace_span(self, name: str, category: str):
+        """
+        Records a span of the current run, or does nothing if the run is not traced.
+        :param name: Span name.
+        :param category: Span category.
+        """
+        if self.tracer is None:
+            return contextlib.nullcontext()
+        return self.tracer.span(name, category)
+
+    def map(self,
+            dtos: Iterable[DTO],
+            workers: Optional[int] = None,
+            ordered: bool = True,
+            return_exceptions: bool = False,
+            prefetch: int = DEFAULT_MAP_PREFETCH,
+            mp_context: Optional[multiprocessing.context.BaseContext] = None) -> Iterator[Any]:
+        """
+        Runs the pipeline over many DTOs in a pool of worker processes.
+
+        The stages are pickled and sent to every worker once, when the worker starts. Each worker then runs all of its
+        DTOs through the same stage instances, so state kept on a stage (loaded models, dataset builders) is reused
+        across DTOs. Only `workers * prefetch` DTOs are in flight at any time, so `dtos` may be a lazy generator over
+        thousands of scenes. Aggregate throughput is logged at the end and kept in `map_stats`.
+        :param dtos: DTOs to process. Consumed lazily.
+        :param workers: Number of worker processes. Defaults to the number of CPUs.
+        :param ordered: Yield results in input order. If False, yield them as they complete.
+        :param return_exceptions: Yield failures in place of their DTO instead of raising the first one.
+        :param prefetch: DTOs submitted per worker ahead of consumption.
+        :param mp_context: Multiprocessing context. Defaults to "spawn", as TensorFlow is not fork-safe.
+        :return: Iterator over the resulting DTOs.
+        """
+        workers = workers or os.cpu_count() or 1
+        stats = MapStats(workers)
+        self.map_stats = stats
+
+        # Without resources, every worker sizes TensorFlow's pools to all cores.
+        default_threads = ResourceConfig().planned_threads()
+        planned = sum(self.process_resources.for_worker(i, workers).planned_threads()
+                      if self.process_resources else default_threads for i in range(workers))
+        if planned > len(available_cpus()):
+            self.log(f"CPU oversubscription: {workers} map workers plan {planned} busy threads on "
+                     f"{len(available_cpus())} CPUs. Configure with_resources to split the CPUs between them.",
+                     logging.WARNING)
+        self.register_resources(planned)
+        context = mp_context or multiprocessing.get_context("spawn")
+        worker_counter = context.Value("i", 0)
+
+        dtos = iter(dtos)
+        pending: collections.deque = collections.deque()
+        start = time.perf_counter()
+
+        with ProcessPoolExecutor(max_workers=workers,
+                                 mp_context=context,
+                                 initializer=_init_map_worker,
+                                 initargs=(self.stages, self.policies, self.process_resources, worker_counter,
+                                           workers)) as executor:
+            try:
+                while True:
+                    while len(pending) < workers * prefetch:
+                        dto = next(dtos, _END_OF_STREAM)
+                        if dto is _END_OF_STREAM:
+                            break
+                        pending.append(executor.submit(_run_map_worker, dto))
+
+                    if not pending:
+                        break
+
+                    if ordered:
+                        future = pending.popleft()
+                    else:
+                        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                        future = done.pop()
+                        pending.remove(future)
+
+                    yield self._map_result(future, stats, return_exceptions)
+            finally:
+                for future in pending:
+                    future.cancel()
+                stats.elapsed = time.perf_counter() - start
+                self.unregister_resources()
+                self.log(f"Mapped {stats.completed} DTOs ({stats.failed} failed) on {stats.workers} workers in "
+                         f"{stats.elapsed:.2f}s, {stats.throughput:.2f} DTOs/s")
+
+    @staticmethod
+    def _map_result(future: Future, stats: MapStats, return_exceptions: bool) -> Any:
+        try:
+            result = future.result()
+        except Exception as e:
+            stats.failed += 1
+            if not return_exceptions:
+                raise e
+            return e
+
+        stats.completed += 1
+        return result
+
+    def _stage_stream(self, s: Stage, chunks: Iterator[DTO], release: List[str]) -> Iterator[DTO]:
+        """
+        Returns the output stream of a stage, applying the same skip semantics as `run` to stages that do not
+        implement their own `run_stream`.
+        :param s: Stage to run.
+        :param chunks: Input chunks.
+        :param release: Fields to release from every output chunk.
+        :return: Output chunks.
+        """
+        if getattr(type(s), "run_stream", Stage.run_stream) is not Stage.run_stream:
+            for dto in s.run_stream(chunks):
+                self.after_stage(s, dto, release)
+                yield dto
+            return
+
+        for dto in chunks:
             try:
-                # Note that we replace the DTO at each pipeline stage. We can use this for playback by persisting the
-                # DTO at each stage along with the stage name.
-                dto = s.run(dto)
+                dto = self.run_stage(s, dto)
             except SkipStageError as e:
                 self.log(f"Hiccup, skipping stage {s.__class__.__name__}: {e}")
-                continue
             except SkipPipelineError as e:
                 self.log(f"Show stopper! Skipping pipeline: {e}")
-                raise e # Send to the error handler in main.
+                raise e
+            self.after_stage(s, dto, release)
+            yield dto
 
-        return dto
+    def _feed_stream(self, dtos: Iterable[DTO], out: queue.Queue, stop: threading.Event,
+                     errors: List[BaseException]) -> None:
+        try:
+            for dto in dtos:
+                if not self._put(out, dto, stop):
+                    return
+            self._put(out, _END_OF_STREAM, stop)
+        except BaseException as e:
+            errors.append(e)
+            stop.set()
 
+    def _run_stream_stage(self, s: Stage, release: List[str], inp: queue.Queue, out: queue.Queue,
+                          stop: threading.Event, errors: List[BaseException]) -> None:
+        try:
+            for dto in self._stage_stream(s, self._drain(inp, stop), release):
+                if not self._put(out, dto, stop):
+                    return
+            self._put(out, _END_OF_STREAM, stop)
+        except BaseException as e:
+            errors.append(e)
+            stop.set()
+
+    @staticmethod
+    def _put(q: queue.Queue, item: Any, stop: threading.Event) -> bool:
+        """Blocks until the item is queued. Returns False if the stream was cancelled first."""
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=STREAM_POLL_INTERVAL)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    @staticmethod
+    def _drain(q: queue.Queue, stop: threading.Event) -> Iterator[Any]:
+        """Yields queued items until the end of the stream or until the stream is cancelled."""
+        while True:
+            try:
+                item = q.get(timeout=STREAM_POLL_INTERVAL)
+            except queue.Empty:
+                if stop.is_set():
+                    return
+                continue
+            if item is _END_OF_STREAM:
+                return
+            yield item
 
     def log(self, msg: str, lvl: int = logging.INFO) -> None:
         """
@@ -49,6 +517,30 @@ class Pipeline:
         else:
             print(msg)
 
+# Per-process pipeline used by Pipeline.map workers, built once from the pickled stages.
+_worker_pipeline: Optional[Pipeline] = None
+
+
+def _init_map_worker(stages: List[Stage], policies: Dict[Stage, StagePolicy], resources: Optional[ResourceConfig],
+                     counter, workers: int) -> None:
+    global _worker_pipeline
+    _worker_pipeline = Pipeline(stages)
+    _worker_pipeline.policies = policies
+
+    if resources is not None:
+        # Each worker takes the next slice of CPUs, and sizes TensorFlow's pools before running anything.
+        with counter.get_lock():
+            worker = counter.value
+            counter.value += 1
+        share = resources.for_worker(worker, workers)
+        share.apply_threads()
+        set_affinity(share.cpus)
+        _worker_pipeline.process_resources = share
+
+
+def _run_map_worker(dto: DTO) -> DTO:
+    return _worker_pipeline.run(dto)
+
 LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
 
 # with_logger could be a kwarg or a decorator, but sometimes you do something because you want to know if you can
@@ -64,4 +556,161 @@ def with_logger(logger: logging.Logger) -> Option:
             logger.addHandler(handler)
 
         instance.logger = logger
-    return option
\ No newline at end of file
+    return option
+
+def with_queue_depth(depth: int) -> Option:
+    """
+    Sets how many DTO chunks may be buffered between two stages when running with `Pipeline.run_stream`.
+    :param depth: Maximum number of queued chunks per stage boundary.
+    """
+    if depth < 1:
+        raise ValueError("Queue depth must be at least 1.")
+
+    def option(instance: Pipeline) -> None:
+        instance.queue_depth = depth
+    return option
+
+
+def with_memory_report(lvl: int = logging.INFO) -> Option:
+    """
+    Logs the estimated memory held by every DTO field after each stage, to spot fields that stay alive too long.
+    :param lvl: Logging level of the report.
+    """
+    def option(instance: Pipeline) -> None:
+        instance.memory_report_level = lvl
+    return option
+
+
+def with_tracing(output_dir: str, sample_rate: float = 1.0, min_span_ms: float = 0.0,
+                 tf_profiler: bool = False) -> Option:
+    """
+    Records stage, training and I/O spans of each run into one Chrome trace JSON file, viewable in chrome://tracing or
+    ui.perfetto.dev. Concurrent runs, e.g. from AsyncPipeline.run_many, each write their own trace. Map workers run
+    in other processes and are not traced.
+    :param output_dir: Directory for trace files.
+    :param sample_rate: Fraction of runs to trace.
+    :param min_span_ms: Drop spans shorter than this.
+    :param tf_profiler: Also capture the TensorFlow profiler around model training, for tf.data and op level detail.
+    """
+    tracer = Tracer(output_dir, sample_rate=sample_rate, min_span_ms=min_span_ms, tf_profiler=tf_profiler)
+
+    def option(instance: Pipeline) -> None:
+        instance.tracer = tracer
+    return option
+
+
+def with_resources(config: ResourceConfig, *stages: Stage,
+                   registry: Optional[ResourceRegistry] = None) -> Option:
+    """
+    Controls the threads and CPUs the pipeline uses.
+
+    Without stages, the configuration applies to the pipeline process: TensorFlow's thread pools are sized right away
+    (only possible before TensorFlow has run anything), the process is pinned to the configured CPUs, and map workers
+    split the CPUs between them. Runs also register their planned threads on this host, and log a warning when the
+    pipelines on the host together oversubscribe the CPUs.
+
+    The process tf.data thread pool is applied to the datasets in the DTO after every stage, so it reaches the datasets
+    once the extractor has created them.
+
+    With stages, CPU pinning applies while each of those stages runs. Their tf.data options are set on the datasets in
+    the DTO when the stage starts, and stick to those datasets and every dataset later stages derive from them, unless
+    process or later stage options override them. Pinning changes the whole process, so overlapping stages in
+    streaming or async runs should not pin to different CPUs.
+    :param config: Resources to use.
+    :param stages: Stages to configure. Defaults to the whole process.
+    :param registry: Registry of pipeline processes on this host. Defaults to one in the temp directory.
+    """
+    def option(instance: Pipeline) -> None:
+        if stages:
+            for s in stages:
+                instance.resources[s] = config
+            return
+
+        instance.process_resources = config
+        instance.resource_registry = registry or ResourceRegistry()
+        config.apply_threads()
+        if config.cpus is not None:
+            set_affinity(config.cpus)
+    return option
+
+
+def with_manifest(manifest: RunManifest, extractor: Stage, model_hash: Optional[str] = None) -> Option:
+    """
+    Processes only inputs that are new or changed since earlier runs, so repeat runs over a growing archive take time
+    proportional to the delta.
+
+    Before each run, the extractor's inputs are checked against the manifest and the extractor is restricted to the
+    changed ones. A run without changed inputs raises SkipPipelineError. After a successful run in which no stage was
+    skipped, its inputs are recorded with the hash of the model in `dto.model_hash`. Only `Pipeline.run` uses the
+    manifest.
+    :param manifest: Manifest of processed inputs.
+    :param extractor: Extractor with `inputs()` and `select_inputs(paths)`, e.g. ExtractFromShards.
+    :param model_hash: Hash of the model the inputs are processed with. Inputs processed with another model count as
+        changed. None accepts inputs processed with any model.
+    """
+    if not (hasattr(extractor, "inputs") and hasattr(extractor, "select_inputs")):
+        raise ValueError(f"{extractor.__class__.__name__} does not expose its inputs.")
+
+    def option(instance: Pipeline) -> None:
+        instance.manifest = manifest
+        instance.manifest_extractor = extractor
+        instance.manifest_model_hash = model_hash
+    return option
+
+
+def _stage_policies(instance: Pipeline, stages) -> List[StagePolicy]:
+    """Returns the policies of the given stages, or of every stage in the pipeline, creating them as needed."""
+    return [instance.policies.setdefault(s, StagePolicy()) for s in (stages or instance.stages)]
+
+
+def with_retry(*stages: Stage,
+               attempts: int = 3,
+               base_delay: float = 0.5,
+               max_delay: float = 30.0,
+               jitter: bool = True,
+               retry_on=(Exception,)) -> Option:
+    """
+    Retries failing stages with exponential backoff and jitter.
+    :param stages: Stages to retry. Defaults to every stage in the pipeline.
+    :param attempts: Total number of attempts, including the first one.
+    :param base_delay: Delay before the first retry, in seconds. Doubles with every retry.
+    :param max_delay: Upper bound for the delay between two attempts, in seconds.
+    :param jitter: Randomize delays so parallel runs don't retry in lockstep.
+    :param retry_on: Exception types worth retrying.
+    """
+    retry = RetryPolicy(attempts=attempts, base_delay=base_delay, max_delay=max_delay, jitter=jitter,
+                        retry_on=tuple(retry_on))
+
+    def option(instance: Pipeline) -> None:
+        for policy in _stage_policies(instance, stages):
+            policy.retry = retry
+    return option
+
+
+def with_timeout(seconds: float, *stages: Stage) -> Option:
+    """
+    Fails a stage attempt that runs longer than `seconds` with StageTimeoutError.
+    :param seconds: Wall-clock timeout per attempt.
+    :param stages: Stages to time out. Defaults to every stage in the pipeline.
+    """
+    if seconds <= 0:
+        raise ValueError("Timeout must be positive.")
+
+    def option(instance: Pipeline) -> None:
+        for policy in _stage_policies(instance, stages):
+            policy.timeout = seconds
+    return option
+
+
+def with_circuit_breaker(*stages: Stage, failure_threshold: int = 5, reset_after: float = 60.0) -> Option:
+    """
+    Skips a stage once it failed `failure_threshold` times in a row, until `reset_after` seconds have passed.
+    Every stage gets its own breaker.
+    :param stages: Stages to guard, typically sinks. Defaults to every stage in the pipeline.
+    :param failure_threshold: Consecutive failures that open the circuit.
+    :param reset_after: Seconds the circuit stays open before a trial call.
+    """
+    def option(instance: Pipeline) -> None:
+        for policy in _stage_policies(instance, stages):
+            policy.breaker = CircuitBreaker(failure_threshold=failure_threshold, reset_after=reset_after)
+    return option
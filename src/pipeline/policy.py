@@ -0,0 +1,182 @@
+from typing import Callable, Optional, Tuple, Type
+import copy
+import logging
+import random
+import threading
+import time
+
+from src.model import DTO, SkipStageError, SkipPipelineError, StageTimeoutError, CircuitOpenError
+from src.pipeline.stage import Stage
+
+
+class RetryPolicy:
+    def __init__(self,
+                 attempts: int = 3,
+                 base_delay: float = 0.5,
+                 max_delay: float = 30.0,
+                 jitter: bool = True,
+                 retry_on: Tuple[Type[BaseException], ...] = (Exception,),
+                 ):
+        """
+        Retry with exponential backoff.
+        :param attempts: Total number of attempts, including the first one.
+        :param base_delay: Delay before the first retry, in seconds. Doubles with every retry.
+        :param max_delay: Upper bound for the delay between two attempts, in seconds.
+        :param jitter: Draw each delay uniformly from [0, delay] so parallel runs don't retry in lockstep.
+        :param retry_on: Exception types worth retrying. Skip errors are never retried.
+        """
+        if attempts < 1:
+            raise ValueError("Retry attempts must be at least 1.")
+
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.retry_on = retry_on
+
+    def delay(self, attempt: int) -> float:
+        """
+        Delay before the next attempt.
+        :param attempt: Number of the attempt that just failed, starting at 1.
+        :return: Delay in seconds.
+        """
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        return random.uniform(0, delay) if self.jitter else delay
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold: int = 5, reset_after: float = 60.0):
+        """
+        Stops calling a stage after repeated failures.
+
+        After `failure_threshold` consecutive failed calls the circuit opens and the stage is skipped. Once
+        `reset_after` seconds have passed, one trial call is let through: success closes the circuit, failure opens it
+        again.
+        :param failure_threshold: Consecutive failures that open the circuit.
+        :param reset_after: Seconds the circuit stays open before a trial call.
+        """
+        if failure_threshold < 1:
+            raise ValueError("Failure threshold must be at least 1.")
+
+        self.failure_threshold = failure_threshold
+        self.reset_after = reset_after
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """Whether the stage may be called right now."""
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at >= self.reset_after:
+                # Half-open: let a single trial call through and keep the rest out until it reports back.
+                self.opened_at = time.monotonic()
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+    def __getstate__(self):
+        # Locks can't be pickled, e.g. when stages and their policies are sent to Pipeline.map workers.
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+
+class StagePolicy:
+    def __init__(self,
+                 retry: Optional[RetryPolicy] = None,
+                 timeout: Optional[float] = None,
+                 breaker: Optional[CircuitBreaker] = None,
+                 ):
+        """
+        Failure handling for a single stage.
+        :param retry: Retry policy, or None to fail on the first error.
+        :param timeout: Wall-clock timeout in seconds, or None to wait forever. A timed-out stage may still be running,
+            so it is not retried.
+        :param breaker: Circuit breaker, or None to always call the stage.
+        """
+        self.retry = retry
+        self.timeout = timeout
+        self.breaker = breaker
+
+    def call(self, s: Stage, dto: DTO, log: Callable[[str, int], None]) -> DTO:
+        """
+        Runs the stage under this policy.
+        :param s: Stage to run.
+        :param dto: Data transfer object (DTO) for the data pipeline.
+        :param log: Logging callback, usually `Pipeline.log`.
+        :return: DTO
+        """
+        name = s.__class__.__name__
+        if self.breaker is not None and not self.breaker.allow():
+            raise CircuitOpenError(f"Circuit open for stage {name} after {self.breaker.failures} consecutive failures")
+
+        attempt = 1
+        while True:
+            try:
+                dto_out = self._call_with_timeout(s, dto)
+            except (SkipStageError, SkipPipelineError):
+                raise
+            except Exception as e:
+                # A timed-out attempt keeps running in the background, a retry would race with it.
+                if (self.retry is not None and attempt < self.retry.attempts and isinstance(e, self.retry.retry_on)
+                        and not isinstance(e, StageTimeoutError)):
+                    delay = self.retry.delay(attempt)
+                    log(f"Stage {name} failed (attempt {attempt}/{self.retry.attempts}), retrying in {delay:.2f}s: {e}",
+                        logging.WARNING)
+                    time.sleep(delay)
+                    attempt += 1
+                    continue
+
+                if self.breaker is not None:
+                    self.breaker.record_failure()
+                raise e
+
+            if self.breaker is not None:
+                self.breaker.record_success()
+            return dto_out
+
+    def _call_with_timeout(self, s: Stage, dto: DTO) -> DTO:
+        """
+        Runs the stage, giving up after `timeout` seconds.
+
+        Python threads can't be killed, so a timed-out stage keeps running in a daemon thread in the background. Its
+        result is discarded. The stage runs on a shallow copy of the DTO, so the fields it sets after timing out don't
+        reach the DTO the caller goes on with.
+        """
+        if self.timeout is None:
+            return s.run(dto)
+
+        result = {}
+        attempt_dto = copy.copy(dto) if isinstance(dto, DTO) else dto
+
+        def target():
+            try:
+                result["dto"] = s.run(attempt_dto)
+            except BaseException as e:
+                result["error"] = e
+
+        worker = threading.Thread(target=target, name=f"stage-{s.__class__.__name__}", daemon=True)
+        worker.start()
+        worker.join(self.timeout)
+
+        if worker.is_alive():
+            raise StageTimeoutError(f"Stage {s.__class__.__name__} timed out after {self.timeout}s")
+        if "error" in result:
+            raise result["error"]
+        return result["dto"]
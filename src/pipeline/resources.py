@@ -0,0 +1,259 @@
+from typing import Dict, Iterator, List, Optional, Sequence
+import contextlib
+import json
+import logging
+import os
+import tempfile
+
+import tensorflow as tf
+
+from src.model import DTO
+
+# Directory where pipeline processes on one host announce the threads they plan to use.
+DEFAULT_REGISTRY_DIR = os.path.join(tempfile.gettempdir(), "pypeline-resources")
+
+
+class ResourceConfig:
+    def __init__(self,
+                 intra_op_threads: Optional[int] = None,
+                 inter_op_threads: Optional[int] = None,
+                 data_threads: Optional[int] = None,
+                 data_intra_op_threads: Optional[int] = None,
+                 cpus: Optional[Sequence[int]] = None,
+                 ):
+        """
+        CPU resources for a process, a map worker or a single stage.
+
+        TensorFlow's intra/inter-op pools exist once per process and can only be sized before TensorFlow starts, so
+        they apply to whole processes: the pipeline process, or each map worker. The tf.data pool and CPU affinity can
+        change at any time, so they also apply per stage.
+        :param intra_op_threads: Threads TensorFlow uses inside one op. Defaults to one per core.
+        :param inter_op_threads: Threads TensorFlow uses to run independent ops. Defaults to one per core.
+        :param data_threads: Size of a private tf.data thread pool for the datasets in the DTO, instead of sharing the
+            intra-op pool.
+        :param data_intra_op_threads: Threads a single tf.data transformation may use.
+        :param cpus: CPUs to pin to. Defaults to every CPU available to the process.
+        """
+        for name, value in (("intra_op_threads", intra_op_threads), ("inter_op_threads", inter_op_threads),
+                            ("data_threads", data_threads), ("data_intra_op_threads", data_intra_op_threads)):
+            if value is not None and value < 1:
+                raise ValueError(f"{name} must be at least 1.")
+        if cpus is not None and not cpus:
+            raise ValueError("cpus must not be empty.")
+
+        self.intra_op_threads = intra_op_threads
+        self.inter_op_threads = inter_op_threads
+        self.data_threads = data_threads
+        self.data_intra_op_threads = data_intra_op_threads
+        self.cpus = list(cpus) if cpus is not None else None
+
+    def planned_threads(self) -> int:
+        """
+        Threads this configuration keeps busy at once: the intra-op pool, one thread per core by default, plus a
+        private tf.data pool. Inter-op threads mostly wait on ops running in the intra-op pool, so they are not counted.
+        :return:
+        """
+        cores = len(self.cpus) if self.cpus is not None else len(available_cpus())
+        return (self.intra_op_threads or cores) + (self.data_threads or 0)
+
+    def dataset_options(self) -> Optional[tf.data.Options]:
+        """
+        tf.data options for the configured data threads, or None if none are configured.
+        :return:
+        """
+        if self.data_threads is None and self.data_intra_op_threads is None:
+            return None
+        options = tf.data.Options()
+        if self.data_threads is not None:
+            options.threading.private_threadpool_size = self.data_threads
+        if self.data_intra_op_threads is not None:
+            options.threading.max_intra_op_parallelism = self.data_intra_op_threads
+        return options
+
+    def apply_threads(self) -> bool:
+        """
+        Size TensorFlow's intra/inter-op pools for this process.
+        :return: False if TensorFlow had already started and the pools kept their size.
+        """
+        try:
+            if self.intra_op_threads is not None:
+                tf.config.threading.set_intra_op_parallelism_threads(self.intra_op_threads)
+            if self.inter_op_threads is not None:
+                tf.config.threading.set_inter_op_parallelism_threads(self.inter_op_threads)
+        except RuntimeError as e:
+            logging.warning(f"TensorFlow thread pools keep their size, configure resources before TensorFlow "
+                            f"runs: {e}")
+            return False
+        return True
+
+    def for_worker(self, worker: int, workers: int) -> "ResourceConfig":
+        """
+        The share of this configuration for one of `workers` processes. CPUs are split into disjoint slices, and the
+        intra-op pool defaults to the size of the slice, so the workers together use each core once.
+        :param worker: Worker index, from 0.
+        :param workers: Number of workers.
+        :return:
+        """
+        cpus = self.cpus if self.cpus is not None else available_cpus()
+        share = [cpu for i, cpu in enumerate(cpus) if i % workers == worker % workers] or cpus
+        return ResourceConfig(intra_op_threads=self.intra_op_threads or len(share),
+                              inter_op_threads=self.inter_op_threads or 1,
+                              data_threads=self.data_threads,
+                              data_intra_op_threads=self.data_intra_op_threads,
+                              cpus=share)
+
+
+def available_cpus() -> List[int]:
+    """
+    CPUs this process may run on.
+    :return:
+    """
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def set_affinity(cpus: Sequence[int]) -> None:
+    """
+    Pin every thread of this process, including TensorFlow's pools, to the given CPUs. A no-op where the platform has
+    no affinity API.
+    :param cpus: CPUs to pin to.
+    """
+    if not hasattr(os, "sched_setaffinity"):
+        return
+
+    # sched_setaffinity only pins the thread it is given, so pin each thread in the process.
+    try:
+        threads = [int(tid) for tid in os.listdir("/proc/self/task")]
+    except OSError:
+        threads = [0]
+    for tid in threads:
+        try:
+            os.sched_setaffinity(tid, cpus)
+        except OSError:
+            # The thread exited in the meantime.
+            pass
+
+
+@contextlib.contextmanager
+def pinned(cpus: Optional[Sequence[int]]) -> Iterator[None]:
+    """
+    Pin the process to `cpus` for the enclosed block, then restore the previous CPUs.
+    :param cpus: CPUs to pin to. None leaves the affinity unchanged.
+    """
+    if cpus is None or not hasattr(os, "sched_setaffinity"):
+        yield
+        return
+
+    previous = available_cpus()
+    set_affinity(cpus)
+    try:
+        yield
+    finally:
+        set_affinity(previous)
+
+
+def apply_dataset_options(dto: DTO, options: tf.data.Options) -> None:
+    """
+    Apply tf.data options to the datasets held by the DTO. Options stick to a dataset and every dataset derived from it.
+    :param dto: Data transfer object (DTO) for the data pipeline.
+    :param options: Options to apply.
+    """
+    def with_options(data):
+        if isinstance(data, tf.data.Dataset):
+            # Skip datasets that already carry the options, so repeated calls don't stack option nodes
+            if data.options().merge(options) == data.options():
+                return data
+            return data.with_options(options)
+        if isinstance(data, dict):
+            return {k: with_options(v) for k, v in data.items()}
+        return data
+
+    # Raw data is a dictionary of datasets when the extractor already split it.
+    dto.raw_data = with_options(dto.raw_data)
+    dto.split_data = with_options(dto.split_data)
+
+
+class ResourceRegistry:
+    """
+    Lets the pipeline processes on one host see each other's planned thread usage, to detect oversubscription.
+
+    Every process writes one small JSON file named after its pid. Files of processes that no longer exist are ignored
+    and removed.
+    """
+
+    def __init__(self, directory: str = DEFAULT_REGISTRY_DIR):
+        self.directory = directory
+
+    def path(self, pid: int) -> str:
+        return os.path.join(self.directory, f"{pid}.json")
+
+    def register(self, threads: int, pid: Optional[int] = None) -> None:
+        """
+        Announce the threads a process plans to use.
+        :param threads: Planned busy threads.
+        :param pid: Process id. Defaults to this process.
+        """
+        pid = pid or os.getpid()
+        os.makedirs(self.directory, exist_ok=True)
+        temp_path = f"{self.path(pid)}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump({"pid": pid, "threads": threads}, f)
+        os.replace(temp_path, self.path(pid))
+
+    def unregister(self, pid: Optional[int] = None) -> None:
+        try:
+            os.remove(self.path(pid or os.getpid()))
+        except FileNotFoundError:
+            pass
+
+    def usage(self) -> Dict[int, int]:
+        """
+        Planned threads of every live registered process.
+        :return: Threads by pid.
+        """
+        usage: Dict[int, int] = {}
+        if not os.path.isdir(self.directory):
+            return usage
+
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                with open(path, "r") as f:
+                    entry = json.load(f)
+            except (OSError, ValueError):
+                continue
+
+            if _process_alive(entry["pid"]):
+                usage[entry["pid"]] = entry["threads"]
+            else:
+                with contextlib.suppress(OSError):
+                    os.remove(path)
+        return usage
+
+    def oversubscription(self, cpus: Optional[int] = None) -> Optional[str]:
+        """
+        Describe the oversubscription of this host, if the registered processes plan more threads than there are
+        CPUs.
+        :param cpus: CPUs on the host. Defaults to the CPU count.
+        :return: A warning message, or None if the host is not oversubscribed.
+        """
+        cpus = cpus or os.cpu_count() or 1
+        usage = self.usage()
+        total = sum(usage.values())
+        if total <= cpus:
+            return None
+        return (f"{len(usage)} pipeline processes plan {total} busy threads on {cpus} CPUs. Lower the thread "
+                f"counts with with_resources, or pin processes to disjoint CPUs.")
+
+
+def _process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
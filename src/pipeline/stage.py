@@ -1,5 +1,5 @@
 from abc import ABC, abstractmethod
-from typing import Union
+from typing import Iterator, Optional, Tuple, Union
 
 from src.model import DTO, SkipStageError, SkipPipelineError
 
@@ -10,7 +10,15 @@ class Stage(ABC):
 
     A stage can extract, transform or load data. For each stage, we instantiate the class and call the `accept` method
     to check if the stage should run. If it should, we call the `run` method to execute the stage.
+
+    Stages can optionally override `run_stream` to consume and produce DTO chunks incrementally when the pipeline runs
+    in streaming mode.
+
+    Stages declare the DTO fields they read in `consumes`. Once no later stage consumes a transient field, the pipeline
+    releases it. `None` means the stage may read anything, which keeps every field alive until it has run.
     """
+    consumes: Optional[Tuple[str, ...]] = None
+
     @abstractmethod
     def accept(self, dto: DTO) -> Union[None, SkipStageError, SkipPipelineError]:
         """
@@ -26,4 +34,16 @@ class Stage(ABC):
         :param dto: Data transfer object (DTO) for the data pipeline.
         :return: DTO
         """
-        pass
\ No newline at end of file
+        pass
+
+    def run_stream(self, chunks: Iterator[DTO]) -> Iterator[DTO]:
+        """
+        Runs the stage over a stream of DTO chunks.
+
+        The default implementation calls `run` once per chunk. Override it for stages that can split a chunk into
+        several smaller ones, merge chunks, or keep state (open files, connections) across chunks.
+        :param chunks: Iterator of DTO chunks produced by the previous stage.
+        :return: Iterator of DTO chunks for the next stage.
+        """
+        for dto in chunks:
+            yield self.run(dto)
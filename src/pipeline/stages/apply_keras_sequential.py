@@ -1,4 +1,4 @@
-from typing import Union, List, Dict, Any, Optional
+from typing import Union, List, Dict, Any, Optional, Tuple
 import os
 
 import keras
@@ -6,9 +6,14 @@ import tensorflow as tf
 import json
 
 from src.model import DTO, SkipStageError, SkipPipelineError, SplitEnum
+from src.utils import tracing
 from src.pipeline.stage import Stage
+from src.utils.hardware import supports_bfloat16
 from src.utils.model_cache import ModelCache
 
+# Supported values of KerasConfig.mixed_precision. None trains in float32.
+MIXED_PRECISION_POLICIES = (None, "auto", "mixed_bfloat16", "mixed_float16")
+
 
 class KerasConfig:
     def __init__(self,
@@ -17,6 +22,11 @@ class KerasConfig:
                  metrics: List[str] = ['accuracy'],
                  optimizer: str = 'adam',
                  use_cache: bool = True,
+                 jit_compile: Optional[bool] = None,
+                 steps_per_execution: int = 1,
+                 mixed_precision: Optional[str] = None,
+                 warm_start: bool = False,
+                 freeze_shared_layers: bool = True,
                  ):
         """
         Configuration for the Keras model.
@@ -25,35 +35,98 @@ class KerasConfig:
         :param metrics: Metrics for the Keras model.
         :param optimizer: Optimizer for the Keras model.
         :param use_cache: Whether to use model caching.
+        :param jit_compile: Compile the train and predict steps with XLA. None leaves the choice to Keras.
+        :param steps_per_execution: Batches run per call into the compiled step, cutting Python dispatch overhead.
+        :param mixed_precision: Mixed precision policy, "mixed_bfloat16" or "mixed_float16". "auto" picks
+            mixed_bfloat16 on CPUs with native bfloat16 support and float32 elsewhere.
+        :param warm_start: Without an exact cache hit, initialize from the nearest compatible cached model: train only
+            the remaining epochs when it has the same layers, or only the layers after those it shares otherwise.
+            The model is cached with where it came from. Models built on another model's layers are only exact cache
+            hits for configurations that allow warm starts.
+        :param freeze_shared_layers: Freeze the layers taken from the nearest cached model when warm-starting a model
+            with a different head, so only the new layers train.
         """
+        if steps_per_execution < 1:
+            raise ValueError("Steps per execution must be at least 1.")
+        if mixed_precision not in MIXED_PRECISION_POLICIES:
+            raise ValueError(f"Unsupported mixed precision policy {mixed_precision}, "
+                             f"expected one of {MIXED_PRECISION_POLICIES}")
+
         self.epochs = epochs
         self.loss = loss
         self.metrics = metrics
         self.optimizer = optimizer
         self.use_cache = use_cache
-    
+        self.jit_compile = jit_compile
+        self.steps_per_execution = steps_per_execution
+        self.mixed_precision = mixed_precision
+        self.warm_start = warm_start
+        self.freeze_shared_layers = freeze_shared_layers
+
+    def precision_policy(self) -> Optional[str]:
+        """
+        The mixed precision policy to train with, or None for float32.
+        :return:
+        """
+        if self.mixed_precision == "auto":
+            return "mixed_bfloat16" if supports_bfloat16() else None
+        return self.mixed_precision
+
+    def compile_kwargs(self) -> Dict[str, Any]:
+        """
+        Optional model.compile arguments, only those that differ from the Keras defaults.
+        :return:
+        """
+        kwargs: Dict[str, Any] = {}
+        if self.jit_compile is not None:
+            kwargs["jit_compile"] = self.jit_compile
+        if self.steps_per_execution != 1:
+            kwargs["steps_per_execution"] = self.steps_per_execution
+        return kwargs
+
     def to_dict(self) -> Dict[str, Any]:
-        """Convert config to a dictionary for caching"""
-        return {
+        """
+        Convert config to a dictionary for caching. Performance options are only included when set, so models cached
+        before they existed keep their hash. Warm-start options are left out, they only change how a model gets trained,
+        so a warm-started model and a cold-trained one share their cache entry.
+        """
+        config = {
             "epochs": self.epochs,
             "loss": self.loss,
             "metrics": self.metrics,
             "optimizer": self.optimizer
         }
+        config.update(self.compile_kwargs())
+        policy = self.precision_policy()
+        if policy is not None:
+            config["mixed_precision"] = policy
+        return config
 
 
 class ApplyKerasSequential(Stage):
-    def __init__(self, config: KerasConfig, layers: List[keras.Layer], cache_dir: Optional[str] = None):
+    consumes = ("keras_inputs", "split_data", "class_names")
+
+    def __init__(self, config: KerasConfig, layers: List[keras.Layer], cache_dir: Optional[str] = None,
+                 model_cache: Optional[ModelCache] = None):
         """
         :param config: Configuration for the Keras model.
         :param layers: List of layers for the Sequential model.
         :param cache_dir: Optional directory for model caching.
+        :param model_cache: Optional preconfigured model cache, e.g. with deduplicated storage. Takes precedence
+            over cache_dir.
         """
         self.config = config
         self.layers = layers
-        self.model_cache = ModelCache(cache_dir) if cache_dir else ModelCache()
+        if model_cache is not None:
+            self.model_cache = model_cache
+        else:
+            self.model_cache = ModelCache(cache_dir) if cache_dir else ModelCache()
+        # Models loaded from the cache, kept so repeated runs in the same process (e.g. Pipeline.map workers) don't
+        # reload them from disk.
+        self._loaded_models: Dict[str, keras.Model] = {}
 
-    def get_dataset_info(self, dto: DTO) -> Dict[str, Any]:
+    @staticmethod
+    def get_dataset_info(dto: DTO) -> Dict[str, Any]:
         """
         Extract dataset information for caching purposes.
         
@@ -80,11 +153,21 @@ class ApplyKerasSequential(Stage):
         """
         Extract layer configuration for caching purposes.
         
+        :return: List of layer configurations.
+        """
+        return self.layers_config(self.layers)
+
+    @staticmethod
+    def layers_config(layers: List[keras.Layer]) -> List[Dict[str, Any]]:
+        """
+        Serializable configuration of a list of layers, used in model cache keys.
+        
+        :param layers: Layers of a Sequential model.
         :return: List of layer configurations.
         """
         # Convert layers to a serializable format for caching
         layers_config = []
-        for layer in self.layers:
+        for layer in layers:
             if hasattr(layer, 'get_config'):
                 # For standard Keras layers
                 layer_config = {
@@ -109,6 +192,98 @@ class ApplyKerasSequential(Stage):
                 })
         return layers_config
 
+    def apply_precision_policy(self, policy: str) -> List[Tuple[keras.Layer, Any]]:
+        """
+        Set the dtype policy of every layer, including the layers of nested models such as a pretrained backbone. The
+        last layer stays in float32, so the softmax and the loss are computed at full precision.
+        :param policy: Mixed precision policy name.
+        :return: Every changed layer with its previous policy, to restore after training.
+        """
+        layers = [layer for layer in self.layers if isinstance(layer, keras.Layer)]
+        previous = []
+
+        def apply(layer: keras.Layer, layer_policy: str) -> None:
+            previous.append((layer, layer.dtype_policy))
+            layer.dtype_policy = layer_policy
+            for sublayer in getattr(layer, "layers", []):
+                apply(sublayer, layer_policy)
+
+        for i, layer in enumerate(layers):
+            apply(layer, policy if i < len(layers) - 1 else "float32")
+        return previous
+
+    def optimizer(self, policy: Optional[str]) -> Union[str, keras.optimizers.Optimizer]:
+        """
+        The optimizer to compile with. float16 gradients underflow without loss scaling, and Keras only adds it for
+        models whose own policy is mixed_float16, not for models whose layers are.
+        :param policy: Mixed precision policy the model trains with.
+        :return:
+        """
+        if policy != "mixed_float16":
+            return self.config.optimizer
+        return keras.optimizers.LossScaleOptimizer(keras.optimizers.get(self.config.optimizer))
+
+    def is_cache_hit(self, model_hash: str) -> bool:
+        """
+        Whether the cached model with the exact hash of this configuration may be used. A model warm-started from
+        another model's weights, e.g. with shared layers frozen, only stands in for a run that allows warm starts.
+        :param model_hash: Hash of this configuration.
+        :return:
+        """
+        provenance = self.model_cache.metadata.get(model_hash, {}).get("warm_start")
+        if provenance and provenance.get("transferred") and not self.config.warm_start:
+            print(f"Ignoring cached model (hash: {model_hash[:8]}...), it was warm-started from "
+                  f"{provenance['warm_started_from'][:8]}...")
+            return False
+        return True
+
+    def warm_start(self, model: keras.Model, layers_config: List[Dict[str, Any]],
+                   dataset_info: Dict[str, Any]) -> Tuple[int, List[keras.Layer], Optional[Dict[str, Any]]]:
+        """
+        Initialize the model from the nearest compatible cached model.
+        :param model: The new, uncompiled model.
+        :param layers_config: Layer configuration of the new model.
+        :param dataset_info: Dataset information of the new model.
+        :return: The epoch to start training from, 0 unless the cached model has the same layers and trained for
+            fewer epochs, the layers frozen for training, and the provenance to store with the model, or None if it
+            was not warm-started. Provenance marks the model as transferred unless it continues the training of a
+            model that was not transferred itself, with the same layers and nothing frozen.
+        """
+        if dataset_info["input_shape"] is None:
+            return 0, [], None
+        nearest = self.model_cache.find_nearest(layers_config, self.config.to_dict(), dataset_info)
+        if nearest is None:
+            return 0, [], None
+        cached_model = self.model_cache.get_model(nearest["hash"])
+        if cached_model is None:
+            return 0, [], None
+
+        model.build((None, *dataset_info["input_shape"]))
+        # Inputs in the layer list, e.g. keras.Input, have a config entry but no layer in the model
+        shared = sum(isinstance(layer, keras.Layer) for layer in self.layers[:nearest["shared_layers"]])
+        freeze = self.config.freeze_shared_layers and nearest["shared_layers"] < len(self.layers)
+        frozen = []
+        for layer, cached_layer in zip(model.layers[:shared], cached_model.layers[:shared]):
+            weights = cached_layer.get_weights()
+            if [w.shape for w in weights] != [w.shape for w in layer.get_weights()]:
+                continue
+            layer.set_weights(weights)
+            if freeze and weights and layer.trainable:
+                layer.trainable = False
+                frozen.append(layer)
+
+        print(f"Warm-starting from cached model (hash: {nearest['hash'][:8]}..., {nearest['shared_layers']} shared "
+              f"layers, {nearest['epochs']} of {self.config.epochs} epochs trained)")
+        source = self.model_cache.metadata.get(nearest["hash"], {}).get("warm_start") or {}
+        provenance = {
+            "warm_started_from": nearest["hash"],
+            "shared_layers": nearest["shared_layers"],
+            "frozen": [layer.name for layer in frozen],
+            "initial_epoch": nearest["epochs"],
+            "transferred": nearest["epochs"] == 0 or bool(frozen) or source.get("transferred", False),
+        }
+        return nearest["epochs"], frozen, provenance
+
     def accept(self, dto: DTO) -> Union[None, SkipStageError, SkipPipelineError]:
         """
         Check if the DTO has a TensorFlow Dataset for training and validation, and we have a valid base model.
@@ -138,38 +313,65 @@ class ApplyKerasSequential(Stage):
                 self.config.to_dict(), 
                 dataset_info
             )
-            cached_model = self.model_cache.get_model(model_hash)
+            cached_model = self._loaded_models.get(model_hash)
+            if cached_model is None and self.is_cache_hit(model_hash):
+                cached_model = self.model_cache.get_model(model_hash)
             
             if cached_model is not None:
                 print(f"Using cached model (hash: {model_hash[:8]}...)")
+                self._loaded_models[model_hash] = cached_model
                 dto.keras_model = cached_model
+                dto.model_hash = model_hash
                 return dto
         
         # If no cached model is found or caching is disabled, train a new model
         print("Training new model...")
-        model = tf.keras.Sequential(self.layers)
-
-        model.compile(optimizer=self.config.optimizer,
-                      loss=self.config.loss,
-                      metrics=self.config.metrics)
-
-        # Train the model
-        model.fit(
-            dto.split_data.get(SplitEnum.TRAIN.value), 
-            validation_data=dto.split_data.get(SplitEnum.VALIDATION.value), 
-            epochs=self.config.epochs
-        )
+        policy = self.config.precision_policy()
+        # The layers belong to the caller, e.g. a shared backbone, so they only keep the policy while training
+        previous_policies = self.apply_precision_policy(policy) if policy is not None else []
+        try:
+            model = tf.keras.Sequential(self.layers)
+            initial_epoch, frozen, provenance = 0, [], None
+            if self.config.warm_start:
+                initial_epoch, frozen, provenance = self.warm_start(model, layers_config, dataset_info)
+
+            model.compile(optimizer=self.optimizer(policy),
+                          loss=self.config.loss,
+                          metrics=self.config.metrics,
+                          **self.config.compile_kwargs())
+
+            # Train the model, with epoch and batch spans when the run is traced
+            callbacks = tracing.training_callbacks()
+            fit_kwargs = {"callbacks": callbacks} if callbacks else {}
+            if initial_epoch:
+                fit_kwargs["initial_epoch"] = initial_epoch
+            try:
+                with tracing.span("fit", tracing.CATEGORY_TRAIN, epochs=self.config.epochs), tracing.tf_profile():
+                    model.fit(
+                        dto.split_data.get(SplitEnum.TRAIN.value),
+                        validation_data=dto.split_data.get(SplitEnum.VALIDATION.value),
+                        epochs=self.config.epochs,
+                        **fit_kwargs
+                    )
+            finally:
+                # Shared layers are only frozen for this training run, the layers are reused by later runs
+                for layer in frozen:
+                    layer.trainable = True
+        finally:
+            for layer, previous in previous_policies:
+                layer.dtype_policy = previous
         
         # Store the model in the DTO
         dto.keras_model = model
         
         # Cache the model if caching is enabled
         if self.config.use_cache:
-            self.model_cache.save_model(
+            dto.model_hash = self.model_cache.save_model(
                 model, 
                 layers_config, 
                 self.config.to_dict(), 
-                dataset_info
+                dataset_info,
+                extra_metadata={"warm_start": provenance} if provenance else None
             )
             
         return dto
\ No newline at end of file
@@ -0,0 +1,247 @@
+from typing import Optional, Sequence, Tuple, Union
+
+import numpy as np
+import rasterio
+import rasterio.shutil
+from rasterio.enums import Resampling
+from rasterio.io import MemoryFile
+from rasterio.transform import Affine
+
+from src.model import DTO, SkipStageError, SkipPipelineError
+from src.pipeline.stage import Stage
+
+# Class value for cells no window covered.
+NODATA_CLASS = 255
+
+
+def window_grid(height: int, width: int, window: int, stride: int) -> Tuple[int, int]:
+    """
+    Rows and columns of windows needed to cover a scene, the last ones reaching into padding.
+    :param height: Scene height in pixels.
+    :param width: Scene width in pixels.
+    :param window: Window size in pixels.
+    :param stride: Step between windows in pixels.
+    :return:
+    """
+    rows = max(0, -(-(height - window) // stride)) + 1
+    cols = max(0, -(-(width - window) // stride)) + 1
+    return rows, cols
+
+
+def load_scene(scene_path: Optional[str], dto: DTO) -> Tuple[np.ndarray, Optional[Affine], Optional[rasterio.crs.CRS]]:
+    """
+    Read a scene as an (H, W, C) array with its georeferencing, if any.
+    :param scene_path: Raster to read. If None, the scene is the (H, W, C) array in `dto.raw_data`.
+    :param dto:
+    :return: Scene, affine transform and CRS.
+    """
+    if scene_path is None:
+        return dto.raw_data, None, None
+
+    with rasterio.open(scene_path) as src:
+        # (C, H, W) to (H, W, C) is a view, no copy.
+        return src.read().transpose(1, 2, 0), src.transform, src.crs
+
+
+class SlidingWindowConfig:
+    def __init__(self,
+                 window: int = 64,
+                 stride: int = 32,
+                 batch_size: int = 256,
+                 merge: str = "mean",
+                 output_path: Optional[str] = None,
+                 blocksize: int = 256,
+                 bands: Optional[Sequence[int]] = None,
+                 ):
+        """
+        Configuration for sliding-window scene inference.
+        :param window: Window size in pixels, the model input size.
+        :param stride: Step between windows in pixels. Must divide the window size. Predictions are merged on a grid of
+            stride x stride cells.
+        :param batch_size: Windows per model call.
+        :param merge: How overlapping window predictions are merged per cell: "mean" averages the class
+            probabilities, "max" keeps the highest probability per class.
+        :param output_path: Where to write the class raster as a Cloud Optimized GeoTIFF, or None to skip writing.
+        :param blocksize: Internal tile size of the GeoTIFF.
+        :param bands: Bands of the scene to feed the model, e.g. to leave out a cloud mask band. Defaults to all.
+        """
+        if merge not in ("mean", "max"):
+            raise ValueError(f"Unsupported merge {merge}, expected 'mean' or 'max'")
+        if stride < 1 or window % stride != 0:
+            raise ValueError("Stride must be a positive divisor of the window size")
+
+        self.window = window
+        self.stride = stride
+        self.batch_size = batch_size
+        self.merge = merge
+        self.output_path = output_path
+        self.blocksize = blocksize
+        self.bands = list(bands) if bands is not None else None
+
+
+class ApplySlidingWindow(Stage):
+    consumes = ("keras_model", "raw_data", "window_labels")
+
+    def __init__(self, config: SlidingWindowConfig, scene_path: Optional[str] = None):
+        """
+        Classify a whole scene by running the model over overlapping windows.
+
+        Window predictions are accumulated into a preallocated per-cell buffer, where a cell is stride x stride pixels,
+        and the merged class map is stored in `dto.prediction_raster`. Windows that `dto.window_labels` already decided,
+        e.g. from FilterTiles, are not run through the model.
+        :param config: Configuration for the sliding-window inference.
+        :param scene_path: Raster to classify. If None, `dto.raw_data` must hold the scene as an (H, W, C) array.
+        """
+        self.config = config
+        self.scene_path = scene_path
+        self.windows_predicted = 0
+
+    def accept(self, dto: DTO) -> Union[None, SkipStageError, SkipPipelineError]:
+        """
+        Check that there is a trained model and a scene to classify.
+        :param dto:
+        :return:
+        """
+        if dto.keras_model is None:
+            raise SkipPipelineError("No Keras model available for sliding-window inference.")
+
+        if self.scene_path is None and not (isinstance(dto.raw_data, np.ndarray) and dto.raw_data.ndim == 3):
+            raise SkipPipelineError("Sliding-window inference needs a scene path or an (H, W, C) array in raw_data.")
+
+        return None
+
+    def run(self, dto: DTO) -> DTO:
+        """
+        Run the windows through the model in batches and merge their predictions.
+        :param dto:
+        :return:
+        """
+        scene, transform, crs = self.load_scene(dto)
+        probabilities = self.predict_cells(dto.keras_model, scene, dto.window_labels)
+
+        class_map = np.argmax(probabilities, axis=-1).astype(np.uint8)
+        class_map[probabilities.max(axis=-1) < 0] = NODATA_CLASS
+        dto.prediction_raster = class_map
+
+        if self.config.output_path is not None:
+            cell_transform = transform * Affine.scale(self.config.stride) if transform is not None else None
+            self.write_cog(class_map, cell_transform, crs)
+
+        return dto
+
+    def load_scene(self, dto: DTO) -> Tuple[np.ndarray, Optional[Affine], Optional[rasterio.crs.CRS]]:
+        """
+        Read the scene as an (H, W, C) array with its georeferencing, if any.
+        :param dto:
+        :return: Scene, affine transform and CRS.
+        """
+        return load_scene(self.scene_path, dto)
+
+    def predict_cells(self, model, scene: np.ndarray, window_labels: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Predict every window and merge the predictions per cell.
+        :param model: Model returning class probabilities per window.
+        :param scene: (H, W, C) scene.
+        :param window_labels: (rows, cols) class per window decided without the model, -1 for windows to predict and
+            NODATA_CLASS for windows to leave out.
+        :return: (rows, cols, classes) merged probabilities per cell, -1 for cells no window covered.
+        """
+        window, stride = self.config.window, self.config.stride
+        cells_per_window = window // stride
+
+        # Pad the bottom and right edges so the last windows line up with the cell grid.
+        height, width = scene.shape[:2]
+        rows, cols = window_grid(height, width, window, stride)
+        if window_labels is not None and window_labels.shape != (rows, cols):
+            raise ValueError(f"Window labels of shape {window_labels.shape} do not match the {rows}x{cols} window grid")
+        pad_h = (rows - 1) * stride + window - height
+        pad_w = (cols - 1) * stride + window - width
+        if pad_h or pad_w:
+            scene = np.pad(scene, ((0, pad_h), (0, pad_w), (0, 0)))
+
+        # Every window as a strided view over the scene, no copies until a batch is gathered.
+        windows = np.lib.stride_tricks.sliding_window_view(scene, (window, window), axis=(0, 1))[::stride, ::stride]
+        labels = window_labels.ravel() if window_labels is not None else np.full(rows * cols, -1)
+        predict = np.flatnonzero(labels < 0)
+        origin_rows, origin_cols = np.divmod(predict, cols)
+
+        accumulator: Optional[np.ndarray] = None
+        counts = np.zeros((rows - 1 + cells_per_window, cols - 1 + cells_per_window), dtype=np.int32)
+
+        def add(r: np.ndarray, c: np.ndarray, predictions: np.ndarray) -> None:
+            nonlocal accumulator
+            if accumulator is None:
+                fill = 0.0 if self.config.merge == "mean" else -1.0
+                accumulator = np.full(counts.shape + (predictions.shape[-1],), fill, dtype=np.float32)
+
+            # Windows in a batch start on distinct cells, so for a fixed offset every target cell is unique and plain
+            # fancy indexing updates the whole batch at once.
+            for dr in range(cells_per_window):
+                for dc in range(cells_per_window):
+                    if self.config.merge == "mean":
+                        accumulator[r + dr, c + dc] += predictions
+                    else:
+                        accumulator[r + dr, c + dc] = np.maximum(accumulator[r + dr, c + dc], predictions)
+                    counts[r + dr, c + dc] += 1
+
+        for start in range(0, len(predict), self.config.batch_size):
+            r = origin_rows[start:start + self.config.batch_size]
+            c = origin_cols[start:start + self.config.batch_size]
+
+            # sliding_window_view puts the window axes last: (B, C, window, window) to (B, window, window, C).
+            batch = windows[r, c].transpose(0, 2, 3, 1)
+            if self.config.bands is not None:
+                batch = batch[..., self.config.bands]
+            add(r, c, np.asarray(model.predict_on_batch(batch), dtype=np.float32))
+        self.windows_predicted = len(predict)
+
+        # Windows labeled before inference count as certain predictions of their class.
+        fixed = np.flatnonzero((labels >= 0) & (labels != NODATA_CLASS))
+        if len(fixed):
+            classes = accumulator.shape[-1] if accumulator is not None else int(labels[fixed].max()) + 1
+            r, c = np.divmod(fixed, cols)
+            add(r, c, np.eye(classes, dtype=np.float32)[labels[fixed]])
+        if accumulator is None:
+            accumulator = np.full(counts.shape + (1,), -1.0, dtype=np.float32)
+
+        if self.config.merge == "mean":
+            covered = counts > 0
+            accumulator[covered] /= counts[covered][:, None]
+            accumulator[~covered] = -1.0
+
+        # Drop the cells that only cover padding.
+        return accumulator[:-(-height // stride), :-(-width // stride)]
+
+    def write_cog(self, class_map: np.ndarray, transform: Optional[Affine], crs) -> None:
+        """
+        Write the class map as an internally tiled, compressed Cloud Optimized GeoTIFF.
+        :param class_map: (rows, cols) class ids.
+        :param transform: Affine transform of the cell grid.
+        :param crs: CRS of the scene.
+        """
+        profile = {
+            "driver": "GTiff",
+            "height": class_map.shape[0],
+            "width": class_map.shape[1],
+            "count": 1,
+            "dtype": "uint8",
+            "nodata": NODATA_CLASS,
+            "tiled": True,
+            "blockxsize": self.config.blocksize,
+            "blockysize": self.config.blocksize,
+        }
+        if transform is not None:
+            profile["transform"] = transform
+        if crs is not None:
+            profile["crs"] = crs
+
+        # The COG driver can only copy an existing dataset, so build it with overviews in memory first.
+        with MemoryFile() as memfile:
+            with memfile.open(**profile) as dst:
+                dst.write(class_map, 1)
+                factors = [f for f in (2, 4, 8, 16) if min(class_map.shape) // f >= 1]
+                if factors:
+                    dst.build_overviews(factors, Resampling.mode)
+            with memfile.open() as src:
+                rasterio.shutil.copy(src, self.config.output_path, driver="COG", compress="DEFLATE",
+                                     blocksize=self.config.blocksize, overview_resampling="MODE")
@@ -0,0 +1,259 @@
+from typing import Any, Dict, List, Optional, Sequence, Union
+import enum
+import json
+import os
+
+import numpy as np
+import tensorflow as tf
+
+from src.model import DTO, SkipStageError, SkipPipelineError, SplitEnum
+from src.pipeline.stage import Stage
+
+
+# Number of buckets elements are hashed into for the stratified split, i.e. the resolution of train_ratio.
+SPLIT_BUCKETS = 10_000
+
+
+class BalanceMethod(enum.Enum):
+    # Repeat elements of rare classes and thin out common ones, running for a fixed epoch size.
+    RESAMPLE = "resample"
+    # Drop elements of common classes with tf.data rejection_resample, which ends with the input rather than running
+    # for a fixed epoch size.
+    REJECTION = "rejection"
+
+
+class BalanceConfig:
+    def __init__(self,
+                 method: BalanceMethod = BalanceMethod.RESAMPLE,
+                 target_distribution: Optional[Sequence[float]] = None,
+                 stratify: bool = True,
+                 train_ratio: float = 0.8,
+                 epoch_size: Optional[int] = None,
+                 counts_cache: Optional[str] = None,
+                 cache_key: Optional[str] = None,
+                 count_batch: int = 4096,
+                 shuffle_buffer: int = 1024,
+                 seed: Optional[int] = None,
+                 ):
+        """
+        Configuration for the class balancing stage.
+        :param method: How to rebalance the classes.
+        :param target_distribution: Share of each class after balancing. Uniform by default.
+        :param stratify: Also split into training and validation datasets with the same class mix. Only the training
+            dataset is rebalanced. Without it the whole dataset is rebalanced, repeating elements of rare classes, so
+            it must not be split afterwards, e.g. by SplitTFDataset's take/skip split: copies of the same element
+            would land in training and validation, and validation would get the resampled class mix.
+        :param train_ratio: Share of every class that goes to training when stratifying. Elements are assigned by a
+            hash of their contents, so the split holds however often the source reshuffles.
+        :param epoch_size: Elements per pass over the resampled dataset. Defaults to the number of training elements.
+        :param counts_cache: JSON file to keep per-class counts in across runs.
+        :param cache_key: Key of the dataset in counts_cache, e.g. "eurosat/rgb:train".
+        :param count_batch: Labels counted per step of the counting pass.
+        :param shuffle_buffer: Buffer that spreads the repeats of an element when resampling.
+        :param seed: Seed for sampling.
+        """
+        self.method = method
+        self.target_distribution = target_distribution
+        self.stratify = stratify
+        self.train_ratio = train_ratio
+        self.epoch_size = epoch_size
+        self.counts_cache = counts_cache
+        self.cache_key = cache_key
+        self.count_batch = count_batch
+        self.shuffle_buffer = shuffle_buffer
+        self.seed = seed
+
+
+class BalanceClasses(Stage):
+    consumes = ("raw_data", "class_names")
+
+    def __init__(self, config: BalanceConfig):
+        """
+        Rebalances the classes of raw_data, and optionally makes a stratified training/validation split.
+
+        Every pass reads the source once: per-class counts come from one pass over the labels, and balancing repeats or
+        drops each element as it streams past. Counts are cached on the stage and in counts_cache, under cache_key.
+        With stratify set, raw_data becomes a dictionary of training and validation datasets, which SplitTFDataset
+        batches as is.
+        :param config: Configuration for the class balancing stage.
+        """
+        self.config = config
+        # Counts by cache key
+        self.class_counts: Dict[str, np.ndarray] = {}
+
+    def accept(self, dto: DTO) -> Union[None, SkipStageError, SkipPipelineError]:
+        """
+        Check that there is a dataset to balance and the class names to balance it over.
+        :param dto:
+        :return:
+        """
+        if not isinstance(dto.raw_data, tf.data.Dataset):
+            raise SkipStageError("Raw data must be a TensorFlow Dataset to balance classes.")
+
+        if not dto.class_names:
+            raise SkipStageError("Class names are needed to balance classes.")
+
+        target = self.config.target_distribution
+        if target is not None and (len(target) != len(dto.class_names) or min(target) < 0 or sum(target) <= 0):
+            raise SkipPipelineError("Target distribution must hold a non-negative weight for every class.")
+
+        if not 0.0 < self.config.train_ratio < 1.0:
+            raise SkipPipelineError("Train ratio must be between 0 and 1.")
+
+        return None
+
+    def run(self, dto: DTO) -> DTO:
+        dataset = dto.raw_data
+        counts = self.counts(dataset, len(dto.class_names))
+        if not self.config.stratify:
+            print(f"Class counts: {dict(zip(dto.class_names, counts.tolist()))}")
+            print("Warning: rebalancing without stratify, don't split the result into training and validation data, "
+                  "copies of an element would end up in both")
+            dto.raw_data = self.balance(dataset, counts)
+            return dto
+
+        train_counts, valid_counts = counts
+        print(f"Class counts: {dict(zip(dto.class_names, (train_counts + valid_counts).tolist()))}")
+
+        # Each split is one filter over the source, so each reads the source once per epoch.
+        train = dataset.filter(lambda *element: self.in_train(*element))
+        dto.raw_data = {
+            SplitEnum.TRAIN.value: self.balance(train, train_counts),
+            # Validation keeps the natural class mix.
+            SplitEnum.VALIDATION.value: dataset.filter(lambda *element: tf.logical_not(self.in_train(*element))),
+        }
+        return dto
+
+    def balance(self, source: tf.data.Dataset, counts: np.ndarray) -> tf.data.Dataset:
+        """
+        Resample towards the target distribution in a single pass over the source.
+        :param source: Dataset with the natural class mix.
+        :param counts: Elements of each class in the source.
+        :return:
+        """
+        # Classes without elements cannot be drawn from, so their share goes to the others.
+        target = self.target(len(counts))
+        target[counts == 0] = 0.0
+        target /= target.sum()
+
+        if self.config.method == BalanceMethod.REJECTION:
+            return (source
+                    .rejection_resample(lambda *element: tf.cast(self.label(*element), tf.int32),
+                                        target_dist=target.astype(np.float32),
+                                        initial_dist=(counts / counts.sum()).astype(np.float32),
+                                        seed=self.config.seed)
+                    .map(lambda _, element: element))
+
+        # Expected copies of each element of a class, so a pass over the source yields about epoch_size elements.
+        epoch_size = self.config.epoch_size or int(counts.sum())
+        copies = tf.constant(np.divide(target * epoch_size, counts, out=np.zeros(len(counts)), where=counts > 0),
+                             dtype=tf.float32)
+        seed = self.config.seed
+
+        def repeat(index: tf.Tensor, element: Any) -> tf.data.Dataset:
+            label = self.label(*element) if isinstance(element, tuple) else self.label(element)
+            expected = tf.gather(copies, tf.cast(label, tf.int32))
+            # Round up or down at random, so fractional copies come out right on average.
+            draw = (tf.random.stateless_uniform([], seed=tf.stack([tf.constant(seed, tf.int64), index]))
+                    if seed is not None else tf.random.uniform([]))
+            count = tf.cast(tf.floor(expected + draw), tf.int64)
+            return tf.data.Dataset.from_tensors(element).repeat(count)
+
+        return (source
+                .enumerate()
+                .flat_map(repeat)
+                .shuffle(self.config.shuffle_buffer, seed=seed)
+                .repeat()
+                .take(epoch_size))
+
+    def in_train(self, *element: Any) -> tf.Tensor:
+        """
+        Whether an element belongs to the training split, from a hash of its contents.
+        :param element:
+        :return:
+        """
+        serialized = tf.strings.reduce_join([tf.io.serialize_tensor(t) for t in tf.nest.flatten(element)])
+        bucket = tf.strings.to_hash_bucket_fast(serialized, SPLIT_BUCKETS)
+        return bucket < int(round(self.config.train_ratio * SPLIT_BUCKETS))
+
+    def target(self, n_classes: int) -> np.ndarray:
+        target = self.config.target_distribution
+        target = np.ones(n_classes) if target is None else np.asarray(target, dtype=np.float64)
+        return target / target.sum()
+
+    @staticmethod
+    def label(*element: Any) -> tf.Tensor:
+        """
+        Label of a dataset element, either an (input, label) tuple or a feature dictionary with a label.
+        :param element:
+        :return:
+        """
+        if len(element) == 1 and isinstance(element[0], dict):
+            return element[0]["label"]
+        return element[1]
+
+    def cache_key(self) -> Optional[str]:
+        """Key of the counts in the caches, which tells stratified counts for each train ratio apart."""
+        key = self.config.cache_key
+        if key is None or not self.config.stratify:
+            return key
+        return f"{key}:stratified:{self.config.train_ratio}"
+
+    def counts(self, dataset: tf.data.Dataset, n_classes: int) -> np.ndarray:
+        """
+        Per-class element counts, from the cache or from a single pass over the labels.
+        :param dataset:
+        :param n_classes:
+        :return: Counts per class, or (train, validation) counts per class when stratifying.
+        """
+        shape = (2, n_classes) if self.config.stratify else (n_classes,)
+        key = self.cache_key()
+        if key in self.class_counts and self.class_counts[key].shape == shape:
+            return self.class_counts[key]
+
+        cached = self._read_cached_counts()
+        if cached is not None and np.shape(cached) == shape:
+            self.class_counts[key] = np.asarray(cached, dtype=np.int64)
+            return self.class_counts[key]
+
+        def bins(*element: Any) -> tf.Tensor:
+            label = tf.cast(self.label(*element), tf.int32)
+            if not self.config.stratify:
+                return label
+            # Validation elements count in the second half of the bins.
+            return label + n_classes * tf.cast(tf.logical_not(self.in_train(*element)), tf.int32)
+
+        size = n_classes * (2 if self.config.stratify else 1)
+        batches = dataset.map(bins, num_parallel_calls=tf.data.AUTOTUNE).batch(self.config.count_batch)
+        counts = batches.reduce(
+            tf.zeros([size], tf.int64),
+            lambda total, batch: total + tf.math.bincount(batch, minlength=size, maxlength=size, dtype=tf.int64))
+
+        counts = counts.numpy().reshape(shape)
+        if key is not None:
+            self.class_counts[key] = counts
+        self._write_cached_counts(counts.tolist())
+        return counts
+
+    def _read_cached_counts(self) -> Optional[List[Any]]:
+        if self.config.counts_cache is None or self.config.cache_key is None:
+            return None
+        if not os.path.exists(self.config.counts_cache):
+            return None
+        with open(self.config.counts_cache, "r") as f:
+            return json.load(f).get(self.cache_key())
+
+    def _write_cached_counts(self, counts: List[Any]) -> None:
+        if self.config.counts_cache is None or self.config.cache_key is None:
+            return
+
+        cache: Dict[str, List[Any]] = {}
+        if os.path.exists(self.config.counts_cache):
+            with open(self.config.counts_cache, "r") as f:
+                cache = json.load(f)
+        cache[self.cache_key()] = counts
+
+        temp_path = f"{self.config.counts_cache}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump(cache, f, indent=2)
+        os.replace(temp_path, self.config.counts_cache)
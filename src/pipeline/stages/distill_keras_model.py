@@ -0,0 +1,366 @@
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+import hashlib
+import json
+import os
+import time
+
+import keras
+import numpy as np
+import tensorflow as tf
+
+from src.model import DTO, SkipStageError, SkipPipelineError, SplitEnum
+from src.utils import tracing
+from src.pipeline.stage import Stage
+from src.pipeline.stages.apply_keras_sequential import ApplyKerasSequential
+from src.utils.model_cache import ModelCache, weights_hash
+
+# Directory in the model cache for teacher predictions, one file per teacher and dataset.
+PREDICTIONS_DIR = "teacher_predictions"
+
+# Inputs are looked up in the teacher predictions by a hash of their contents.
+MAX_ELEMENT_KEY = 2 ** 63 - 1
+
+# Keeps the log of zero probabilities finite.
+EPSILON = 1e-7
+
+
+class DistillConfig:
+    def __init__(self,
+                 epochs: int = 5,
+                 temperature: float = 4.0,
+                 alpha: float = 0.1,
+                 optimizer: str = 'adam',
+                 filters: Sequence[int] = (16, 32),
+                 dense_units: int = 64,
+                 rescale: Optional[float] = None,
+                 use_cache: bool = True,
+                 data_key: Optional[str] = None,
+                 replace_model: bool = True,
+                 latency_runs: int = 20,
+                 ):
+        """
+        Configuration for knowledge distillation.
+        :param epochs: Number of epochs to train the student.
+        :param temperature: Softmax temperature of the soft labels. Higher values pass on more of the teacher's
+            confidence in the wrong classes.
+        :param alpha: Weight of the loss on the true labels, the soft labels get the rest.
+        :param optimizer: Optimizer for the student.
+        :param filters: Filters of each convolution block of the default student. Non-image inputs skip them.
+        :param dense_units: Units of the hidden dense layer of the default student.
+        :param rescale: Factor to rescale inputs with in the default student, e.g. 1 / 255 for raw pixels.
+        :param use_cache: Whether to cache the student and the teacher predictions.
+        :param data_key: Identifies the training data in the teacher prediction cache. Only the teacher, the element
+            spec and the number of batches are part of the key, so set it when different data has the same shape.
+        :param replace_model: Replace the teacher in the DTO with the student, for inference with later stages.
+        :param latency_runs: Timed predictions per model in the report.
+        """
+        if temperature <= 0:
+            raise ValueError("Temperature must be positive.")
+        if not 0.0 <= alpha <= 1.0:
+            raise ValueError("Alpha must be between 0 and 1.")
+
+        self.epochs = epochs
+        self.temperature = temperature
+        self.alpha = alpha
+        self.optimizer = optimizer
+        self.filters = list(filters)
+        self.dense_units = dense_units
+        self.rescale = rescale
+        self.use_cache = use_cache
+        self.data_key = data_key
+        self.replace_model = replace_model
+        self.latency_runs = latency_runs
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Convert config to a dictionary for caching.
+        """
+        return {
+            "epochs": self.epochs,
+            "temperature": self.temperature,
+            "alpha": self.alpha,
+            "optimizer": self.optimizer,
+            "filters": self.filters,
+            "dense_units": self.dense_units,
+            "rescale": self.rescale,
+        }
+
+
+def distillation_loss(temperature: float, alpha: float):
+    """
+    Loss of the student on targets packing the teacher's soft labels with the true label in the last column.
+    :param temperature: Softmax temperature of the soft labels.
+    :param alpha: Weight of the loss on the true labels.
+    :return: Keras loss function.
+    """
+    def loss(y_true, y_pred):
+        soft_labels, labels = y_true[:, :-1], tf.cast(y_true[:, -1], tf.int32)
+        y_pred = tf.cast(y_pred, tf.float32)
+        hard_loss = tf.keras.losses.sparse_categorical_crossentropy(labels, y_pred)
+        # The student outputs probabilities, their logs are its logits up to a constant
+        soft_pred = tf.nn.softmax(tf.math.log(y_pred + EPSILON) / temperature)
+        soft_loss = tf.reduce_sum(
+            soft_labels * (tf.math.log(soft_labels + EPSILON) - tf.math.log(soft_pred + EPSILON)), axis=-1)
+        # Soft gradients shrink with 1 / temperature^2, scale them back up
+        return alpha * hard_loss + (1.0 - alpha) * temperature ** 2 * soft_loss
+
+    return loss
+
+
+def label_accuracy(y_true, y_pred):
+    """
+    Accuracy on the true labels in the last column of distillation targets.
+    """
+    predicted = tf.cast(tf.argmax(y_pred, axis=-1), tf.float32)
+    return tf.cast(tf.equal(predicted, y_true[:, -1]), tf.float32)
+
+
+class DistillKerasModel(Stage):
+    consumes = ("keras_model", "split_data", "class_names")
+
+    def __init__(self, config: DistillConfig, layers: Optional[List[keras.Layer]] = None,
+                 cache_dir: Optional[str] = None, model_cache: Optional[ModelCache] = None):
+        """
+        Distills dto.keras_model into a small student model trained on the teacher's soft labels.
+
+        The teacher predicts every training batch once, in a pass before training. Only its predictions are stored,
+        keyed by a hash of each input, in a file named after the teacher's model hash. The epochs, and later students
+        of the same teacher, look them up instead of running the teacher again, in whatever order the training data
+        yields the inputs. Batches with inputs the teacher has not seen, e.g. after random augmentation, are predicted
+        again. The student is stored in the model cache with the hash of its teacher,
+        together with a report of the accuracy and per-tile latency of both models on the validation data.
+        :param config: Configuration for knowledge distillation.
+        :param layers: Layers of the student. Defaults to a small CNN built from the config.
+        :param cache_dir: Optional directory for model caching.
+        :param model_cache: Optional preconfigured model cache. Takes precedence over cache_dir.
+        """
+        self.config = config
+        self.layers = layers
+        if model_cache is not None:
+            self.model_cache = model_cache
+        else:
+            self.model_cache = ModelCache(cache_dir) if cache_dir else ModelCache()
+        self.report: Optional[Dict[str, Any]] = None
+
+    def accept(self, dto: DTO) -> Union[None, SkipStageError, SkipPipelineError]:
+        """
+        Check that there is a teacher model and training data to distill it on.
+        :param dto:
+        :return:
+        """
+        if dto.keras_model is None:
+            raise SkipStageError("No teacher model to distill.")
+
+        if dto.split_data is None or not isinstance(dto.split_data.get(SplitEnum.TRAIN.value), tf.data.Dataset):
+            raise SkipStageError("Training data must be a TensorFlow Dataset to distill a model.")
+
+        if not dto.class_names:
+            raise SkipStageError("No class names available for the student model.")
+
+        if self.layers is None and ApplyKerasSequential.get_dataset_info(dto)["input_shape"] is None:
+            raise SkipStageError("Cannot infer the input shape of the default student, pass its layers instead.")
+
+        return None
+
+    def student_layers(self, input_shape: List[int], class_count: int) -> List[keras.Layer]:
+        """
+        Layers of the default student: convolution blocks for image inputs, then a small dense head.
+        :param input_shape: Input shape, without the batch dimension.
+        :param class_count: Number of classes.
+        :return:
+        """
+        # Fixed names keep the layer configs, and so the cache key of the student, the same across runs
+        layers: List[keras.Layer] = [keras.layers.InputLayer(shape=tuple(input_shape), name="student_input")]
+        if self.config.rescale is not None:
+            layers.append(keras.layers.Rescaling(self.config.rescale, name="student_rescale"))
+        if len(input_shape) == 3:
+            for i, filters in enumerate(self.config.filters):
+                layers.append(keras.layers.Conv2D(filters, 3, padding="same", activation="relu",
+                                                  name=f"student_conv_{i}"))
+                layers.append(keras.layers.MaxPooling2D(name=f"student_pool_{i}"))
+            layers.append(keras.layers.GlobalAveragePooling2D(name="student_global_pool"))
+        layers.append(keras.layers.Dense(self.config.dense_units, activation="relu", name="student_hidden"))
+        layers.append(keras.layers.Dense(class_count, activation="softmax", name="student_output"))
+        return layers
+
+    def predictions_key(self, teacher_hash: str, train: tf.data.Dataset) -> str:
+        """
+        Key of the teacher predictions for a training dataset.
+        :param teacher_hash: Model hash of the teacher.
+        :param train: Training dataset.
+        :return:
+        """
+        key = {
+            "teacher": teacher_hash,
+            "element_spec": str(train.element_spec),
+            "batches": int(train.cardinality()),
+            "data_key": self.config.data_key,
+        }
+        return hashlib.md5(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+    @staticmethod
+    def element_keys(x: tf.Tensor) -> tf.Tensor:
+        """
+        Hash of the contents of every input in a batch.
+        :param x: Batch of inputs.
+        :return: int64 key per input.
+        """
+        return tf.map_fn(lambda element: tf.strings.to_hash_bucket_fast(tf.io.serialize_tensor(element),
+                                                                        MAX_ELEMENT_KEY),
+                         x, fn_output_signature=tf.int64)
+
+    def teacher_predictions(self, teacher: keras.Model, train: tf.data.Dataset,
+                            key: str) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        The teacher's predictions of every training input, from the prediction cache or a pass over the data.
+        :param teacher: Teacher model.
+        :param train: Batched training dataset of inputs and labels.
+        :param key: Key of the teacher predictions in the prediction cache.
+        :return: Input keys, and the teacher's probabilities in the same order.
+        """
+        cache_path = os.path.join(self.model_cache.cache_dir, PREDICTIONS_DIR, f"{key}.npz")
+        if os.path.exists(cache_path):
+            print(f"Using cached teacher predictions (key: {key[:8]}...)")
+            with np.load(cache_path) as cached:
+                return cached["keys"], cached["probabilities"]
+
+        keys, probabilities = [], []
+        with tracing.span("teacher_predictions", key=key):
+            for x, _ in train:
+                keys.append(self.element_keys(x).numpy())
+                probabilities.append(tf.cast(teacher(x, training=False), tf.float32).numpy())
+        # Inputs that occur more than once have the same prediction
+        keys, first = np.unique(np.concatenate(keys), return_index=True)
+        probabilities = np.concatenate(probabilities)[first]
+
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        temp_path = f"{cache_path}.tmp.npz"
+        np.savez(temp_path, keys=keys, probabilities=probabilities)
+        os.replace(temp_path, cache_path)
+        return keys, probabilities
+
+    def soft_labels(self, teacher: keras.Model, train: tf.data.Dataset, key: str) -> tf.data.Dataset:
+        """
+        Pair every training batch with the teacher's soft labels and the true labels.
+        :param teacher: Teacher model.
+        :param train: Batched training dataset of inputs and labels.
+        :param key: Key of the teacher predictions in the prediction cache.
+        :return: Dataset of inputs and distillation targets.
+        """
+        def predict(x):
+            return tf.cast(teacher(x, training=False), tf.float32)
+
+        if self.config.use_cache:
+            keys, probabilities = self.teacher_predictions(teacher, train, key)
+            table = tf.lookup.StaticHashTable(
+                tf.lookup.KeyValueTensorInitializer(keys, np.arange(len(keys), dtype=np.int64)), default_value=-1)
+            probabilities = tf.constant(probabilities)
+
+            def lookup(x):
+                rows = table.lookup(self.element_keys(x))
+                return tf.cond(tf.reduce_all(rows >= 0),
+                               lambda: tf.gather(probabilities, tf.maximum(rows, 0)),
+                               lambda: predict(x))
+        else:
+            lookup = predict
+
+        temperature = self.config.temperature
+
+        def targets(x, y):
+            soft = tf.nn.softmax(tf.math.log(lookup(x) + EPSILON) / temperature)
+            return x, tf.concat([soft, tf.cast(tf.reshape(y, (-1, 1)), tf.float32)], axis=-1)
+
+        return train.map(targets)
+
+    def evaluate(self, model: keras.Model, data: tf.data.Dataset) -> Dict[str, float]:
+        """
+        Accuracy and per-tile latency of a model.
+        :param model: Model to evaluate.
+        :param data: Batched dataset of inputs and labels.
+        :return:
+        """
+        correct = total = 0
+        sample = None
+        for x, y in data:
+            sample = x if sample is None else sample
+            predicted = np.argmax(model.predict_on_batch(x), axis=-1)
+            correct += int(np.sum(predicted == np.reshape(y.numpy(), -1)))
+            total += len(predicted)
+
+        # The first call after evaluation may still trace, so it is not timed
+        model.predict_on_batch(sample)
+        timings = []
+        for _ in range(self.config.latency_runs):
+            start = time.perf_counter()
+            model.predict_on_batch(sample)
+            timings.append(time.perf_counter() - start)
+
+        return {
+            "accuracy": correct / total if total else 0.0,
+            "latency_ms": float(np.median(timings)) * 1000.0 / len(sample),
+            "parameters": int(model.count_params()),
+        }
+
+    def run(self, dto: DTO) -> DTO:
+        teacher = dto.keras_model
+        train = dto.split_data[SplitEnum.TRAIN.value]
+        validation = dto.split_data.get(SplitEnum.VALIDATION.value)
+        if validation is None:
+            validation = train
+        dataset_info = ApplyKerasSequential.get_dataset_info(dto)
+        teacher_hash = dto.model_hash or weights_hash(teacher)
+
+        layers = self.layers
+        if layers is None:
+            layers = self.student_layers(dataset_info["input_shape"], dataset_info["class_count"])
+        layers_config = ApplyKerasSequential.layers_config(layers)
+        student_info = {**dataset_info, "teacher": teacher_hash}
+
+        student = None
+        student_hash = None
+        if self.config.use_cache:
+            student_hash = self.model_cache.get_model_hash(layers_config, self.config.to_dict(), student_info)
+            student = self.model_cache.get_model(student_hash)
+            if student is not None:
+                print(f"Using cached student model (hash: {student_hash[:8]}...)")
+                self.report = self.model_cache.metadata[student_hash].get("distillation")
+
+        if student is None:
+            print(f"Distilling teacher (hash: {teacher_hash[:8]}...) into a student model...")
+            student = keras.Sequential(layers)
+            student.compile(optimizer=self.config.optimizer,
+                            loss=distillation_loss(self.config.temperature, self.config.alpha),
+                            metrics=[label_accuracy])
+
+            callbacks = tracing.training_callbacks()
+            fit_kwargs = {"callbacks": callbacks} if callbacks else {}
+            with tracing.span("distill", tracing.CATEGORY_TRAIN, epochs=self.config.epochs):
+                student.fit(self.soft_labels(teacher, train, self.predictions_key(teacher_hash, train)),
+                            epochs=self.config.epochs, **fit_kwargs)
+            # The distillation targets only exist in this stage, later stages and the cache get a plain classifier
+            student.compile(optimizer=self.config.optimizer, loss='sparse_categorical_crossentropy',
+                            metrics=['accuracy'])
+
+            teacher_report = self.evaluate(teacher, validation)
+            student_report = self.evaluate(student, validation)
+            self.report = {
+                "teacher": teacher_report,
+                "student": student_report,
+                "speedup": teacher_report["latency_ms"] / max(student_report["latency_ms"], 1e-9),
+            }
+
+            if self.config.use_cache:
+                self.model_cache.save_model(student, layers_config, self.config.to_dict(), student_info,
+                                            extra_metadata={"teacher": teacher_hash, "distillation": self.report})
+
+        if self.report is not None:
+            print(f"{'model':<9}{'accuracy':>10}{'ms/tile':>10}{'params':>12}")
+            for name in ("teacher", "student"):
+                row = self.report[name]
+                print(f"{name:<9}{row['accuracy']:>10.3f}{row['latency_ms']:>10.3f}{row['parameters']:>12,}")
+            print(f"Student is {self.report['speedup']:.1f}x faster per tile")
+
+        if self.config.replace_model:
+            dto.keras_model = student
+            dto.model_hash = student_hash
+        return dto
@@ -0,0 +1,248 @@
+from typing import Callable, List, Optional, Sequence, Tuple, Union
+import enum
+import os
+
+import numpy as np
+import tensorflow as tf
+
+from src.model import DTO, SkipStageError, SkipPipelineError
+from src.pipeline.stage import Stage
+
+# File next to the shards listing one class name per line, used when no class names are configured.
+CLASS_NAMES_FILE = "class_names.txt"
+
+# Records of a .npy shard decoded in one step.
+NPY_BLOCK_SIZE = 256
+
+
+class ShardFormat(enum.Enum):
+    TFRECORD = "tfrecord"
+    NPY = "npy"
+
+
+class ShardConfig:
+    def __init__(self,
+                 pattern: str,
+                 shard_format: ShardFormat = ShardFormat.TFRECORD,
+                 class_names: Optional[Sequence[str]] = None,
+                 shuffle_files: bool = True,
+                 seed: Optional[int] = None,
+                 cycle_length: Optional[int] = None,
+                 block_length: int = 1,
+                 image_key: str = "image",
+                 label_key: str = "label",
+                 image_dtype: tf.DType = tf.uint8,
+                 buffer_size: int = 8 * 1024 * 1024,
+                 parse_fn: Optional[Callable[[tf.Tensor], Tuple[tf.Tensor, tf.Tensor]]] = None,
+                 ):
+        """
+        Configuration for the sharded local extractor.
+        :param pattern: Glob matching the shards, e.g. /data/eurosat/train-*.tfrecord or /data/eurosat/image-*.npy.
+        :param shard_format: TFRecord files, or pairs of .npy files holding images and labels.
+        :param class_names: Class names in label order. Read from class_names.txt next to the shards when omitted.
+        :param shuffle_files: Shuffle the order in which shards are read.
+        :param seed: Seed for the shard shuffle.
+        :param cycle_length: Number of shards read concurrently. Defaults to AUTOTUNE.
+        :param block_length: Consecutive elements taken from a shard before moving to the next one.
+        :param image_key: TFRecord feature holding the image, and the .npy file prefix for images.
+        :param label_key: TFRecord feature holding the label, and the .npy file prefix for labels.
+        :param image_dtype: Dtype of the serialized image tensors in TFRecord shards.
+        :param buffer_size: Read buffer per TFRecord or .npy file, in bytes.
+        :param parse_fn: Parses a serialized record into (image, label). Overrides the default feature parsing.
+        """
+        self.pattern = pattern
+        self.shard_format = shard_format
+        self.class_names = list(class_names) if class_names is not None else None
+        self.shuffle_files = shuffle_files
+        self.seed = seed
+        self.cycle_length = cycle_length
+        self.block_length = block_length
+        self.image_key = image_key
+        self.label_key = label_key
+        self.image_dtype = image_dtype
+        self.buffer_size = buffer_size
+        self.parse_fn = parse_fn
+
+
+class ExtractFromShards(Stage):
+    consumes = ()
+
+    def __init__(self, config: ShardConfig):
+        """
+        Reads (image, label) pairs from local TFRecord or .npy shards into a tf.data pipeline.
+
+        TFRecord shards are read with a parallel interleave, so several files are in flight at once. By default each
+        record holds the image as a tf.io.serialize_tensor string and the label as an int64 feature.
+
+        .npy shards come in pairs, e.g. image-00000.npy and label-00000.npy. Only their headers are read up front. The
+        data is read in-graph with FixedLengthRecordDataset, one fixed-size record per element, as the interleave
+        reaches a shard, so shards are read in parallel without Python in the loop.
+        Incremental runs can restrict the extractor to some of its shards with `select_inputs`, see with_manifest.
+        :param config: Configuration for the sharded extractor.
+        """
+        self.config = config
+        # Shards to read instead of every shard matching the pattern
+        self.selected: Optional[List[str]] = None
+
+    def accept(self, dto: DTO) -> Union[None, SkipStageError, SkipPipelineError]:
+        """
+        Check that the pattern matches at least one shard.
+        :param dto:
+        :return:
+        """
+        if not tf.io.gfile.glob(self.config.pattern):
+            raise SkipPipelineError(f"No shards match {self.config.pattern}.")
+        if self.selected is not None and not self.selected:
+            raise SkipPipelineError(f"No shards selected from {self.config.pattern}.")
+
+        return None
+
+    def shards(self) -> List[str]:
+        """
+        Every shard matching the pattern, in order. For .npy shards these are the image files.
+        :return:
+        """
+        return sorted(tf.io.gfile.glob(self.config.pattern))
+
+    def inputs(self) -> List[str]:
+        """
+        Every file the shards are read from, in order. For .npy shards these are the image and the label files, so a
+        manifest notices changed labels too.
+        :return:
+        """
+        shards = self.shards()
+        if self.config.shard_format == ShardFormat.NPY:
+            return sorted(shards + [self.label_path(path) for path in shards])
+        return shards
+
+    def select_inputs(self, paths: Optional[Sequence[str]]) -> None:
+        """
+        Restrict the next runs to some of the shards.
+        :param paths: Files to read, from `inputs`. A .npy label file selects its image shard. None reads every shard
+            again.
+        """
+        if paths is None:
+            self.selected = None
+            return
+        if self.config.shard_format == ShardFormat.NPY:
+            image_paths = {self.label_path(path): path for path in self.shards()}
+            paths = [image_paths.get(path, path) for path in paths]
+        self.selected = sorted(set(paths))
+
+    def run(self, dto: DTO) -> DTO:
+        files = self.selected if self.selected is not None else self.shards()
+
+        if self.config.shard_format == ShardFormat.NPY:
+            dataset = self.read_npy(files)
+        else:
+            dataset = self.read_tfrecord(files)
+
+        dto.raw_data = dataset.prefetch(tf.data.AUTOTUNE)
+        dto.class_names = self.class_names(files)
+
+        print(f"Reading {len(files)} {self.config.shard_format.value} shards from {self.config.pattern}")
+        return dto
+
+    def read_tfrecord(self, files: List[str]) -> tf.data.Dataset:
+        config = self.config
+        parse = config.parse_fn or self.parse_example
+
+        dataset = tf.data.Dataset.from_tensor_slices(files)
+        if config.shuffle_files:
+            dataset = dataset.shuffle(len(files), seed=config.seed)
+
+        return (dataset
+                .interleave(lambda f: tf.data.TFRecordDataset(f, buffer_size=config.buffer_size),
+                            cycle_length=config.cycle_length or tf.data.AUTOTUNE,
+                            block_length=config.block_length,
+                            num_parallel_calls=tf.data.AUTOTUNE,
+                            deterministic=not config.shuffle_files)
+                .map(parse, num_parallel_calls=tf.data.AUTOTUNE, deterministic=not config.shuffle_files))
+
+    def parse_example(self, record: tf.Tensor) -> Tuple[tf.Tensor, tf.Tensor]:
+        features = tf.io.parse_single_example(record, {
+            self.config.image_key: tf.io.FixedLenFeature([], tf.string),
+            self.config.label_key: tf.io.FixedLenFeature([], tf.int64),
+        })
+        image = tf.io.parse_tensor(features[self.config.image_key], out_type=self.config.image_dtype)
+        return image, features[self.config.label_key]
+
+    @staticmethod
+    def npy_header(path: str) -> Tuple[Tuple[int, ...], np.dtype, int]:
+        """
+        Shape, dtype and header length of a .npy file, without reading its data.
+        :param path: .npy file.
+        :return:
+        """
+        with open(path, "rb") as f:
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+            header_bytes = f.tell()
+        if fortran_order or dtype.hasobject or not shape:
+            raise ValueError(f"{path} must hold a C-ordered array of fixed-size elements.")
+        return shape, dtype, header_bytes
+
+    def read_npy(self, files: List[str]) -> tf.data.Dataset:
+        config = self.config
+        if config.shuffle_files:
+            files = [files[i] for i in np.random.default_rng(config.seed).permutation(len(files))]
+
+        # Only the headers are read here, to check the pairs and find where the data of every shard starts.
+        label_files = [self.label_path(path) for path in files]
+        headers = []
+        layouts = set()
+        for path, label_path in zip(files, label_files):
+            image_shape, image_dtype, image_header = self.npy_header(path)
+            label_shape, label_dtype, label_header = self.npy_header(label_path)
+            if image_shape[0] != label_shape[0]:
+                raise ValueError(f"{path} holds {image_shape[0]} images but its labels hold {label_shape[0]}.")
+            layouts.add((image_shape[1:], image_dtype, label_shape[1:], label_dtype))
+            headers.append((image_header, label_header))
+        if len(layouts) > 1:
+            raise ValueError(f"Shards matching {config.pattern} differ in element shape or dtype.")
+        image_shape, image_dtype, label_shape, label_dtype = layouts.pop()
+
+        def records(path: tf.Tensor, header_bytes: tf.Tensor, shape: Tuple[int, ...],
+                    dtype: np.dtype) -> tf.data.Dataset:
+            # Decode a block of records at once, then split it back into elements
+            return (tf.data.FixedLengthRecordDataset(path, record_bytes=int(np.prod(shape)) * dtype.itemsize,
+                                                     header_bytes=header_bytes, buffer_size=config.buffer_size)
+                    .batch(NPY_BLOCK_SIZE)
+                    .map(lambda block: tf.reshape(
+                        tf.io.decode_raw(block, tf.as_dtype(dtype.newbyteorder("=")),
+                                         little_endian=dtype.byteorder != ">"),
+                        (-1, *shape)))
+                    .unbatch())
+
+        def read_shard(path, label_path, image_header, label_header):
+            return tf.data.Dataset.zip((records(path, image_header, image_shape, image_dtype),
+                                        records(label_path, label_header, label_shape, label_dtype)))
+
+        image_headers, label_headers = zip(*headers)
+        # Interleave the shards, the same way TFRecord files are interleaved.
+        return (tf.data.Dataset.from_tensor_slices((files, label_files, tf.constant(image_headers, tf.int64),
+                                                    tf.constant(label_headers, tf.int64)))
+                .interleave(read_shard,
+                            cycle_length=config.cycle_length or tf.data.AUTOTUNE,
+                            block_length=config.block_length,
+                            num_parallel_calls=tf.data.AUTOTUNE,
+                            deterministic=not config.shuffle_files))
+
+    def label_path(self, image_path: str) -> str:
+        directory, name = os.path.split(image_path)
+        if not name.startswith(self.config.image_key):
+            raise ValueError(f"Image shard {name} does not start with {self.config.image_key}.")
+        return os.path.join(directory, self.config.label_key + name[len(self.config.image_key):])
+
+    def class_names(self, files: List[str]) -> Optional[List[str]]:
+        if self.config.class_names is not None:
+            return self.config.class_names
+
+        path = os.path.join(os.path.dirname(files[0]), CLASS_NAMES_FILE)
+        if not tf.io.gfile.exists(path):
+            return None
+        with tf.io.gfile.GFile(path) as f:
+            return [line.strip() for line in f if line.strip()]
@@ -1,9 +1,9 @@
 import enum
-from typing import Any, Union
+from typing import Any, Dict, Optional, Sequence, Union
 
 import tensorflow_datasets as tfds
 
-from src.model import DTO, SkipStageError, SkipPipelineError
+from src.model import DTO, SkipStageError, SkipPipelineError, SplitEnum
 from src.pipeline.stage import Stage
 
 
@@ -14,12 +14,84 @@ class DatasetSplit(enum.Enum):
 
 
 class ExtractFromTensorFlow(Stage):
-    def __init__(self, name: str, split: DatasetSplit = DatasetSplit.TRAIN, with_info: bool = False,
-                 as_supervised: bool = False):
+    consumes = ()
+
+    def __init__(self, name: str, split: Union[DatasetSplit, str, Dict[str, str]] = DatasetSplit.TRAIN,
+                 with_info: bool = False,
+                 as_supervised: bool = False,
+                 read_config: Optional[tfds.ReadConfig] = None,
+                 decoders: Optional[Dict[str, tfds.decode.Decoder]] = None,
+                 skip_decoding: Sequence[str] = (),
+                 shuffle_files: Optional[bool] = None,
+                 data_dir: Optional[str] = None):
+        """
+        :param name: TFDS dataset name.
+        :param split: Split to load. Either a split, a TFDS split expression such as "train[:80%]", which reads only
+            the shards it covers, or a dictionary of named expressions, which loads a dictionary of datasets.
+        :param with_info: Also load the dataset info, which holds the class names.
+        :param as_supervised: Yield (input, label) tuples instead of feature dictionaries.
+        :param read_config: TFDS read options, e.g. interleave cycle length, file shuffling and autocaching.
+        :param decoders: Custom decoders per feature.
+        :param skip_decoding: Features to leave encoded, e.g. ["image"], so decoding can happen later in the pipeline.
+        :param shuffle_files: Shuffle the order of the input files.
+        :param data_dir: Directory holding the prepared dataset, e.g. on fast local disk.
+        """
         self.split = split
         self.name = name
         self.with_info = with_info
         self.as_supervised = as_supervised
+        self.read_config = read_config
+        self.decoders = dict(decoders or {})
+        for feature in skip_decoding:
+            self.decoders[feature] = tfds.decode.SkipDecoding()
+        self.shuffle_files = shuffle_files
+        self.data_dir = data_dir
+
+    def base_split(self) -> str:
+        """
+        Name of the split being read, without any slicing, e.g. "train" for "train[:80%]".
+        :return:
+        """
+        if isinstance(self.split, DatasetSplit):
+            return self.split.value
+        if isinstance(self.split, dict):
+            splits = {expression.split("[")[0] for expression in self.split.values()}
+            if len(splits) != 1:
+                raise ValueError(f"Split expressions {self.split} read from more than one split.")
+            return splits.pop()
+        return self.split.split("[")[0]
+
+    def push_split(self, train_ratio: float, valid_ratio: float) -> None:
+        """
+        Load the training and validation ratios as a dictionary of TFDS slices, e.g. train[:80%] and train[80%:100%],
+        so each split reads only its own shards instead of the whole split being read and cut with take/skip.
+        :param train_ratio: Ratio of the split used for training.
+        :param valid_ratio: Ratio of the split used for validation, following the training slice.
+        :return:
+        """
+        split = self.base_split()
+        train_end = round(train_ratio * 100, 6)
+        valid_end = round(min(train_ratio + valid_ratio, 1.0) * 100, 6)
+        self.split = {
+            SplitEnum.TRAIN.value: f"{split}[:{train_end:g}%]",
+            SplitEnum.VALIDATION.value: f"{split}[{train_end:g}%:{valid_end:g}%]",
+        }
+
+    def load_kwargs(self) -> Dict[str, Any]:
+        """
+        Optional tfds.load arguments, only those that were set, so TFDS keeps its own defaults otherwise.
+        :return:
+        """
+        kwargs: Dict[str, Any] = {}
+        if self.read_config is not None:
+            kwargs["read_config"] = self.read_config
+        if self.decoders:
+            kwargs["decoders"] = self.decoders
+        if self.shuffle_files is not None:
+            kwargs["shuffle_files"] = self.shuffle_files
+        if self.data_dir is not None:
+            kwargs["data_dir"] = self.data_dir
+        return kwargs
 
     def accept(self, dto: DTO) -> Union[None, SkipStageError, SkipPipelineError]:
         """
@@ -31,7 +103,7 @@ class ExtractFromTensorFlow(Stage):
 
     def run(self, dto: DTO) -> DTO:
         dataset, info = tfds.load(self.name, split=self.split, with_info=self.with_info,
-                                  as_supervised=self.as_supervised)
+                                  as_supervised=self.as_supervised, **self.load_kwargs())
         dto.raw_data = dataset
         dto.class_names = info.features['label'].names
 
@@ -0,0 +1,44 @@
+from typing import List, Union
+
+from src.model import DTO, SkipStageError, SkipPipelineError
+from src.pipeline.stage import Stage
+
+
+class FanOut(Stage):
+    def __init__(self, stages: List[Stage]):
+        """
+        Runs several stages against the same DTO, typically multiple data sinks.
+
+        The synchronous pipeline runs the branches one after another, `AsyncPipeline` runs them concurrently. Both run
+        every branch under its own retry, timeout and circuit breaker policy. Branches share the DTO, so they must only
+        read from it.
+        :param stages: Stages to fan the DTO out to.
+        """
+        self.stages = stages
+
+        # The fan-out reads whatever its branches read, and anything at all if one of them doesn't say.
+        branch_consumes = [getattr(s, "consumes", None) for s in stages]
+        if all(isinstance(c, tuple) for c in branch_consumes):
+            self.consumes = tuple(sorted({field for c in branch_consumes for field in c}))
+
+    def accept(self, dto: DTO) -> Union[None, SkipStageError, SkipPipelineError]:
+        """
+        Each branch checks its own preconditions.
+        :param dto:
+        :return:
+        """
+        return None
+
+    def run(self, dto: DTO) -> DTO:
+        """
+        Run every branch. A branch raising SkipStageError does not stop the others.
+        :param dto:
+        :return: The input DTO.
+        """
+        for s in self.stages:
+            try:
+                s.run(dto)
+            except SkipStageError as e:
+                print(f"Hiccup, skipping branch {s.__class__.__name__}: {e}")
+
+        return dto
@@ -0,0 +1,221 @@
+from typing import Dict, Optional, Tuple, Union
+
+import numpy as np
+
+from src.model import DTO, SkipStageError, SkipPipelineError
+from src.utils import tracing
+from src.pipeline.stage import Stage
+from src.pipeline.stages.apply_sliding_window import NODATA_CLASS, load_scene, window_grid
+
+# Reasons a window is skipped, in the order they are checked. A window counts towards the first reason that applies.
+SKIP_REASONS = ("nodata", "masked", "brightness", "variance")
+
+
+class TileFilterConfig:
+    def __init__(self,
+                 window: int = 64,
+                 stride: int = 32,
+                 nodata: Optional[float] = 0,
+                 max_nodata_fraction: float = 0.5,
+                 mask_band: Optional[int] = None,
+                 max_masked_fraction: float = 0.5,
+                 min_brightness: Optional[float] = None,
+                 max_brightness: Optional[float] = None,
+                 min_variance: Optional[float] = None,
+                 labels: Optional[Dict[str, int]] = None,
+                 ):
+        """
+        Configuration for the tile prefilter.
+        :param window: Window size in pixels. Must match the sliding-window inference.
+        :param stride: Step between windows in pixels. Must match the sliding-window inference.
+        :param nodata: Pixel value that marks nodata when every band has it, or None if the scene has no nodata.
+        :param max_nodata_fraction: Skip windows with a larger share of nodata pixels.
+        :param mask_band: Band whose non-zero pixels are masked, e.g. a cloud mask. It is left out of the brightness
+            and variance statistics. Keep it from the model with SlidingWindowConfig(bands=...).
+        :param max_masked_fraction: Skip windows with a larger share of masked pixels.
+        :param min_brightness: Skip windows whose mean pixel value is lower, e.g. dark water.
+        :param max_brightness: Skip windows whose mean pixel value is higher, e.g. bright cloud without a mask band.
+        :param min_variance: Skip windows whose pixel variance, computed per band and averaged over the bands, is
+            lower, e.g. flat water or fill. Differences between the bands of a flat window don't count as variance.
+        :param labels: Class to label windows skipped for a reason with, e.g. {"brightness": 3} for water. Windows
+            skipped for reasons without a class are left out of the prediction raster.
+        """
+        unknown = set(labels or {}) - set(SKIP_REASONS)
+        if unknown:
+            raise ValueError(f"Unknown skip reasons {sorted(unknown)}, expected some of {SKIP_REASONS}")
+        if stride < 1 or window % stride != 0:
+            raise ValueError("Stride must be a positive divisor of the window size")
+
+        self.window = window
+        self.stride = stride
+        self.nodata = nodata
+        self.max_nodata_fraction = max_nodata_fraction
+        self.mask_band = mask_band
+        self.max_masked_fraction = max_masked_fraction
+        self.min_brightness = min_brightness
+        self.max_brightness = max_brightness
+        self.min_variance = min_variance
+        self.labels = labels or {}
+
+
+class FilterTiles(Stage):
+    consumes = ("raw_data",)
+
+    def __init__(self, config: TileFilterConfig, scene_path: Optional[str] = None):
+        """
+        Decides, before sliding-window inference, which windows of a scene are worth a model call.
+
+        Statistics of every window are computed from per-cell sums, where a cell is stride x stride pixels, so each
+        pixel is read once however much the windows overlap. Skipped windows are either left out or labeled with a
+        fixed class, in `dto.window_labels`, which ApplySlidingWindow follows. The counters on the stage show how many
+        windows were skipped, and why.
+        :param config: Configuration for the tile prefilter.
+        :param scene_path: Raster to filter. If None, `dto.raw_data` must hold the scene as an (H, W, C) array.
+        """
+        self.config = config
+        self.scene_path = scene_path
+        # Totals over every run of the stage
+        self.windows_total = 0
+        self.windows_skipped: Dict[str, int] = {reason: 0 for reason in SKIP_REASONS}
+
+    def accept(self, dto: DTO) -> Union[None, SkipStageError, SkipPipelineError]:
+        """
+        Check that there is a scene to filter.
+        :param dto:
+        :return:
+        """
+        if self.scene_path is None and not (isinstance(dto.raw_data, np.ndarray) and dto.raw_data.ndim == 3):
+            raise SkipStageError("Tile filtering needs a scene path or an (H, W, C) array in raw_data.")
+
+        return None
+
+    def window_stats(self, scene: np.ndarray) -> Dict[str, np.ndarray]:
+        """
+        Nodata and masked fractions, brightness and variance of every window.
+        :param scene: (H, W, C) scene.
+        :return: (rows, cols) arrays per statistic. Brightness and variance are NaN for windows without valid pixels.
+            Variance is the mean of the per-band variances.
+        """
+        window, stride = self.config.window, self.config.stride
+        height, width = scene.shape[:2]
+        rows, cols = window_grid(height, width, window, stride)
+        cell_rows = rows - 1 + window // stride
+        cell_cols = cols - 1 + window // stride
+
+        window_sums = {}
+        cells = window // stride
+        for name, cell in self.cell_sums(scene, cell_rows, cell_cols).items():
+            # Windows of cells from a summed-area table
+            band_shape = cell.shape[2:]
+            table = np.pad(cell.cumsum(axis=0).cumsum(axis=1), ((1, 0), (1, 0)) + ((0, 0),) * len(band_shape))
+            window_sums[name] = (table[cells:cells + rows, cells:cells + cols] - table[:rows, cells:cells + cols]
+                                 - table[cells:cells + rows, :cols] + table[:rows, :cols])
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            valid_pixels = window_sums["valid"][..., None]
+            band_mean = window_sums["sum"] / valid_pixels
+            band_variance = window_sums["sum_sq"] / valid_pixels - np.square(band_mean)
+            stats = {
+                "nodata": window_sums["nodata"] / window_sums["inside"],
+                "brightness": band_mean.mean(axis=-1),
+                "variance": band_variance.mean(axis=-1),
+            }
+            if "masked" in window_sums:
+                stats["masked"] = window_sums["masked"] / window_sums["inside"]
+        return stats
+
+    def cell_sums(self, scene: np.ndarray, cell_rows: int, cell_cols: int) -> Dict[str, np.ndarray]:
+        """
+        Per-cell pixel counts and per-band sums, accumulated one strip of `stride` rows at a time, so only a strip is
+        ever held at float64.
+        :param scene: (H, W, C) scene.
+        :param cell_rows: Cell rows, covering the scene height.
+        :param cell_cols: Cell columns, covering the scene width.
+        :return: (cell_rows, cell_cols) arrays, (cell_rows, cell_cols, bands) for the per-band sums.
+        """
+        stride = self.config.stride
+        height, width, band_count = scene.shape
+        bands = [b for b in range(band_count) if b != self.config.mask_band]
+        names = ["inside", "nodata", "valid"] + (["masked"] if self.config.mask_band is not None else [])
+        sums = {name: np.zeros((cell_rows, cell_cols)) for name in names}
+        sums["sum"] = np.zeros((cell_rows, cell_cols, len(bands)))
+        sums["sum_sq"] = np.zeros((cell_rows, cell_cols, len(bands)))
+
+        for row in range(min(cell_rows, -(-height // stride))):
+            strip = scene[row * stride:(row + 1) * stride]
+            values = strip[..., bands].astype(np.float64)
+            if self.config.nodata is not None:
+                nodata = np.all(strip[..., bands] == self.config.nodata, axis=-1)
+            else:
+                nodata = np.zeros(strip.shape[:2], dtype=bool)
+            valid = ~nodata
+            values[nodata] = 0.0
+
+            pixels = {
+                "inside": np.ones(strip.shape[:2]),
+                "nodata": nodata,
+                "valid": valid,
+                "sum": values,
+                "sum_sq": np.square(values),
+            }
+            if self.config.mask_band is not None:
+                pixels["masked"] = strip[..., self.config.mask_band] != 0
+
+            for name, strip_pixels in pixels.items():
+                # Sum the strip's rows, then stride-wide runs of columns
+                columns = np.zeros((cell_cols * stride,) + strip_pixels.shape[2:])
+                columns[:width] = strip_pixels.sum(axis=0)
+                sums[name][row] = columns.reshape(cell_cols, stride, *strip_pixels.shape[2:]).sum(axis=1)
+        return sums
+
+    def window_labels(self, stats: Dict[str, np.ndarray]) -> Tuple[np.ndarray, Dict[str, int]]:
+        """
+        Class of every window: -1 to run the model, a fixed class, or NODATA_CLASS to leave it out.
+        :param stats: Window statistics.
+        :return: Window classes, and the number of windows skipped per reason.
+        """
+        config = self.config
+        brightness = stats["brightness"]
+        skip = {
+            "nodata": stats["nodata"] > config.max_nodata_fraction,
+            "masked": stats["masked"] > config.max_masked_fraction if "masked" in stats else None,
+            "brightness": None,
+            "variance": stats["variance"] < config.min_variance if config.min_variance is not None else None,
+        }
+        if config.min_brightness is not None or config.max_brightness is not None:
+            skip["brightness"] = np.zeros(brightness.shape, dtype=bool)
+            if config.min_brightness is not None:
+                skip["brightness"] |= brightness < config.min_brightness
+            if config.max_brightness is not None:
+                skip["brightness"] |= brightness > config.max_brightness
+
+        labels = np.full(brightness.shape, -1, dtype=np.int16)
+        skipped = {}
+        for reason in SKIP_REASONS:
+            if skip[reason] is None:
+                continue
+            # Earlier reasons take precedence
+            newly = skip[reason] & (labels == -1)
+            labels[newly] = config.labels.get(reason, NODATA_CLASS)
+            skipped[reason] = int(newly.sum())
+        return labels, skipped
+
+    def run(self, dto: DTO) -> DTO:
+        """
+        Compute window statistics and record which windows the model can skip.
+        :param dto:
+        :return:
+        """
+        scene, _, _ = load_scene(self.scene_path, dto)
+        with tracing.span("filter_tiles", pixels=scene.shape[0] * scene.shape[1]):
+            labels, skipped = self.window_labels(self.window_stats(scene))
+        dto.window_labels = labels
+
+        self.windows_total += labels.size
+        for reason, count in skipped.items():
+            self.windows_skipped[reason] += count
+        total = sum(skipped.values())
+        reasons = ", ".join(f"{count} {reason}" for reason, count in skipped.items() if count)
+        print(f"Prefilter skipped {total} of {labels.size} windows ({total / max(labels.size, 1):.0%} of inference)"
+              + (f": {reasons}" if reasons else ""))
+        return dto
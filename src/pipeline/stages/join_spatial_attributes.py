@@ -0,0 +1,185 @@
+from typing import Any, Dict, List, Optional, Union
+import os
+import pickle
+
+import geopandas as gpd
+import numpy as np
+import shapely
+
+from src.model import DEFAULT_CRS, DTO, SkipStageError, SkipPipelineError
+from src.utils import tracing
+from src.pipeline.stage import Stage
+
+# Bump when the layout of the tree cache file changes, so old caches are rebuilt instead of misread.
+TREE_CACHE_VERSION = 1
+
+
+class JoinSpatialAttributesConfig:
+    def __init__(self,
+                 polygons_path: str,
+                 attributes: List[str],
+                 predicate: str = "intersects",
+                 prefix: str = "",
+                 crs: Optional[str] = None,
+                 tree_cache: Optional[str] = None,
+                 missing: Any = None,
+                 ):
+        """
+        Configuration for the spatial join stage.
+        :param polygons_path: Polygon layer to join with, any format geopandas reads, e.g. admin regions or parcels.
+        :param attributes: Columns of the polygon layer to attach to every prediction.
+        :param predicate: Shapely predicate a prediction and a polygon must satisfy, e.g. "intersects" or "within".
+        :param prefix: Prefix of the attached columns, to avoid clashes with prediction columns.
+        :param crs: CRS of the prediction geometries. Defaults to the CRS of the DTO. The polygon layer is reprojected
+            to it when loaded.
+        :param tree_cache: File to keep the polygon layer and its STRtree in between runs.
+        :param missing: Value of the attached columns for predictions outside every polygon.
+        """
+        self.polygons_path = polygons_path
+        self.attributes = attributes
+        self.predicate = predicate
+        self.prefix = prefix
+        self.crs = crs
+        self.tree_cache = tree_cache
+        self.missing = missing
+
+
+class JoinSpatialAttributes(Stage):
+    consumes = ("processed_data",)
+
+    def __init__(self, config: JoinSpatialAttributesConfig):
+        """
+        Attaches attributes of a polygon layer to the predictions in processed_data.
+
+        The polygon layer is loaded once per stage and indexed with a shapely STRtree. All prediction geometries are
+        matched in a single bulk tree query, and the attributes are gathered with array indexing, so no Python code
+        runs per feature. With tree_cache set, the loaded layer and its tree are pickled next to a fingerprint of the
+        source file, and later runs skip reading and reprojecting the layer until the source changes.
+        :param config: Configuration for the spatial join stage.
+        """
+        self.config = config
+        self.tree: Optional[shapely.STRtree] = None
+        self.crs: Optional[str] = None
+        self.attributes: Optional[Dict[str, np.ndarray]] = None
+        self.matched = 0
+
+    def accept(self, dto: DTO) -> Union[None, SkipStageError, SkipPipelineError]:
+        """
+        Check that there are prediction geometries to join.
+        :param dto:
+        :return:
+        """
+        if dto.processed_data is None:
+            raise SkipStageError("No processed data to join with polygons.")
+
+        data = dto.processed_data
+        if "geometry" not in data and not ("lon" in data and "lat" in data):
+            raise SkipStageError("Processed data needs a geometry column or lon/lat columns.")
+
+        return None
+
+    def fingerprint(self, crs: str) -> Dict[str, Any]:
+        """
+        Identifies the polygon layer and the settings it was loaded with, to validate the tree cache.
+        :param crs: CRS the layer is loaded in.
+        :return:
+        """
+        stat = os.stat(self.config.polygons_path)
+        return {
+            "version": TREE_CACHE_VERSION,
+            "path": os.path.abspath(self.config.polygons_path),
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "attributes": list(self.config.attributes),
+            "crs": crs,
+        }
+
+    def load(self, crs: str = DEFAULT_CRS) -> None:
+        """
+        Load the polygon layer and its STRtree, from the tree cache when it is still valid.
+        :param crs: CRS of the prediction geometries.
+        """
+        if self.tree is not None and self.crs == crs:
+            return
+
+        self.crs = crs
+        fingerprint = self.fingerprint(crs)
+        if self.config.tree_cache and os.path.exists(self.config.tree_cache):
+            try:
+                with open(self.config.tree_cache, "rb") as f:
+                    cached = pickle.load(f)
+                if cached["fingerprint"] == fingerprint:
+                    self.tree, self.attributes = cached["tree"], cached["attributes"]
+                    print(f"Using cached polygon tree from {self.config.tree_cache}")
+                    return
+            except (OSError, pickle.UnpicklingError, KeyError, EOFError) as e:
+                print(f"Ignoring unreadable polygon tree cache {self.config.tree_cache}: {e}")
+
+        with tracing.span("read_polygons", path=self.config.polygons_path):
+            polygons = gpd.read_file(self.config.polygons_path)
+        if polygons.crs is not None and polygons.crs != crs:
+            polygons = polygons.to_crs(crs)
+
+        missing = [name for name in self.config.attributes if name not in polygons.columns]
+        if missing:
+            raise ValueError(f"Polygon layer {self.config.polygons_path} has no columns {missing}.")
+
+        self.tree = shapely.STRtree(np.asarray(polygons.geometry.values, dtype=object))
+        self.attributes = {name: polygons[name].to_numpy() for name in self.config.attributes}
+
+        if self.config.tree_cache:
+            os.makedirs(os.path.dirname(os.path.abspath(self.config.tree_cache)), exist_ok=True)
+            temp_path = f"{self.config.tree_cache}.tmp"
+            with open(temp_path, "wb") as f:
+                pickle.dump({"fingerprint": fingerprint, "tree": self.tree, "attributes": self.attributes}, f)
+            os.replace(temp_path, self.config.tree_cache)
+
+    @staticmethod
+    def geometries(data: Dict[str, Any]) -> np.ndarray:
+        """Prediction geometries, from the geometry column or as points from lon/lat columns."""
+        if "geometry" in data:
+            return np.asarray(data["geometry"], dtype=object)
+        return shapely.points(np.asarray(data["lon"], dtype=np.float64), np.asarray(data["lat"], dtype=np.float64))
+
+    def match(self, geometries: np.ndarray) -> np.ndarray:
+        """
+        Index of the polygon each geometry joins with, or -1 if none. Where polygons overlap, the first one in the
+        layer wins.
+        :param geometries: Prediction geometries.
+        :return:
+        """
+        matches = np.full(len(geometries), -1, dtype=np.int64)
+        geometry_index, polygon_index = self.tree.query(geometries, predicate=self.config.predicate)
+        if len(geometry_index):
+            # Sort by polygon so the first polygon of each geometry is the one np.unique keeps
+            order = np.lexsort((polygon_index, geometry_index))
+            geometry_index, polygon_index = geometry_index[order], polygon_index[order]
+            first, position = np.unique(geometry_index, return_index=True)
+            matches[first] = polygon_index[position]
+        return matches
+
+    def run(self, dto: DTO) -> DTO:
+        """
+        Join every prediction with the polygon it falls in and attach that polygon's attributes.
+        :param dto:
+        :return:
+        """
+        self.load(self.config.crs or dto.crs or DEFAULT_CRS)
+        data = dto.processed_data
+        geometries = self.geometries(data)
+
+        with tracing.span("spatial_join", rows=len(geometries)):
+            matches = self.match(geometries)
+        unmatched = matches < 0
+        self.matched = int(len(matches) - unmatched.sum())
+
+        for name, values in self.attributes.items():
+            if unmatched.any():
+                column = np.asarray(values, dtype=object)[matches]
+                column[unmatched] = self.config.missing
+            else:
+                column = values[matches]
+            data[f"{self.config.prefix}{name}"] = column
+
+        print(f"Joined {self.matched} of {len(matches)} predictions with {self.config.polygons_path}")
+        return dto
@@ -0,0 +1,231 @@
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Any, Dict, List, Tuple, Union
+from urllib.parse import urlencode, urlparse
+import http.client
+import queue
+
+import numpy as np
+
+from src.model import DTO, SkipStageError, SkipPipelineError
+from src.utils import tracing
+from src.pipeline.stage import Stage
+
+# NumPy little-endian layouts of the fixed-width ClickHouse types. Native format columns of these types are the raw
+# array buffer, so a whole column is encoded with a single tobytes().
+FIXED_WIDTH_TYPES = {
+    "UInt8": "<u1",
+    "UInt16": "<u2",
+    "UInt32": "<u4",
+    "UInt64": "<u8",
+    "Int8": "<i1",
+    "Int16": "<i2",
+    "Int32": "<i4",
+    "Int64": "<i8",
+    "Float32": "<f4",
+    "Float64": "<f8",
+}
+
+
+class ClickHouseConfig:
+    def __init__(self,
+                 table: str,
+                 columns: List[Tuple[str, str]],
+                 url: str = "http://localhost:8123",
+                 database: str = "default",
+                 user: str = "default",
+                 password: str = "",
+                 batch_size: int = 100_000,
+                 pool_size: int = 2,
+                 async_flush: bool = True,
+                 timeout: float = 30.0,
+                 ):
+        """
+        Configuration for the ClickHouse sink.
+        :param table: Table to insert into.
+        :param columns: (name, ClickHouse type) pairs to insert, in table order. Supports the fixed-width integer and
+            float types and String. Geometries in a String column are written as WKT.
+        :param url: ClickHouse HTTP interface, without a path. Set the database with `database`.
+        :param database: Database of the table.
+        :param user: ClickHouse user.
+        :param password: ClickHouse password.
+        :param batch_size: Rows per INSERT.
+        :param pool_size: Number of pooled HTTP connections, and of batches uploaded concurrently.
+        :param async_flush: Upload batches in the background while the next batch is encoded.
+        :param timeout: Socket timeout per request in seconds.
+        """
+        for name, ch_type in columns:
+            if ch_type != "String" and ch_type not in FIXED_WIDTH_TYPES:
+                raise ValueError(f"Unsupported ClickHouse type {ch_type} for column {name}")
+        if batch_size < 1 or pool_size < 1:
+            raise ValueError("batch_size and pool_size must be at least 1")
+        if urlparse(url).path not in ("", "/"):
+            raise ValueError(f"ClickHouse URL {url} has a path, which would be ignored. Pass the database as "
+                             f"database= instead.")
+
+        self.table = table
+        self.columns = columns
+        self.url = url
+        self.database = database
+        self.user = user
+        self.password = password
+        self.batch_size = batch_size
+        self.pool_size = pool_size
+        self.async_flush = async_flush
+        self.timeout = timeout
+
+
+def _varuint(value: int) -> bytes:
+    """Encode an unsigned LEB128 integer, as used for lengths in ClickHouse formats."""
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def _string(value: Union[str, bytes]) -> bytes:
+    data = value.encode("utf-8") if isinstance(value, str) else value
+    return _varuint(len(data)) + data
+
+
+def encode_native_block(columns: List[Tuple[str, str]], data: Dict[str, Any], start: int, stop: int) -> bytes:
+    """
+    Encode rows [start, stop) of columnar data as one ClickHouse Native format block.
+
+    A block is the column and row counts followed by every column as name, type and values. Fixed-width columns are
+    written as little-endian arrays, String columns as length-prefixed UTF-8.
+    :param columns: (name, ClickHouse type) pairs.
+    :param data: Column name to array-like of values.
+    :param start: First row.
+    :param stop: Row after the last row.
+    :return: Encoded block.
+    """
+    parts = [_varuint(len(columns)), _varuint(stop - start)]
+    for name, ch_type in columns:
+        values = data[name][start:stop]
+        parts.append(_string(name))
+        parts.append(_string(ch_type))
+        if ch_type == "String":
+            parts.append(b"".join(_string(getattr(v, "wkt", None) or str(v)) for v in values))
+        else:
+            parts.append(np.asarray(values, dtype=FIXED_WIDTH_TYPES[ch_type]).tobytes())
+    return b"".join(parts)
+
+
+class _ConnectionPool:
+    """Keeps HTTP connections to ClickHouse open across batches and runs."""
+
+    def __init__(self, url: str, size: int, timeout: float):
+        parsed = urlparse(url)
+        self.connection_class = http.client.HTTPSConnection if parsed.scheme == "https" else http.client.HTTPConnection
+        self.host = parsed.hostname
+        self.port = parsed.port
+        self.timeout = timeout
+        self.idle: queue.LifoQueue = queue.LifoQueue(maxsize=size)
+
+    def acquire(self) -> http.client.HTTPConnection:
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            return self.connection_class(self.host, self.port, timeout=self.timeout)
+
+    def release(self, conn: http.client.HTTPConnection) -> None:
+        try:
+            self.idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def close(self) -> None:
+        while not self.idle.empty():
+            self.idle.get_nowait().close()
+
+
+class LoadToClickHouse(Stage):
+    consumes = ("processed_data",)
+
+    def __init__(self, config: ClickHouseConfig):
+        """
+        :param config: Configuration for the ClickHouse sink.
+        """
+        self.config = config
+        self.pool = _ConnectionPool(config.url, config.pool_size, config.timeout)
+        self.rows_written = 0
+
+    def accept(self, dto: DTO) -> Union[None, SkipStageError, SkipPipelineError]:
+        """
+        Check that there is processed data with every configured column.
+        :param dto:
+        :return:
+        """
+        if dto.processed_data is None:
+            raise SkipStageError("No processed data to load into ClickHouse.")
+
+        missing = [name for name, _ in self.config.columns if name not in dto.processed_data]
+        if missing:
+            raise SkipStageError(f"Processed data is missing columns {missing}.")
+
+        return None
+
+    def run(self, dto: DTO) -> DTO:
+        """
+        Insert the processed data in batches.
+        :param dto:
+        :return:
+        """
+        data = dto.processed_data
+        rows = len(data[self.config.columns[0][0]])
+
+        if not self.config.async_flush:
+            for start in range(0, rows, self.config.batch_size):
+                self._insert(encode_native_block(self.config.columns, data, start,
+                                                 min(start + self.config.batch_size, rows)))
+            self.rows_written += rows
+            return dto
+
+        # Encode the next batch while earlier ones upload, with at most two batches per connection in flight.
+        in_flight: List[Future] = []
+        with ThreadPoolExecutor(max_workers=self.config.pool_size) as executor:
+            for start in range(0, rows, self.config.batch_size):
+                if len(in_flight) >= 2 * self.config.pool_size:
+                    in_flight.pop(0).result()
+                body = encode_native_block(self.config.columns, data, start,
+                                           min(start + self.config.batch_size, rows))
+                in_flight.append(executor.submit(self._insert, body))
+
+            for future in in_flight:
+                future.result()
+
+        self.rows_written += rows
+        return dto
+
+    def _insert(self, body: bytes) -> None:
+        """
+        POST one Native block to ClickHouse.
+        :param body: Encoded block.
+        """
+        column_names = ", ".join(name for name, _ in self.config.columns)
+        query = f"INSERT INTO {self.config.database}.{self.config.table} ({column_names}) FORMAT Native"
+        headers = {
+            "X-ClickHouse-User": self.config.user,
+            "X-ClickHouse-Key": self.config.password,
+            "Content-Type": "application/octet-stream",
+        }
+
+        conn = self.pool.acquire()
+        try:
+            with tracing.span("clickhouse_insert", bytes=len(body)):
+                conn.request("POST", "/?" + urlencode({"query": query}), body=body, headers=headers)
+                response = conn.getresponse()
+                payload = response.read()
+        except (http.client.HTTPException, OSError):
+            # The connection is in an unknown state, don't hand it out again.
+            conn.close()
+            raise
+
+        self.pool.release(conn)
+        if response.status != 200:
+            raise IOError(f"ClickHouse insert failed with {response.status}: {payload.decode(errors='replace')}")
@@ -2,11 +2,14 @@ import os
 from typing import Any, Union
 import geopandas as gpd
 
-from src.model import DTO, SkipStageError, SkipPipelineError
+from src.model import DEFAULT_CRS, DTO, SkipStageError, SkipPipelineError
+from src.utils import tracing
 from src.pipeline.stage import Stage
 
 
 class LoadToGeoJSON(Stage):
+    consumes = ("processed_data",)
+
     def __init__(self, file_path):
         self.file_path = file_path
         self.data = None
@@ -22,8 +25,9 @@ class LoadToGeoJSON(Stage):
     def run(self, dto: DTO) -> DTO:
         """Load GeoJSON data from the specified file path."""
         try:
-            gdf = gpd.GeoDataFrame(dto.processed_data, crs="EPSG:4326")
-            gdf.to_file(os.path.join(self.file_path, "output.geojson"), driver="GeoJSON")
+            gdf = gpd.GeoDataFrame(dto.processed_data, crs=dto.crs or DEFAULT_CRS)
+            with tracing.span("geojson_write", rows=len(gdf)):
+                gdf.to_file(os.path.join(self.file_path, "output.geojson"), driver="GeoJSON")
             return dto
         except Exception as e:
             print(f"Error loading GeoJSON data: {e}")
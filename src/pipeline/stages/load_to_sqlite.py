@@ -0,0 +1,186 @@
+from typing import Any, Dict, List, Optional, Tuple, Union
+import hashlib
+import sqlite3
+
+import numpy as np
+import shapely
+
+from src.model import DTO, SkipStageError, SkipPipelineError
+from src.utils import tracing
+from src.pipeline.stage import Stage
+
+# Integer key of the table rows, which the bounding box index refers to. Unlike the implicit rowid of a table with a
+# TEXT primary key, an INTEGER PRIMARY KEY column survives VACUUM unchanged.
+FID_COLUMN = "fid"
+
+
+class SQLiteConfig:
+    def __init__(self,
+                 path: str,
+                 table: str = "predictions",
+                 id_column: str = "tile_id",
+                 columns: Optional[List[str]] = None,
+                 geometry_column: str = "geometry",
+                 ):
+        """
+        Configuration for the SQLite sink.
+        :param path: Database file. Created if missing.
+        :param table: Table to upsert into.
+        :param id_column: Column that identifies a tile across runs.
+        :param columns: Attribute columns to store, e.g. label and probability.
+        :param geometry_column: Column with shapely geometries, stored as WKB and indexed by bounding box.
+        """
+        self.path = path
+        self.table = table
+        self.id_column = id_column
+        self.columns = columns or []
+        self.geometry_column = geometry_column
+
+
+class LoadToSQLite(Stage):
+    consumes = ("processed_data",)
+
+    def __init__(self, config: SQLiteConfig):
+        """
+        Upserts predictions into an embedded SQLite database with an R*Tree spatial index.
+
+        Rows are keyed by tile id and carry a content hash, so a repeat run only rewrites tiles whose attributes or
+        geometry changed. The bounding box index, an R*Tree where SQLite supports it, is updated for those tiles at the
+        end of the transaction.
+        :param config: Configuration for the SQLite sink.
+        """
+        self.config = config
+        self.rows_written = 0
+
+    @property
+    def index_table(self) -> str:
+        return f"{self.config.table}_bbox"
+
+    def accept(self, dto: DTO) -> Union[None, SkipStageError, SkipPipelineError]:
+        """
+        Check that there is processed data with ids, geometries and every configured column.
+        :param dto:
+        :return:
+        """
+        if dto.processed_data is None:
+            raise SkipStageError("No processed data to load into SQLite.")
+
+        required = [self.config.id_column, self.config.geometry_column] + self.config.columns
+        missing = [name for name in required if name not in dto.processed_data]
+        if missing:
+            raise SkipStageError(f"Processed data is missing columns {missing}.")
+
+        return None
+
+    def run(self, dto: DTO) -> DTO:
+        """
+        Upsert the processed data in a single transaction.
+        :param dto:
+        :return:
+        """
+        data = dto.processed_data
+        geoms = np.asarray(data[self.config.geometry_column], dtype=object)
+
+        # Bounds and WKB for every geometry in one vectorized call each.
+        bounds = shapely.bounds(geoms)
+        wkb = shapely.to_wkb(geoms)
+        ids = [str(i) for i in np.asarray(data[self.config.id_column]).tolist()]
+        attributes = [np.asarray(data[c]).tolist() for c in self.config.columns]
+
+        rows = []
+        for i, tile_id in enumerate(ids):
+            values = [a[i] for a in attributes]
+            row_hash = hashlib.blake2b(repr(values).encode() + wkb[i], digest_size=16).hexdigest()
+            rows.append((tile_id, *values, wkb[i], *bounds[i].tolist(), row_hash))
+
+        conn = sqlite3.connect(self.config.path)
+        try:
+            with tracing.span("sqlite_upsert", rows=len(rows)), conn:
+                self._create_schema(conn)
+                self.rows_written = self._upsert(conn, rows)
+        finally:
+            conn.close()
+
+        print(f"Upserted {self.rows_written} of {len(rows)} tiles into {self.config.path}")
+        return dto
+
+    def _create_schema(self, conn: sqlite3.Connection) -> None:
+        attribute_columns = "".join(f", {c}" for c in self.config.columns)
+        conn.execute(f"CREATE TABLE IF NOT EXISTS {self.config.table} ("
+                     f"{FID_COLUMN} INTEGER PRIMARY KEY, "
+                     f"{self.config.id_column} TEXT NOT NULL UNIQUE{attribute_columns}, "
+                     f"geometry BLOB, min_x REAL, min_y REAL, max_x REAL, max_y REAL, row_hash TEXT)")
+        try:
+            conn.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS {self.index_table} "
+                         f"USING rtree(id, min_x, max_x, min_y, max_y)")
+        except sqlite3.OperationalError:
+            # Some SQLite builds, including the one bundled with TensorFlow, lack the R*Tree module. Fall back to
+            # B-tree indexes on the bounds, which the same bbox queries can use.
+            conn.execute(f"CREATE TABLE IF NOT EXISTS {self.index_table} "
+                         f"(id INTEGER PRIMARY KEY, min_x REAL, max_x REAL, min_y REAL, max_y REAL)")
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {self.index_table}_x ON {self.index_table} (min_x, max_x)")
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {self.index_table}_y ON {self.index_table} (min_y, max_y)")
+
+    def _upsert(self, conn: sqlite3.Connection, rows: List[Tuple[Any, ...]]) -> int:
+        """
+        Bulk load rows into a staging table, then upsert and index only the changed ones.
+        :return: Number of new or changed rows.
+        """
+        columns = [self.config.id_column] + self.config.columns + \
+            ["geometry", "min_x", "min_y", "max_x", "max_y", "row_hash"]
+        column_list = ", ".join(columns)
+        placeholders = ", ".join("?" for _ in columns)
+        staging = f"{self.config.table}_staging"
+
+        conn.execute(f"CREATE TEMP TABLE {staging} AS SELECT {column_list} FROM {self.config.table} WHERE 0")
+        try:
+            conn.executemany(f"INSERT INTO {staging} ({column_list}) VALUES ({placeholders})", rows)
+
+            # Drop unchanged tiles from the staging table, so everything left is new or changed.
+            conn.execute(f"DELETE FROM {staging} WHERE EXISTS (SELECT 1 FROM {self.config.table} t "
+                         f"WHERE t.{self.config.id_column} = {staging}.{self.config.id_column} "
+                         f"AND t.row_hash = {staging}.row_hash)")
+            changed = conn.execute(f"SELECT COUNT(*) FROM {staging}").fetchone()[0]
+
+            updates = ", ".join(f"{c} = excluded.{c}" for c in columns[1:])
+            conn.execute(f"INSERT INTO {self.config.table} ({column_list}) SELECT {column_list} FROM {staging} "
+                         f"WHERE 1 ON CONFLICT({self.config.id_column}) DO UPDATE SET {updates}")
+
+            # Index the changed tiles by the fid of their table row.
+            conn.execute(f"INSERT OR REPLACE INTO {self.index_table} (id, min_x, max_x, min_y, max_y) "
+                         f"SELECT t.{FID_COLUMN}, t.min_x, t.max_x, t.min_y, t.max_y FROM {self.config.table} t "
+                         f"JOIN {staging} s ON s.{self.config.id_column} = t.{self.config.id_column}")
+        finally:
+            conn.execute(f"DROP TABLE {staging}")
+
+        return changed
+
+
+def query_bbox(path: str, min_x: float, min_y: float, max_x: float, max_y: float,
+               table: str = "predictions") -> List[Dict[str, Any]]:
+    """
+    Fetch the rows whose bounding box intersects the given one, using the bounding box index.
+    :param path: Database file written by LoadToSQLite.
+    :param min_x: Minimum x of the query box.
+    :param min_y: Minimum y of the query box.
+    :param max_x: Maximum x of the query box.
+    :param max_y: Maximum y of the query box.
+    :param table: Table written by LoadToSQLite.
+    :return: Matching rows as dictionaries, with the geometry as a shapely geometry.
+    """
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    try:
+        rows = conn.execute(f"SELECT t.* FROM {table} t JOIN {table}_bbox r ON r.id = t.{FID_COLUMN} "
+                            f"WHERE r.max_x >= ? AND r.min_x <= ? AND r.max_y >= ? AND r.min_y <= ?",
+                            (min_x, max_x, min_y, max_y)).fetchall()
+    finally:
+        conn.close()
+
+    results = []
+    for row in rows:
+        result = dict(row)
+        del result[FID_COLUMN]
+        result["geometry"] = shapely.from_wkb(result["geometry"])
+        results.append(result)
+    return results
@@ -0,0 +1,259 @@
+from typing import Any, Dict, List, Tuple, Union
+import json
+import os
+
+import numpy as np
+import shapely
+
+from src.model import DEFAULT_CRS, DTO, SkipStageError, SkipPipelineError
+from src.utils import tracing
+from src.pipeline.stage import Stage
+from src.utils.mvt import encode_point_layer
+
+# Web Mercator is undefined at the poles.
+MAX_LATITUDE = 85.0511287798
+
+# Categorical colors for labels in the viewer.
+PALETTE = ["#1f77b4", "#ff7f0e", "#2ca02c", "#d62728", "#9467bd", "#8c564b", "#e377c2", "#7f7f7f", "#bcbd22",
+           "#17becf"]
+
+
+class VectorTileConfig:
+    def __init__(self,
+                 output_dir: str,
+                 min_zoom: int = 0,
+                 max_zoom: int = 14,
+                 cluster_max_zoom: int = 11,
+                 cluster_radius: int = 40,
+                 extent: int = 4096,
+                 layer: str = "predictions",
+                 label_column: str = "label",
+                 properties: Tuple[str, ...] = (),
+                 ):
+        """
+        Configuration for the vector tile sink.
+        :param output_dir: Directory for the {z}/{x}/{y}.pbf pyramid and the viewer.
+        :param min_zoom: Lowest zoom level to write.
+        :param max_zoom: Highest zoom level to write.
+        :param cluster_max_zoom: Highest zoom level with clustered points. Higher levels hold every prediction.
+        :param cluster_radius: Cluster cell size in screen pixels of a 256 px tile.
+        :param extent: Tile extent in tile-local units.
+        :param layer: Vector tile layer name.
+        :param label_column: Column with the predicted class.
+        :param properties: Extra columns to attach to unclustered points, e.g. probability.
+        """
+        if not 0 <= min_zoom <= max_zoom:
+            raise ValueError("Zoom levels must satisfy 0 <= min_zoom <= max_zoom")
+
+        self.output_dir = output_dir
+        self.min_zoom = min_zoom
+        self.max_zoom = max_zoom
+        self.cluster_max_zoom = cluster_max_zoom
+        self.cluster_radius = cluster_radius
+        self.extent = extent
+        self.layer = layer
+        self.label_column = label_column
+        self.properties = properties
+
+
+class LoadToVectorTiles(Stage):
+    consumes = ("processed_data",)
+
+    def __init__(self, config: VectorTileConfig):
+        """
+        Write predictions as a pyramid of Mapbox Vector Tiles with per-zoom point clustering, plus a static viewer.
+
+        Up to `cluster_max_zoom`, points are clustered on a grid of `cluster_radius` pixels; each cluster carries its
+        point count and majority label. Above it, every prediction is written. The viewer loads tiles on demand, so
+        serve the output directory over HTTP, e.g. `python -m http.server -d <output_dir>`.
+        :param config: Configuration for the vector tile sink.
+        """
+        self.config = config
+        self.tiles_written = 0
+
+    def accept(self, dto: DTO) -> Union[None, SkipStageError, SkipPipelineError]:
+        """
+        Check that there are point locations and labels to tile.
+        :param dto:
+        :return:
+        """
+        if dto.processed_data is None:
+            raise SkipStageError("No processed data to write as vector tiles.")
+        if dto.crs not in (None, DEFAULT_CRS):
+            raise SkipStageError(f"Vector tiles need {DEFAULT_CRS} coordinates, processed data is in {dto.crs}. "
+                                 f"Reproject it first.")
+
+        data = dto.processed_data
+        if "geometry" not in data and not ("lon" in data and "lat" in data):
+            raise SkipStageError("Processed data needs a geometry column or lon/lat columns.")
+        if self.config.label_column not in data:
+            raise SkipStageError(f"Processed data is missing the label column {self.config.label_column}.")
+        if len(data[self.config.label_column]) == 0:
+            raise SkipStageError("Processed data has no rows to write as vector tiles.")
+
+        return None
+
+    def run(self, dto: DTO) -> DTO:
+        """
+        Cluster and tile the predictions for every zoom level.
+        :param dto:
+        :return:
+        """
+        data = dto.processed_data
+        lon, lat = self.coordinates(data)
+        label_names, label_index = np.unique(np.asarray(data[self.config.label_column]), return_inverse=True)
+        x, y = self.project(lon, lat)
+
+        self.tiles_written = 0
+        for zoom in range(self.config.min_zoom, self.config.max_zoom + 1):
+            scale = (1 << zoom) * self.config.extent
+            wx, wy = x * scale, y * scale
+
+            if zoom <= self.config.cluster_max_zoom:
+                wx, wy, properties = self.cluster(wx, wy, label_index, label_names)
+            else:
+                properties = {"count": np.ones(len(wx), dtype=np.int64), "label": label_names[label_index]}
+                for column in self.config.properties:
+                    properties[column] = np.asarray(data[column])
+
+            with tracing.span("write_zoom", zoom=zoom, features=len(wx)):
+                self.write_zoom(zoom, wx, wy, properties)
+
+        self.write_viewer(lon, lat, label_names)
+        print(f"Wrote {self.tiles_written} vector tiles to {self.config.output_dir}")
+        return dto
+
+    @staticmethod
+    def coordinates(data: Dict[str, Any]) -> Tuple[np.ndarray, np.ndarray]:
+        """Longitude and latitude arrays, from lon/lat columns or the geometry centroids."""
+        if "lon" in data and "lat" in data:
+            return np.asarray(data["lon"], dtype=np.float64), np.asarray(data["lat"], dtype=np.float64)
+
+        centroids = shapely.centroid(np.asarray(data["geometry"], dtype=object))
+        return shapely.get_x(centroids), shapely.get_y(centroids)
+
+    @staticmethod
+    def project(lon: np.ndarray, lat: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Project to normalized Web Mercator coordinates in [0, 1), y pointing south."""
+        lat = np.radians(np.clip(lat, -MAX_LATITUDE, MAX_LATITUDE))
+        x = (lon + 180.0) / 360.0
+        y = (1.0 - np.log(np.tan(lat) + 1.0 / np.cos(lat)) / np.pi) / 2.0
+        return np.clip(x, 0.0, np.nextafter(1.0, 0.0)), np.clip(y, 0.0, np.nextafter(1.0, 0.0))
+
+    def cluster(self, wx: np.ndarray, wy: np.ndarray, label_index: np.ndarray,
+                label_names: np.ndarray) -> Tuple[np.ndarray, np.ndarray, Dict[str, np.ndarray]]:
+        """
+        Grid-cluster points in world coordinates of one zoom level.
+        :return: Cluster centroids and their count and majority label.
+        """
+        cell = self.config.cluster_radius * self.config.extent / 256
+        cx = np.floor(wx / cell).astype(np.int64)
+        cy = np.floor(wy / cell).astype(np.int64)
+        _, inverse, counts = np.unique(cx * (int(cy.max()) + 1) + cy, return_inverse=True, return_counts=True)
+
+        centroid_x = np.bincount(inverse, weights=wx) / counts
+        centroid_y = np.bincount(inverse, weights=wy) / counts
+
+        n_labels = len(label_names)
+        votes = np.bincount(inverse * n_labels + label_index, minlength=len(counts) * n_labels)
+        majority = votes.reshape(len(counts), n_labels).argmax(axis=1)
+
+        return centroid_x, centroid_y, {"count": counts, "label": label_names[majority]}
+
+    def write_zoom(self, zoom: int, wx: np.ndarray, wy: np.ndarray, properties: Dict[str, np.ndarray]) -> None:
+        """Split features of one zoom level into tiles and write them."""
+        extent = self.config.extent
+        tx = np.floor(wx / extent).astype(np.int64)
+        ty = np.floor(wy / extent).astype(np.int64)
+        local = np.stack([wx - tx * extent, wy - ty * extent], axis=1).astype(np.int64).clip(0, extent - 1)
+
+        # Sort features by tile once, then write every tile from a contiguous slice.
+        order = np.lexsort((ty, tx))
+        keys = np.stack([tx[order], ty[order]], axis=1)
+        boundaries = np.flatnonzero(np.any(np.diff(keys, axis=0) != 0, axis=1)) + 1
+
+        for indices in np.split(order, boundaries):
+            tile = encode_point_layer(self.config.layer, local[indices],
+                                      {k: v[indices] for k, v in properties.items()}, extent)
+            path = os.path.join(self.config.output_dir, str(zoom), str(tx[indices[0]]), f"{ty[indices[0]]}.pbf")
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as f:
+                f.write(tile)
+            self.tiles_written += 1
+
+    def write_viewer(self, lon: np.ndarray, lat: np.ndarray, label_names: np.ndarray) -> None:
+        """Write the TileJSON metadata and a MapLibre viewer next to the tiles."""
+        bounds = [float(lon.min()), float(lat.min()), float(lon.max()), float(lat.max())]
+        labels: List[str] = [str(l) for l in label_names.tolist()]
+
+        metadata = {
+            "tilejson": "3.0.0",
+            "tiles": ["{z}/{x}/{y}.pbf"],
+            "minzoom": self.config.min_zoom,
+            "maxzoom": self.config.max_zoom,
+            "bounds": bounds,
+            "vector_layers": [{"id": self.config.layer, "fields": {"count": "Number", "label": "String"}}],
+            "labels": labels,
+        }
+        with open(os.path.join(self.config.output_dir, "metadata.json"), "w") as f:
+            json.dump(metadata, f)
+
+        color: Any = PALETTE[0]
+        if labels:
+            color = ["match", ["to-string", ["get", "label"]]]
+            for i, label in enumerate(labels):
+                color.extend([label, PALETTE[i % len(PALETTE)]])
+            color.append("#000000")
+
+        with open(os.path.join(self.config.output_dir, "index.html"), "w") as f:
+            f.write(VIEWER_TEMPLATE
+                    .replace("__LAYER__", json.dumps(self.config.layer))
+                    .replace("__BOUNDS__", json.dumps(bounds))
+                    .replace("__MIN_ZOOM__", str(self.config.min_zoom))
+                    .replace("__MAX_ZOOM__", str(self.config.max_zoom))
+                    .replace("__COLOR__", json.dumps(color)))
+
+
+VIEWER_TEMPLATE = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>Predictions</title>
+<link rel="stylesheet" href="https://unpkg.com/maplibre-gl@4/dist/maplibre-gl.css">
+<script src="https://unpkg.com/maplibre-gl@4/dist/maplibre-gl.js"></script>
+<style>html, body, #map { margin: 0; height: 100%; }</style>
+</head>
+<body>
+<div id="map"></div>
+<script>
+const base = location.href.replace(/[^/]*$/, "");
+const map = new maplibregl.Map({
+  container: "map",
+  style: {
+    version: 8,
+    sources: {
+      osm: {type: "raster", tiles: ["https://tile.openstreetmap.org/{z}/{x}/{y}.png"], tileSize: 256,
+            attribution: "&copy; OpenStreetMap contributors"},
+      predictions: {type: "vector", tiles: [base + "{z}/{x}/{y}.pbf"], minzoom: __MIN_ZOOM__, maxzoom: __MAX_ZOOM__}
+    },
+    layers: [
+      {id: "osm", type: "raster", source: "osm"},
+      {id: "predictions", type: "circle", source: "predictions", "source-layer": __LAYER__,
+       paint: {
+         "circle-radius": ["interpolate", ["linear"], ["get", "count"], 1, 4, 1000, 24],
+         "circle-color": __COLOR__,
+         "circle-opacity": 0.8
+       }}
+    ]
+  },
+  bounds: __BOUNDS__,
+  fitBoundsOptions: {padding: 40}
+});
+map.on("click", "predictions", (e) => {
+  const p = e.features[0].properties;
+  new maplibregl.Popup().setLngLat(e.lngLat).setHTML(`${p.label} (${p.count})`).addTo(map);
+});
+</script>
+</body>
+</html>
+"""
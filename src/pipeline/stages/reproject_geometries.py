@@ -0,0 +1,149 @@
+from typing import Optional, Tuple, Union
+import threading
+
+import numpy as np
+import pyproj
+import shapely
+
+from src.model import DEFAULT_CRS, DTO, SkipStageError, SkipPipelineError
+from src.utils import tracing
+from src.pipeline.stage import Stage
+
+# Transformers are slow to create and not safe to share between threads, so every thread keeps its own.
+_transformers = threading.local()
+
+
+def get_transformer(source_crs: str, target_crs: str) -> pyproj.Transformer:
+    """
+    Cached transformer between two CRSs, with x/y in longitude/latitude order for geographic CRSs.
+    :param source_crs: CRS to transform from.
+    :param target_crs: CRS to transform to.
+    :return:
+    """
+    cache = getattr(_transformers, "cache", None)
+    if cache is None:
+        cache = _transformers.cache = {}
+
+    key = (source_crs, target_crs)
+    if key not in cache:
+        cache[key] = pyproj.Transformer.from_crs(source_crs, target_crs, always_xy=True)
+    return cache[key]
+
+
+class ReprojectConfig:
+    def __init__(self,
+                 target_crs: str = DEFAULT_CRS,
+                 source_crs: Optional[str] = None,
+                 crs_column: Optional[str] = "crs",
+                 geometry_column: str = "geometry",
+                 coordinate_columns: Optional[Tuple[str, str]] = ("lon", "lat"),
+                 ):
+        """
+        Configuration for the reprojection stage.
+        :param target_crs: CRS to reproject to.
+        :param source_crs: CRS of rows without a CRS of their own. Defaults to the CRS of the DTO.
+        :param crs_column: Column with the CRS of each row, for data from rasters in different UTM zones.
+        :param geometry_column: Column with shapely geometries.
+        :param coordinate_columns: x and y columns to reproject along with the geometries, if present.
+        """
+        self.target_crs = target_crs
+        self.source_crs = source_crs
+        self.crs_column = crs_column
+        self.geometry_column = geometry_column
+        self.coordinate_columns = coordinate_columns
+
+
+class ReprojectGeometries(Stage):
+    consumes = ("processed_data",)
+
+    def __init__(self, config: ReprojectConfig):
+        """
+        Reprojects the geometries in processed_data to one CRS, and records it in dto.crs for the sinks.
+
+        Rows are grouped by source CRS, and every group is transformed in one call over the coordinate arrays of all
+        its geometries, with a cached transformer per pair of CRSs.
+        :param config: Configuration for the reprojection stage.
+        """
+        self.config = config
+        self.rows_reprojected = 0
+
+    def accept(self, dto: DTO) -> Union[None, SkipStageError, SkipPipelineError]:
+        """
+        Check that there are geometries or coordinates to reproject.
+        :param dto:
+        :return:
+        """
+        if dto.processed_data is None:
+            raise SkipStageError("No processed data to reproject.")
+
+        data = dto.processed_data
+        columns = self.config.coordinate_columns
+        if self.config.geometry_column not in data and not (columns and all(c in data for c in columns)):
+            raise SkipStageError("Processed data has no geometries or coordinates to reproject.")
+
+        return None
+
+    def source_crs(self, dto: DTO, rows: int) -> np.ndarray:
+        """
+        Source CRS of every row: its own from the CRS column, else the configured one, else the DTO's.
+        :param dto:
+        :param rows: Number of rows.
+        :return:
+        """
+        default = self.config.source_crs or dto.crs or DEFAULT_CRS
+        data = dto.processed_data
+        if self.config.crs_column is None or self.config.crs_column not in data:
+            return np.full(rows, default, dtype=object)
+
+        crs = np.asarray(data[self.config.crs_column], dtype=object).copy()
+        crs[np.equal(crs, None)] = default
+        return crs
+
+    def run(self, dto: DTO) -> DTO:
+        """
+        Reproject every group of rows with the same source CRS in bulk.
+        :param dto:
+        :return:
+        """
+        data = dto.processed_data
+        target = self.config.target_crs
+        columns = self.config.coordinate_columns
+        has_geometry = self.config.geometry_column in data
+        has_coordinates = bool(columns) and all(c in data for c in columns)
+
+        geometries = np.asarray(data[self.config.geometry_column], dtype=object) if has_geometry else None
+        if has_coordinates:
+            x = np.asarray(data[columns[0]], dtype=np.float64).copy()
+            y = np.asarray(data[columns[1]], dtype=np.float64).copy()
+        rows = len(geometries) if has_geometry else len(x)
+
+        self.rows_reprojected = 0
+        source_names, groups = np.unique(self.source_crs(dto, rows).astype(str), return_inverse=True)
+        for group, source in enumerate(source_names):
+            # NumPy strings confuse pyproj's CRS parsing
+            source = str(source)
+            if source == target:
+                continue
+            transformer = get_transformer(source, target)
+            rows_in_group = np.flatnonzero(groups == group)
+
+            with tracing.span("reproject", source=source, rows=len(rows_in_group)):
+                if has_geometry:
+                    # shapely passes the coordinates of all geometries in the group as one array
+                    geometries[rows_in_group] = shapely.transform(
+                        geometries[rows_in_group],
+                        lambda xy: np.column_stack(transformer.transform(xy[:, 0], xy[:, 1])))
+                if has_coordinates:
+                    x[rows_in_group], y[rows_in_group] = transformer.transform(x[rows_in_group], y[rows_in_group])
+            self.rows_reprojected += len(rows_in_group)
+
+        if has_geometry:
+            data[self.config.geometry_column] = geometries
+        if has_coordinates:
+            data[columns[0]], data[columns[1]] = x, y
+        if self.config.crs_column is not None and self.config.crs_column in data:
+            data[self.config.crs_column] = np.full(rows, target, dtype=object)
+        dto.crs = target
+
+        print(f"Reprojected {self.rows_reprojected} of {rows} rows from {len(source_names)} CRSs to {target}")
+        return dto
@@ -18,9 +18,12 @@ class SplitConfig:
         """
         :param batch: Batch size for the dataset.
         :param shuffle: Buffer size for shuffling the dataset.
-        :param size: Number of samples to take from the dataset.
-        :param train_ratio: Ratio of training data.
-        :param valid_ratio: Ratio of validation data.
+        :param size: Number of samples to take from the dataset for training. Unused when the extractor
+            already loaded the slices, see ExtractFromTensorFlow.push_split.
+        :param train_ratio: Ratio of training data. Pass it to ExtractFromTensorFlow.push_split to size
+            the training slice.
+        :param valid_ratio: Ratio of validation data. Pass it to ExtractFromTensorFlow.push_split to size
+            the validation slice.
         """
         self.batch = batch
         self.shuffle = shuffle
@@ -39,6 +42,8 @@ class SplitConfig:
 
 
 class SplitTFDataset(Stage):
+    consumes = ("raw_data",)
+
     def __init__(self, config: SplitConfig):
         """
         :param config: Configuration for the split dataset stage.
@@ -55,7 +60,11 @@ class SplitTFDataset(Stage):
         if dto.raw_data is None:
             raise SkipPipelineError("No raw data available for splitting.")
 
-        if not isinstance(dto.raw_data, tf.data.Dataset):
+        if isinstance(dto.raw_data, dict):
+            if not all(isinstance(dto.raw_data.get(split.value), tf.data.Dataset)
+                       for split in (SplitEnum.TRAIN, SplitEnum.VALIDATION)):
+                raise SkipPipelineError("Pre-split raw data must hold train and validation TensorFlow Datasets.")
+        elif not isinstance(dto.raw_data, tf.data.Dataset):
             raise SkipPipelineError("Raw data must be a TensorFlow Dataset to split with SplitTFDataset.")
 
         if not (0.0 <= self.config.train_ratio <= 1.0) or not (0.0 <= self.config.valid_ratio <= 1.0):
@@ -78,14 +87,20 @@ class SplitTFDataset(Stage):
         train_ratio = self.config.get("train_ratio")
         valid_ratio = self.config.get("valid_ratio")
 
-        train_ds = (dataset
-                    .take(size)
+        if isinstance(dataset, dict):
+            # The extractor already read each split from its own slice.
+            train_ds = dataset[SplitEnum.TRAIN.value]
+            val_ds = dataset[SplitEnum.VALIDATION.value]
+        else:
+            train_ds = dataset.take(size)
+            val_ds = dataset.skip(size)
+
+        train_ds = (train_ds
                     .shuffle(shuffle)
                     .batch(batch)
                     .prefetch(tf.data.AUTOTUNE))
 
-        val_ds = (dataset
-                  .skip(size)
+        val_ds = (val_ds
                   .batch(batch)
                   .prefetch(tf.data.AUTOTUNE)
                   )
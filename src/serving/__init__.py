@@ -0,0 +1,12 @@
+from src.serving.batcher import InvalidInputError, MicroBatcher
+from src.serving.metrics import ServingMetrics
+from src.serving.server import PredictionService, ModelNotFoundError, make_server
+
+__all__ = [
+    "MicroBatcher",
+    "InvalidInputError",
+    "ServingMetrics",
+    "PredictionService",
+    "ModelNotFoundError",
+    "make_server"
+]
@@ -0,0 +1,173 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from src.serving.metrics import ServingMetrics
+
+# Marks the shutdown of a batcher on its queue.
+_STOP = object()
+
+
+class InvalidInputError(Exception):
+    """
+    Exception raised when the inputs of a request don't fit the model.
+    """
+
+    def __init__(self, message: str):
+        super().__init__(message)
+
+
+class _Request:
+    __slots__ = ("inputs", "future", "enqueued")
+
+    def __init__(self, inputs: np.ndarray):
+        self.inputs = inputs
+        self.future: Future = Future()
+        self.enqueued = time.perf_counter()
+
+
+class MicroBatcher:
+    def __init__(self,
+                 predict_fn: Callable[[np.ndarray], np.ndarray],
+                 max_batch_size: int = 32,
+                 max_wait_ms: float = 5.0,
+                 metrics: Optional[ServingMetrics] = None,
+                 input_shape: Optional[Sequence[Optional[int]]] = None):
+        """
+        Coalesce concurrent prediction requests into batches.
+        
+        A background thread takes the first waiting request and keeps adding requests until the batch holds
+        `max_batch_size` rows or `max_wait_ms` have passed since that first request arrived. The batch is sent to the
+        model in one call and the outputs are split back per request. Requests larger than `max_batch_size` are not
+        split. Requests are checked against `input_shape` when they are submitted, so one malformed request can't fail
+        the others in its batch. Requests of different shapes that get past the check still go to the model in
+        separate calls.
+        
+        Args:
+            predict_fn: Model call over a batch of inputs, e.g. `model.predict_on_batch`
+            max_batch_size: Maximum number of rows per model call
+            max_wait_ms: Maximum time the first request of a batch waits for others
+            metrics: Counters to record batches and request latencies into
+            input_shape: Shape of one instance, with None for any size, e.g. a Keras model's input_shape without
+                the batch dimension. None accepts any shape.
+        """
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be at least 1")
+
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.metrics = metrics or ServingMetrics()
+        self.input_shape = tuple(input_shape) if input_shape is not None else None
+        self._closed = False
+        self._lock = threading.Lock()
+        self._queue: queue.Queue = queue.Queue()
+        self._thread = threading.Thread(target=self._loop, name="micro-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, inputs: np.ndarray) -> Future:
+        """
+        Queue inputs for prediction.
+        
+        Args:
+            inputs: Batch of one or more instances
+            
+        Returns:
+            Future resolving to the model outputs for these inputs
+            
+        Raises:
+            InvalidInputError: If the inputs don't match the input shape
+            RuntimeError: If the batcher is closed
+        """
+        inputs = np.asarray(inputs)
+        self.check_shape(inputs)
+        request = _Request(inputs)
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Batcher is closed")
+            self._queue.put(request)
+        return request.future
+
+    def check_shape(self, inputs: np.ndarray) -> None:
+        """Raise InvalidInputError unless inputs are a batch of instances of the input shape."""
+        if self.input_shape is None:
+            if inputs.ndim == 0:
+                raise InvalidInputError("Inputs must be a batch of instances")
+            return
+        shape = inputs.shape[1:]
+        if len(shape) != len(self.input_shape) or any(
+                expected is not None and expected != actual for expected, actual in zip(self.input_shape, shape)):
+            expected = ", ".join("?" if d is None else str(d) for d in self.input_shape)
+            raise InvalidInputError(f"Expected instances of shape ({expected}), got a batch of shape {inputs.shape}")
+
+    def predict(self, inputs: np.ndarray, timeout: Optional[float] = None) -> np.ndarray:
+        """Queue inputs and wait for their outputs."""
+        return self.submit(inputs).result(timeout)
+
+    def close(self) -> None:
+        """Finish the queued requests and stop the batching thread. Later submissions raise."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(_STOP)
+        self._thread.join()
+
+    def _loop(self) -> None:
+        while True:
+            first = self._queue.get()
+            if first is _STOP:
+                return
+
+            batch = [first]
+            rows = len(first.inputs)
+            deadline = first.enqueued + self.max_wait
+            stopping = False
+
+            while rows < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    request = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if request is _STOP:
+                    stopping = True
+                    break
+                batch.append(request)
+                rows += len(request.inputs)
+
+            self._run_batch(batch)
+            if stopping:
+                return
+
+    def _run_batch(self, batch: List[_Request]) -> None:
+        # Only requests with the same instance shape can be concatenated
+        groups: Dict[Tuple[int, ...], List[_Request]] = {}
+        for request in batch:
+            groups.setdefault(request.inputs.shape[1:], []).append(request)
+        for requests in groups.values():
+            self._run_group(requests)
+
+    def _run_group(self, batch: List[_Request]) -> None:
+        try:
+            outputs = np.asarray(self.predict_fn(np.concatenate([r.inputs for r in batch])))
+        except Exception as e:
+            for request in batch:
+                self.metrics.record_error()
+                request.future.set_exception(e)
+            return
+
+        self.metrics.record_batch(len(outputs))
+        done = time.perf_counter()
+        offset = 0
+        for request in batch:
+            n = len(request.inputs)
+            request.future.set_result(outputs[offset:offset + n])
+            self.metrics.record_request(done - request.enqueued, n)
+            offset += n
@@ -0,0 +1,67 @@
+import collections
+import threading
+import time
+from typing import Dict, Any
+
+import numpy as np
+
+# Number of most recent request latencies kept for percentiles.
+DEFAULT_WINDOW = 10_000
+
+
+class ServingMetrics:
+    def __init__(self, window: int = DEFAULT_WINDOW):
+        """
+        Latency and throughput counters for the prediction service.
+        
+        Args:
+            window: Number of most recent request latencies used for percentiles
+        """
+        self.started = time.perf_counter()
+        self.requests = 0
+        self.rows = 0
+        self.batches = 0
+        self.batched_rows = 0
+        self.errors = 0
+        self.latencies: collections.deque = collections.deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record_request(self, latency: float, rows: int) -> None:
+        """Record a completed request and its end-to-end latency in seconds."""
+        with self._lock:
+            self.requests += 1
+            self.rows += rows
+            self.latencies.append(latency)
+
+    def record_batch(self, rows: int) -> None:
+        """Record a model call over a coalesced batch."""
+        with self._lock:
+            self.batches += 1
+            self.batched_rows += rows
+
+    def record_error(self) -> None:
+        with self._lock:
+            self.errors += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        Summarize the counters.
+        
+        Returns:
+            Dictionary with request/row/batch counts, mean batch size, p50/p99 latency in milliseconds and
+            requests/rows per second since start
+        """
+        with self._lock:
+            latencies = np.asarray(self.latencies) * 1000
+            elapsed = time.perf_counter() - self.started
+            return {
+                "requests": self.requests,
+                "rows": self.rows,
+                "batches": self.batches,
+                "errors": self.errors,
+                "mean_batch_size": self.batched_rows / self.batches if self.batches else 0.0,
+                "p50_ms": float(np.percentile(latencies, 50)) if len(latencies) else 0.0,
+                "p99_ms": float(np.percentile(latencies, 99)) if len(latencies) else 0.0,
+                "requests_per_sec": self.requests / elapsed if elapsed > 0 else 0.0,
+                "rows_per_sec": self.rows / elapsed if elapsed > 0 else 0.0,
+            }
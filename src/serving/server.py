@@ -0,0 +1,208 @@
+import json
+import logging
+import re
+import threading
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from src.serving.batcher import InvalidInputError, MicroBatcher
+from src.serving.metrics import ServingMetrics
+from src.utils.model_cache import ModelCache
+
+PREDICT_PATH = re.compile(r"^/models/(?P<model_hash>[0-9a-f]+)/predict$")
+
+
+class ModelNotFoundError(Exception):
+    """
+    Exception raised when a model hash is not in the cache.
+    """
+
+    def __init__(self, message: str):
+        super().__init__(message)
+
+
+class PredictionService:
+    def __init__(self, cache: ModelCache, max_batch_size: int = 32, max_wait_ms: float = 5.0):
+        """
+        Serve predictions from cached models with dynamic micro-batching.
+        
+        Models are loaded from the cache by hash on first use and get their own `MicroBatcher`, so concurrent
+        requests for the same model share model calls. A model loads without holding up requests for other models,
+        and concurrent first requests for it wait for the same load. All models record into the same metrics.
+        
+        Args:
+            cache: Model cache to load models from
+            max_batch_size: Maximum number of rows per model call
+            max_wait_ms: Maximum time a request waits for others to batch with
+        """
+        self.cache = cache
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.metrics = ServingMetrics()
+        self.batchers: Dict[str, MicroBatcher] = {}
+        # Loads in progress, by model hash
+        self._loading: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    def get_batcher(self, model_hash: str) -> MicroBatcher:
+        """
+        Get the batcher of a model, loading the model from the cache if needed.
+        
+        Args:
+            model_hash: Cache hash of the model
+            
+        Returns:
+            The model's batcher
+        """
+        with self._lock:
+            batcher = self.batchers.get(model_hash)
+            if batcher is not None:
+                return batcher
+            loading = self._loading.get(model_hash)
+            if loading is None:
+                loading = self._loading[model_hash] = Future()
+                owner = True
+            else:
+                owner = False
+
+        if not owner:
+            return loading.result()
+
+        try:
+            model = self.cache.get_model(model_hash)
+            if model is None:
+                raise ModelNotFoundError(f"Model {model_hash} not found in cache")
+            batcher = MicroBatcher(
+                model.predict_on_batch,
+                max_batch_size=self.max_batch_size,
+                max_wait_ms=self.max_wait_ms,
+                metrics=self.metrics,
+                input_shape=self.instance_shape(model),
+            )
+        except BaseException as e:
+            with self._lock:
+                del self._loading[model_hash]
+            loading.set_exception(e)
+            raise
+
+        with self._lock:
+            self.batchers[model_hash] = batcher
+            del self._loading[model_hash]
+        loading.set_result(batcher)
+        return batcher
+
+    @staticmethod
+    def instance_shape(model) -> Optional[Tuple[Optional[int], ...]]:
+        """Shape of one input instance of a single-input Keras model, or None if unknown."""
+        input_shape = getattr(model, "input_shape", None)
+        if not isinstance(input_shape, tuple) or not all(d is None or isinstance(d, int) for d in input_shape):
+            return None
+        return input_shape[1:]
+
+    def predict(self, model_hash: str, instances: np.ndarray) -> np.ndarray:
+        """
+        Predict class probabilities for one or more instances.
+        
+        Args:
+            model_hash: Cache hash of the model
+            instances: Batch of inputs
+            
+        Returns:
+            Model outputs, one row per instance
+        """
+        return self.get_batcher(model_hash).predict(instances)
+
+    def close(self) -> None:
+        """Stop every batcher."""
+        with self._lock:
+            for batcher in self.batchers.values():
+                batcher.close()
+            self.batchers = {}
+
+
+def make_handler(service: PredictionService):
+    """Build a request handler class bound to the service."""
+
+    class PredictionHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            if self.path == "/health":
+                self._send_json(200, {"status": "ok"})
+            elif self.path == "/metrics":
+                self._send_json(200, service.metrics.snapshot())
+            else:
+                self._send_json(404, {"error": f"Unknown path {self.path}"})
+
+        def do_POST(self):
+            match = PREDICT_PATH.match(self.path)
+            if match is None:
+                self._send_json(404, {"error": f"Unknown path {self.path}"})
+                return
+
+            try:
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                if "instance" in body:
+                    instances = np.asarray([body["instance"]], dtype=np.float32)
+                else:
+                    instances = np.asarray(body["instances"], dtype=np.float32)
+            except (ValueError, KeyError, TypeError) as e:
+                self._send_json(400, {"error": f"Invalid request: {e}"})
+                return
+
+            try:
+                outputs = service.predict(match.group("model_hash"), instances)
+            except ModelNotFoundError as e:
+                self._send_json(404, {"error": str(e)})
+                return
+            except InvalidInputError as e:
+                self._send_json(400, {"error": f"Invalid request: {e}"})
+                return
+            except Exception as e:
+                logging.error(f"Prediction failed: {e}")
+                self._send_json(500, {"error": str(e)})
+                return
+
+            self._send_json(200, {
+                "predictions": outputs.tolist(),
+                "classes": np.argmax(outputs, axis=-1).tolist(),
+            })
+
+        def _send_json(self, status: int, payload) -> None:
+            data = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            logging.debug(format % args)
+
+    return PredictionHandler
+
+
+def make_server(service: PredictionService, host: str = "127.0.0.1", port: int = 8080) -> ThreadingHTTPServer:
+    """
+    Create the HTTP server for a prediction service.
+    
+    Routes:
+        POST /models/<hash>/predict with {"instance": ...} for a single tile or {"instances": [...]} for a small
+            batch returns {"predictions": [...], "classes": [...]}
+        GET /metrics returns the latency and throughput counters
+        GET /health returns {"status": "ok"}
+    
+    Args:
+        service: Prediction service to expose
+        host: Interface to bind to
+        port: Port to bind to, 0 for any free port
+        
+    Returns:
+        The server, not yet started
+    """
+    server = ThreadingHTTPServer((host, port), make_handler(service))
+    server.daemon_threads = True
+    return server
@@ -1,9 +1,16 @@
-from src.utils.model_cache import ModelCache
+from src.utils.model_cache import ModelCache, weights_hash
 from src.utils.cache_utils import list_cached_models, print_cache_summary, delete_model_from_cache
+from src.utils.memory import estimate_size, format_size, format_memory_report
+from src.utils.mvt import encode_point_layer
 
 __all__ = [
     "ModelCache", 
+    "weights_hash",
     "list_cached_models", 
     "print_cache_summary", 
-    "delete_model_from_cache"
+    "delete_model_from_cache",
+    "estimate_size",
+    "format_size",
+    "format_memory_report",
+    "encode_point_layer"
 ]
\ No newline at end of file
@@ -82,5 +82,8 @@ def delete_model_from_cache(model_hash: str, cache_dir: str = ".model_cache") ->
     # Remove from metadata
     del cache.metadata[model_hash]
     cache._save_metadata()
+
+    # Drop weight chunks that were only used by this model
+    cache.prune_chunks()
     
     return True
\ No newline at end of file
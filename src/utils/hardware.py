@@ -0,0 +1,47 @@
+import functools
+import logging
+import platform
+from typing import FrozenSet, Optional
+
+# CPU flags of instruction sets with native bfloat16 arithmetic: AVX512-BF16 (Cooper Lake and later) and AMX (Sapphire
+# Rapids and later) on x86, BF16 on Arm.
+BFLOAT16_CPU_FLAGS = frozenset({"avx512_bf16", "amx_bf16", "bf16"})
+
+CPUINFO_PATH = "/proc/cpuinfo"
+
+
+@functools.lru_cache(maxsize=None)
+def cpu_flags(path: str = CPUINFO_PATH) -> FrozenSet[str]:
+    """
+    Read the feature flags of the first CPU.
+
+    Args:
+        path: cpuinfo file to read. Only Linux has one.
+
+    Returns:
+        Lower-case flags, empty when they cannot be read
+    """
+    try:
+        with open(path, "r") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                # x86 lists "flags", Arm lists "Features".
+                if key.strip() in ("flags", "Features"):
+                    return frozenset(value.lower().split())
+    except OSError:
+        logging.warning(f"Could not read CPU flags from {path} on {platform.system()}")
+    return frozenset()
+
+
+def supports_bfloat16(flags: Optional[FrozenSet[str]] = None) -> bool:
+    """
+    Check whether the CPU computes in bfloat16 natively. Without it, bfloat16 is emulated and slower than float32.
+
+    Args:
+        flags: CPU flags, read from the system when omitted
+
+    Returns:
+        True if bfloat16 is worth using
+    """
+    flags = cpu_flags() if flags is None else flags
+    return bool(flags & BFLOAT16_CPU_FLAGS)
@@ -0,0 +1,91 @@
+import sys
+from typing import Any, Dict, Optional, Set
+
+
+def estimate_size(obj: Any, _seen: Optional[Set[int]] = None) -> int:
+    """
+    Estimate the memory held by an object in bytes.
+    
+    Understands NumPy arrays, tensors, Keras models, pandas/GeoPandas frames and nested containers, and falls back to
+    `sys.getsizeof` for everything else. Lazy objects such as `tf.data.Dataset` only count their Python wrapper, as
+    their elements are not materialized.
+    
+    Args:
+        obj: Object to measure
+        
+    Returns:
+        Estimated size in bytes
+    """
+    if obj is None:
+        return 0
+
+    seen = _seen if _seen is not None else set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+
+    # NumPy arrays
+    if hasattr(obj, "nbytes") and isinstance(getattr(obj, "nbytes"), int):
+        return obj.nbytes
+
+    # pandas and GeoPandas frames/series
+    if hasattr(obj, "memory_usage") and callable(obj.memory_usage):
+        try:
+            usage = obj.memory_usage(deep=True)
+            return int(usage.sum()) if hasattr(usage, "sum") else int(usage)
+        except Exception:
+            pass
+
+    # Keras models and layers
+    if hasattr(obj, "get_weights") and callable(obj.get_weights):
+        try:
+            return sum(w.nbytes for w in obj.get_weights())
+        except Exception:
+            pass
+
+    # TensorFlow tensors
+    shape = getattr(obj, "shape", None)
+    dtype = getattr(obj, "dtype", None)
+    if hasattr(shape, "num_elements") and hasattr(dtype, "size"):
+        elements = shape.num_elements()
+        if elements is not None:
+            return elements * dtype.size
+
+    if isinstance(obj, dict):
+        return sys.getsizeof(obj) + sum(estimate_size(k, seen) + estimate_size(v, seen) for k, v in obj.items())
+
+    if isinstance(obj, (list, tuple, set, frozenset)):
+        return sys.getsizeof(obj) + sum(estimate_size(item, seen) for item in obj)
+
+    return sys.getsizeof(obj)
+
+
+def format_size(size: int) -> str:
+    """
+    Format a byte count for humans.
+    
+    Args:
+        size: Size in bytes
+        
+    Returns:
+        Size with a binary unit, e.g. "1.5 MB"
+    """
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024 or unit == "GB":
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GB"
+
+
+def format_memory_report(report: Dict[str, int]) -> str:
+    """
+    Format a per-field memory report as a single line.
+    
+    Args:
+        report: Mapping of field name to size in bytes
+        
+    Returns:
+        Fields sorted by size, largest first
+    """
+    fields = sorted(report.items(), key=lambda item: item[1], reverse=True)
+    return ", ".join(f"{name}={format_size(size)}" for name, size in fields)
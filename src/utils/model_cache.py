@@ -1,22 +1,74 @@
 import os
 import json
 import hashlib
+import numpy as np
 import tensorflow as tf
 from typing import Dict, Any, Optional, Tuple, List
 import logging
 
+from src.utils import tracing
+
+try:
+    import zstandard
+except ImportError:  # zstd compression is optional
+    zstandard = None
+
+
+MANIFEST_FILE = "manifest.json"
+# Keras 3 only saves to paths with a .keras extension, so whole models go in a file inside the entry directory
+MODEL_FILE = "model.keras"
+CHUNKS_DIR = "chunks"
+DEFAULT_CHUNK_SIZE = 4 * 1024 * 1024
+COMPRESSIONS = (None, "zstd")
+
+
+def weights_hash(model: tf.keras.Model) -> str:
+    """
+    Hash the weights of a model, to identify models that did not come from the cache.
+    
+    Args:
+        model: The Keras model to hash
+        
+    Returns:
+        A hash string of the weight shapes and values
+    """
+    digest = hashlib.sha256()
+    for array in model.get_weights():
+        array = np.ascontiguousarray(array)
+        digest.update(f"{array.dtype.str}{array.shape}".encode())
+        digest.update(array.tobytes())
+    return digest.hexdigest()
+
 
 class ModelCache:
-    def __init__(self, cache_dir: str = ".model_cache"):
+    def __init__(self,
+                 cache_dir: str = ".model_cache",
+                 dedupe: bool = False,
+                 compression: Optional[str] = None,
+                 chunk_size: int = DEFAULT_CHUNK_SIZE):
         """
         Initialize the model cache.
         
         Args:
             cache_dir: Directory to store cached models
+            dedupe: Store weights as content-hashed chunks shared between entries instead of a full model copy
+            compression: Chunk compression codec, either None or "zstd" (requires the zstandard package)
+            chunk_size: Maximum size in bytes of a single weight chunk
         """
+        if compression not in COMPRESSIONS:
+            raise ValueError(f"Unsupported compression {compression!r}, expected one of {COMPRESSIONS}")
+        if compression == "zstd" and zstandard is None:
+            raise ImportError("zstd compression requires the 'zstandard' package")
+        if chunk_size <= 0:
+            raise ValueError("chunk_size must be positive")
+
         self.cache_dir = cache_dir
+        self.dedupe = dedupe
+        self.compression = compression
+        self.chunk_size = chunk_size
         os.makedirs(cache_dir, exist_ok=True)
         self.metadata_file = os.path.join(cache_dir, "metadata.json")
+        self.chunks_dir = os.path.join(cache_dir, CHUNKS_DIR)
         self.metadata = self._load_metadata()
     
     def _load_metadata(self) -> Dict[str, Any]:
@@ -68,6 +120,239 @@ class ModelCache:
         """Get the file path for a cached model."""
         return os.path.join(self.cache_dir, model_hash)
     
+    def get_chunk_path(self, chunk_hash: str, compression: Optional[str] = None) -> str:
+        """Get the file path for a weight chunk."""
+        suffix = ".zst" if compression == "zstd" else ""
+        return os.path.join(self.chunks_dir, chunk_hash[:2], chunk_hash + suffix)
+
+    def _write_chunk(self, data: bytes) -> Dict[str, Any]:
+        """
+        Write a chunk to the content-addressed store unless an identical chunk is already present.
+        
+        Args:
+            data: Raw chunk bytes
+            
+        Returns:
+            Chunk reference with its hash, codec and raw size
+        """
+        chunk_hash = hashlib.sha256(data).hexdigest()
+        chunk_path = self.get_chunk_path(chunk_hash, self.compression)
+
+        if not os.path.exists(chunk_path):
+            payload = data
+            if self.compression == "zstd":
+                payload = zstandard.ZstdCompressor().compress(data)
+
+            # Write to a temporary file first so a crash never leaves a truncated chunk behind
+            os.makedirs(os.path.dirname(chunk_path), exist_ok=True)
+            tmp_path = f"{chunk_path}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(payload)
+            os.replace(tmp_path, chunk_path)
+
+        return {"hash": chunk_hash, "compression": self.compression, "size": len(data)}
+
+    def _read_chunk(self, chunk: Dict[str, Any]) -> bytes:
+        """Read and verify a chunk from the content-addressed store."""
+        with open(self.get_chunk_path(chunk["hash"], chunk["compression"]), 'rb') as f:
+            data = f.read()
+
+        if chunk["compression"] == "zstd":
+            if zstandard is None:
+                raise ImportError("Cached model uses zstd compression but 'zstandard' is not installed")
+            data = zstandard.ZstdDecompressor().decompress(data, max_output_size=chunk["size"])
+
+        if hashlib.sha256(data).hexdigest() != chunk["hash"]:
+            raise IOError(f"Chunk {chunk['hash'][:8]}... is corrupt")
+        return data
+
+    def _save_chunked(self, model: tf.keras.Model, model_path: str) -> None:
+        """
+        Save a model as an architecture manifest plus deduplicated weight chunks.
+        
+        Args:
+            model: The Keras model to save
+            model_path: Entry directory for the manifest
+        """
+        weights = []
+        for array in model.get_weights():
+            array = np.ascontiguousarray(array)
+            data = array.tobytes()
+            weights.append({
+                "dtype": array.dtype.str,
+                "shape": list(array.shape),
+                "chunks": [self._write_chunk(data[i:i + self.chunk_size])
+                           for i in range(0, len(data), self.chunk_size)],
+            })
+
+        os.makedirs(model_path, exist_ok=True)
+        with open(os.path.join(model_path, MANIFEST_FILE), 'w') as f:
+            json.dump({"architecture": model.to_json(), "weights": weights}, f)
+
+    def _load_chunked(self, model_hash: str) -> tf.keras.Model:
+        """
+        Reassemble a model from its manifest and weight chunks.
+        
+        Args:
+            model_hash: The hash string for the model
+            
+        Returns:
+            The reassembled model, compiled with the cached model configuration when available
+        """
+        with open(os.path.join(self.get_model_path(model_hash), MANIFEST_FILE), 'r') as f:
+            manifest = json.load(f)
+
+        model = tf.keras.models.model_from_json(manifest["architecture"])
+        model.set_weights([
+            np.frombuffer(b"".join(self._read_chunk(c) for c in w["chunks"]),
+                          dtype=np.dtype(w["dtype"])).reshape(w["shape"])
+            for w in manifest["weights"]
+        ])
+
+        model_config = self.metadata.get(model_hash, {}).get("model_config", {})
+        if "optimizer" in model_config and "loss" in model_config:
+            model.compile(optimizer=model_config["optimizer"],
+                          loss=model_config["loss"],
+                          metrics=model_config.get("metrics"),
+                          jit_compile=model_config.get("jit_compile", "auto"),
+                          steps_per_execution=model_config.get("steps_per_execution", 1))
+        return model
+
+    def _referenced_chunks(self) -> set:
+        """Collect the hashes of every chunk referenced by a chunked cache entry."""
+        referenced = set()
+        for model_hash in self.metadata:
+            manifest_path = os.path.join(self.get_model_path(model_hash), MANIFEST_FILE)
+            if not os.path.exists(manifest_path):
+                continue
+            try:
+                with open(manifest_path, 'r') as f:
+                    manifest = json.load(f)
+            except (json.JSONDecodeError, IOError) as e:
+                logging.warning(f"Failed to read manifest for {model_hash}: {e}")
+                continue
+            for w in manifest["weights"]:
+                referenced.update(c["hash"] for c in w["chunks"])
+        return referenced
+
+    def prune_chunks(self) -> int:
+        """
+        Delete chunks no longer referenced by any cache entry.
+        
+        Returns:
+            The number of chunks deleted
+        """
+        if not os.path.exists(self.chunks_dir):
+            return 0
+
+        referenced = self._referenced_chunks()
+        deleted = 0
+        for dirpath, _, filenames in os.walk(self.chunks_dir):
+            for filename in filenames:
+                if filename.split(".")[0] not in referenced:
+                    os.remove(os.path.join(dirpath, filename))
+                    deleted += 1
+        return deleted
+
+    def get_storage_stats(self) -> Dict[str, int]:
+        """
+        Report logical and on-disk size of the cache.
+        
+        Returns:
+            Dictionary with the number of entries and chunks, the logical weight size of all chunked
+            entries and the bytes actually used on disk
+        """
+        logical_size = 0
+        for model_hash in self.metadata:
+            manifest_path = os.path.join(self.get_model_path(model_hash), MANIFEST_FILE)
+            if os.path.exists(manifest_path):
+                with open(manifest_path, 'r') as f:
+                    manifest = json.load(f)
+                logical_size += sum(c["size"] for w in manifest["weights"] for c in w["chunks"])
+
+        disk_size = 0
+        chunk_count = 0
+        for dirpath, _, filenames in os.walk(self.cache_dir):
+            for filename in filenames:
+                disk_size += os.path.getsize(os.path.join(dirpath, filename))
+                if dirpath.startswith(self.chunks_dir):
+                    chunk_count += 1
+
+        return {
+            "entries": len(self.metadata),
+            "chunks": chunk_count,
+            "logical_bytes": logical_size,
+            "disk_bytes": disk_size,
+        }
+
+    @staticmethod
+    def _layer_signature(layer_config: Dict[str, Any]) -> str:
+        """Serialize a layer configuration without its auto-generated name, so equal layers compare equal."""
+        signature = {k: v for k, v in layer_config.items() if k != "name"}
+        if isinstance(signature.get("config"), dict):
+            signature["config"] = {k: v for k, v in signature["config"].items() if k != "name"}
+        return json.dumps(signature, sort_keys=True)
+
+    @staticmethod
+    def _training_config(model_config: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        The part of a model configuration two models must share to continue training one into the other. Entries
+        saved by earlier versions may still hold warm-start options, which don't change what a model was trained on.
+        """
+        ignored = ("epochs", "warm_start", "freeze_shared_layers")
+        return {k: v for k, v in model_config.items() if k not in ignored}
+
+    def find_nearest(self,
+                     layers_config: List[Dict[str, Any]],
+                     model_config: Dict[str, Any],
+                     dataset_info: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        Find the cached model closest to a configuration, to warm-start training from its weights.
+        
+        Entries are compatible when they were trained on the same input shape and start with the same layers. The
+        entry sharing the most leading layers wins. If it shares every layer and only trained for fewer epochs, it
+        can be trained further for the remaining epochs.
+        
+        Args:
+            layers_config: Layer configuration details
+            model_config: Model compilation and training configuration
+            dataset_info: Information about the dataset used for training
+            
+        Returns:
+            Dictionary with the hash of the nearest entry, the number of leading layers it shares and the epochs it
+            already trained for when it shares every layer (0 otherwise), or None if no entry is compatible
+        """
+        signatures = [self._layer_signature(layer) for layer in layers_config]
+        training_config = self._training_config(model_config)
+        best = None
+
+        for model_hash, entry in self.metadata.items():
+            if entry.get("dataset_info", {}).get("input_shape") != dataset_info.get("input_shape"):
+                continue
+            if not os.path.exists(self.get_model_path(model_hash)):
+                continue
+
+            cached = [self._layer_signature(layer) for layer in entry.get("layers", [])]
+            shared = 0
+            while shared < min(len(signatures), len(cached)) and signatures[shared] == cached[shared]:
+                shared += 1
+            if shared == 0:
+                continue
+
+            epochs = 0
+            cached_config = entry.get("model_config", {})
+            if (shared == len(signatures) == len(cached) and entry.get("dataset_info") == dataset_info
+                    and self._training_config(cached_config) == training_config):
+                epochs = cached_config.get("epochs", 0)
+                if epochs >= model_config.get("epochs", 0):
+                    # Trained for longer than asked, continuing from it would not reproduce this configuration
+                    epochs = 0
+
+            candidate = {"hash": model_hash, "shared_layers": shared, "epochs": epochs}
+            if best is None or (shared, epochs) > (best["shared_layers"], best["epochs"]):
+                best = candidate
+        return best
+
     def get_model(self, model_hash: str) -> Optional[tf.keras.Model]:
         """
         Load a model from the cache based on its hash.
@@ -81,7 +366,13 @@ class ModelCache:
         model_path = self.get_model_path(model_hash)
         if os.path.exists(model_path):
             try:
-                return tf.keras.models.load_model(model_path)
+                with tracing.span("model_cache_load", model_hash=model_hash):
+                    if os.path.exists(os.path.join(model_path, MANIFEST_FILE)):
+                        return self._load_chunked(model_hash)
+                    if os.path.exists(os.path.join(model_path, MODEL_FILE)):
+                        return tf.keras.models.load_model(os.path.join(model_path, MODEL_FILE))
+                    # Entries saved before MODEL_FILE, in the SavedModel format
+                    return tf.keras.models.load_model(model_path)
             except Exception as e:
                 logging.warning(f"Failed to load cached model: {e}")
         return None
@@ -90,7 +381,8 @@ class ModelCache:
                    model: tf.keras.Model, 
                    layers_config: List[Dict[str, Any]],
                    model_config: Dict[str, Any], 
-                   dataset_info: Dict[str, Any]) -> str:
+                   dataset_info: Dict[str, Any],
+                   extra_metadata: Optional[Dict[str, Any]] = None) -> str:
         """
         Save a model to the cache.
         
@@ -99,6 +391,8 @@ class ModelCache:
             layers_config: Layer configuration details
             model_config: Model compilation and training configuration
             dataset_info: Information about the dataset used for training
+            extra_metadata: Additional metadata to store with the entry, e.g. the hash of the teacher of a distilled
+                model. Not part of the hash.
             
         Returns:
             The hash string for the saved model
@@ -107,7 +401,12 @@ class ModelCache:
         model_path = self.get_model_path(model_hash)
         
         # Save the model
-        model.save(model_path)
+        with tracing.span("model_cache_save", model_hash=model_hash, dedupe=self.dedupe):
+            if self.dedupe:
+                self._save_chunked(model, model_path)
+            else:
+                os.makedirs(model_path, exist_ok=True)
+                model.save(os.path.join(model_path, MODEL_FILE))
         
         # Update metadata
         self.metadata[model_hash] = {
@@ -115,8 +414,11 @@ class ModelCache:
             "model_config": model_config,
             "dataset_info": dataset_info,
             "path": model_path,
+            "storage": "chunked" if self.dedupe else "model",
             "created_at": str(tf.timestamp().numpy())
         }
+        if extra_metadata:
+            self.metadata[model_hash].update(extra_metadata)
         
         self._save_metadata()
         return model_hash
@@ -130,6 +432,12 @@ class ModelCache:
                     tf.io.gfile.rmtree(model_path)
                 except Exception as e:
                     logging.warning(f"Failed to delete cached model {model_hash}: {e}")
+
+        if os.path.exists(self.chunks_dir):
+            try:
+                tf.io.gfile.rmtree(self.chunks_dir)
+            except Exception as e:
+                logging.warning(f"Failed to delete cached weight chunks: {e}")
         
         self.metadata = {}
-        self._save_metadata()
\ No newline at end of file
+        self._save_metadata()
@@ -0,0 +1,276 @@
+from typing import Any, Dict, Iterator, List, Optional
+import contextlib
+import contextvars
+import json
+import os
+import random
+import threading
+import time
+
+import keras
+import tensorflow as tf
+
+# Span categories, shown as separate filters in the trace viewer.
+CATEGORY_RUN = "run"
+CATEGORY_STAGE = "stage"
+CATEGORY_IO = "io"
+CATEGORY_TRAIN = "train"
+
+# Trace of the run in the current context, so stages and utilities can add spans without having the pipeline passed
+# in. Every thread and asyncio task has its own context, so concurrent runs never share a trace.
+_active_trace: contextvars.ContextVar[Optional["Trace"]] = contextvars.ContextVar("active_trace", default=None)
+
+
+class Trace:
+    """
+    Spans of one run. Spans from every thread the run uses land in the same trace.
+    """
+
+    def __init__(self, tracer: "Tracer", recording: bool, parent: Optional["Trace"]):
+        self.tracer = tracer
+        self.recording = recording
+        # Trace that was active when this run started, active again once it stops
+        self.parent = parent
+        self.depth = 1
+        self.events: List[Dict[str, Any]] = []
+        self.origin = time.perf_counter()
+        self.threads: Dict[int, str] = {}
+        self.lock = threading.Lock()
+
+    @property
+    def output_dir(self) -> str:
+        return self.tracer.output_dir
+
+    @property
+    def tf_profiler(self) -> bool:
+        return self.tracer.tf_profiler
+
+    @contextlib.contextmanager
+    def span(self, name: str, category: str = CATEGORY_STAGE, **args: Any) -> Iterator[None]:
+        """
+        Records the enclosed block as a span, if the run is recorded.
+        :param name: Span name.
+        :param category: Span category.
+        :param args: Extra values shown with the span.
+        """
+        if not self.recording:
+            yield
+            return
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, category, start, time.perf_counter(), **args)
+
+    def add(self, name: str, category: str, start: float, end: float, **args: Any) -> None:
+        """
+        Records a span from perf_counter timestamps, for spans measured elsewhere, e.g. in Keras callbacks.
+        """
+        duration = (end - start) * 1e6
+        if not self.recording or duration < self.tracer.min_span_us:
+            return
+
+        thread = threading.current_thread()
+        event = {"name": name, "cat": category, "ph": "X", "pid": os.getpid(), "tid": thread.ident,
+                 "ts": (start - self.origin) * 1e6, "dur": duration}
+        if args:
+            event["args"] = {k: v if isinstance(v, (int, float, bool)) else str(v) for k, v in args.items()}
+        with self.lock:
+            self.threads[thread.ident] = thread.name
+            self.events.append(event)
+
+    def write(self, path: str) -> None:
+        with self.lock:
+            events = self.events + [
+                {"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": tid, "args": {"name": thread}}
+                for tid, thread in self.threads.items()
+            ]
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+
+class Tracer:
+    """
+    Records spans of pipeline runs into Chrome traces, one per run, viewable in chrome://tracing or ui.perfetto.dev.
+
+    Every span becomes a complete ("X") event on the thread it ran on, so streaming and async runs show stages
+    overlapping across threads. Runs are sampled: an unsampled run costs one random draw and records nothing. The run
+    in progress lives in the current context, so concurrent runs, e.g. from AsyncPipeline.run_many, each get their own
+    trace. Threads a run starts must run in a copy of its context to add spans to it.
+    """
+
+    def __init__(self,
+                 output_dir: str,
+                 sample_rate: float = 1.0,
+                 min_span_ms: float = 0.0,
+                 tf_profiler: bool = False):
+        """
+        :param output_dir: Directory for trace files, one per recorded run.
+        :param sample_rate: Fraction of runs to record, between 0 and 1.
+        :param min_span_ms: Drop spans shorter than this, to keep traces of long runs small.
+        :param tf_profiler: Also capture the TensorFlow profiler around model training, which includes tf.data
+            iterator waits and op timings. Written to a tf_profile directory next to the trace, for TensorBoard.
+        """
+        if not 0.0 <= sample_rate <= 1.0:
+            raise ValueError("Sample rate must be between 0 and 1.")
+
+        self.output_dir = output_dir
+        self.sample_rate = sample_rate
+        self.min_span_us = min_span_ms * 1000.0
+        self.tf_profiler = tf_profiler
+        self.last_trace: Optional[str] = None
+
+    def current(self) -> Optional[Trace]:
+        """
+        The trace of this tracer's run in the current context, if any.
+        """
+        trace = _active_trace.get()
+        return trace if trace is not None and trace.tracer is self else None
+
+    @property
+    def recording(self) -> bool:
+        """Whether the run in the current context is recorded."""
+        trace = self.current()
+        return trace is not None and trace.recording
+
+    def start(self) -> bool:
+        """
+        Starts a run in the current context, deciding whether to record it. A run started inside a run of the same
+        tracer, e.g. a pipeline run from within a stage, joins the outer run.
+        :return: True if the run is recorded.
+        """
+        trace = self.current()
+        if trace is not None:
+            trace.depth += 1
+            return trace.recording
+
+        trace = Trace(self, random.random() < self.sample_rate, _active_trace.get())
+        _active_trace.set(trace)
+        return trace.recording
+
+    def stop(self, name: str) -> Optional[str]:
+        """
+        Ends the run in the current context, and writes its trace if it was recorded and this is the outermost run.
+        :param name: Run name, used in the file name.
+        :return: Path of the trace file, if one was written.
+        """
+        trace = self.current()
+        if trace is None:
+            return None
+        trace.depth -= 1
+        if trace.depth > 0:
+            return None
+        _active_trace.set(trace.parent)
+        if not trace.recording:
+            return None
+
+        path = os.path.join(self.output_dir, f"trace-{name}.json")
+        trace.write(path)
+        self.last_trace = path
+        return path
+
+    def span(self, name: str, category: str = CATEGORY_STAGE, **args: Any) -> contextlib.AbstractContextManager:
+        """
+        Records the enclosed block as a span of the run in the current context, if it is recorded.
+        :param name: Span name.
+        :param category: Span category.
+        :param args: Extra values shown with the span.
+        """
+        trace = self.current()
+        if trace is None:
+            return contextlib.nullcontext()
+        return trace.span(name, category, **args)
+
+
+def active_trace() -> Optional[Trace]:
+    """
+    Returns the trace of the run being recorded in the current context, or None outside a recorded run.
+    """
+    trace = _active_trace.get()
+    return trace if trace is not None and trace.recording else None
+
+
+def span(name: str, category: str = CATEGORY_IO, **args: Any) -> contextlib.AbstractContextManager:
+    """
+    Records the enclosed block as a span of the run being recorded. A no-op when tracing is off.
+    :param name: Span name.
+    :param category: Span category. Defaults to I/O, for sinks and caches.
+    :param args: Extra values shown with the span.
+    """
+    trace = active_trace()
+    if trace is None:
+        return contextlib.nullcontext()
+    return trace.span(name, category, **args)
+
+
+class TraceCallback(keras.callbacks.Callback):
+    """
+    Keras callback recording every epoch and every training and validation batch as a span.
+    """
+
+    def __init__(self, trace: Trace):
+        super().__init__()
+        self.trace = trace
+        self._starts: Dict[str, float] = {}
+
+    def _begin(self, key: str) -> None:
+        self._starts[key] = time.perf_counter()
+
+    def _end(self, key: str, name: str, **args: Any) -> None:
+        start = self._starts.pop(key, None)
+        if start is not None:
+            self.trace.add(name, CATEGORY_TRAIN, start, time.perf_counter(), **args)
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self._begin("epoch")
+
+    def on_epoch_end(self, epoch, logs=None):
+        self._end("epoch", "epoch", epoch=epoch)
+
+    def on_train_batch_begin(self, batch, logs=None):
+        self._begin("train_batch")
+
+    def on_train_batch_end(self, batch, logs=None):
+        self._end("train_batch", "train_batch", batch=batch)
+
+    def on_test_batch_begin(self, batch, logs=None):
+        self._begin("test_batch")
+
+    def on_test_batch_end(self, batch, logs=None):
+        self._end("test_batch", "test_batch", batch=batch)
+
+
+def training_callbacks() -> List[keras.callbacks.Callback]:
+    """
+    Callbacks that trace model training into the run being recorded. Empty when tracing is off.
+    """
+    trace = active_trace()
+    return [TraceCallback(trace)] if trace is not None else []
+
+
+@contextlib.contextmanager
+def tf_profile() -> Iterator[None]:
+    """
+    Captures the TensorFlow profiler for the enclosed block, if the run being recorded asked for it. The profile lands
+    in a tf_profile directory next to the trace, for the TensorBoard profile plugin.
+    """
+    trace = active_trace()
+    if trace is None or not trace.tf_profiler:
+        yield
+        return
+
+    logdir = os.path.join(trace.output_dir, "tf_profile")
+    try:
+        tf.profiler.experimental.start(logdir)
+    except Exception:
+        # Another profiler session is already running, e.g. a concurrent run.
+        yield
+        return
+
+    try:
+        with trace.span("tf_profiler", CATEGORY_TRAIN, logdir=logdir):
+            yield
+    finally:
+        tf.profiler.experimental.stop()
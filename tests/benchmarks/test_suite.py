@@ -0,0 +1,72 @@
+import json
+import os
+import tempfile
+
+from benchmarks.suite import compare_results, main
+
+
+def document(results):
+    return {"meta": {"scale": "quick", "cpu_count": 4}, "results": results}
+
+
+class TestCompareResults:
+
+    def test_flags_drop_beyond_threshold(self):
+        """Test that only drops larger than the threshold count as regressions."""
+        baseline = document({"sink": {"rows_per_sec": 100.0, "mb_per_sec": 10.0}})
+        current = document({"sink": {"rows_per_sec": 85.0, "mb_per_sec": 9.5}})
+
+        rows = {row["metric"]: row for row in compare_results(baseline, current, threshold=0.1)}
+
+        assert rows["rows_per_sec"]["regression"]
+        assert abs(rows["rows_per_sec"]["change"] + 0.15) < 1e-9
+        assert not rows["mb_per_sec"]["regression"]
+
+    def test_new_error_is_a_regression(self):
+        """Test that a benchmark failing now but not before is flagged."""
+        baseline = document({"cache": {"loads_per_sec": 5.0}})
+        current = document({"cache": {"error": "ValueError: boom"}})
+
+        assert compare_results(baseline, current) == [
+            {"benchmark": "cache", "metric": "error", "baseline": None, "current": "ValueError: boom", "change": None,
+             "regression": True}
+        ]
+
+    def test_persistent_error_is_a_regression(self):
+        """Test that a benchmark failing in both runs is still flagged."""
+        baseline = document({"cache": {"error": "ValueError: boom"}})
+        current = document({"cache": {"error": "ValueError: boom"}})
+
+        rows = compare_results(baseline, current)
+
+        assert [(row["benchmark"], row["metric"], row["regression"]) for row in rows] == [("cache", "error", True)]
+
+    def test_fixed_error_is_reported(self):
+        """Test that a benchmark that only failed in the baseline is reported without counting as a regression."""
+        baseline = document({"cache": {"error": "ValueError: boom"}})
+        current = document({"cache": {"loads_per_sec": 5.0}})
+
+        assert compare_results(baseline, current) == [
+            {"benchmark": "cache", "metric": "error", "baseline": "ValueError: boom", "current": None, "change": None,
+             "regression": False}
+        ]
+
+    def test_skips_missing_benchmarks(self):
+        """Test that benchmarks only present in one file are ignored."""
+        baseline = document({"old": {"rows_per_sec": 1.0}})
+        current = document({"new": {"rows_per_sec": 1.0}})
+
+        assert compare_results(baseline, current) == []
+
+    def test_compare_exit_code(self):
+        """Test that the compare command exits non-zero on a regression."""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            paths = []
+            for name, value in (("baseline", 100.0), ("current", 50.0)):
+                path = os.path.join(temp_dir, f"{name}.json")
+                with open(path, "w") as f:
+                    json.dump(document({"sink": {"rows_per_sec": value}}), f)
+                paths.append(path)
+
+            assert main(["compare", *paths]) == 1
+            assert main(["compare", paths[0], paths[0]]) == 0
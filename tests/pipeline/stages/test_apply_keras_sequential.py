@@ -1,9 +1,13 @@
+import tempfile
+
 import pytest
 from unittest.mock import patch, MagicMock
+import keras
 import tensorflow as tf
 
 from src.model import DTO, SplitEnum, SkipPipelineError
 from src.pipeline.stages.apply_keras_sequential import ApplyKerasSequential, KerasConfig
+from src.utils.model_cache import ModelCache
 
 
 class TestApplyKerasSequential:
@@ -51,7 +55,7 @@ class TestApplyKerasSequential:
     
     @patch.object(tf.keras.Sequential, 'fit')
     @patch.object(tf.keras.Sequential, 'compile')
-    def test_run_creates_and_trains_model(self, mock_compile, mock_fit, dto_with_keras_inputs):
+    def test_run_creates_and_trains_model(self, mock_compile, mock_fit, dto_with_keras_inputs, tmp_path):
         """Test that run creates, compiles, and trains a Keras model."""
         # Setup
         config = KerasConfig(
@@ -64,7 +68,7 @@ class TestApplyKerasSequential:
             tf.keras.layers.Dense(10, activation='relu'),
             tf.keras.layers.Dense(3, activation='softmax')
         ]
-        stage = ApplyKerasSequential(config, layers)
+        stage = ApplyKerasSequential(config, layers, cache_dir=str(tmp_path))
         
         # Run the stage
         result_dto = stage.run(dto_with_keras_inputs)
@@ -81,4 +85,184 @@ class TestApplyKerasSequential:
             dto_with_keras_inputs.split_data.get(SplitEnum.TRAIN.value),
             validation_data=dto_with_keras_inputs.split_data.get(SplitEnum.VALIDATION.value),
             epochs=config.epochs
-        )
\ No newline at end of file
+        )
+
+class TestKerasConfig:
+
+    def test_to_dict_without_performance_options(self):
+        """Test that the cache key of a default config is unchanged by the performance options."""
+        assert KerasConfig().to_dict() == {
+            "epochs": 5,
+            "loss": "sparse_categorical_crossentropy",
+            "metrics": ["accuracy"],
+            "optimizer": "adam",
+        }
+
+    def test_to_dict_with_performance_options(self):
+        """Test that set performance options are part of the cache key."""
+        config = KerasConfig(jit_compile=True, steps_per_execution=16, mixed_precision="mixed_bfloat16")
+
+        assert config.to_dict()["jit_compile"] is True
+        assert config.to_dict()["steps_per_execution"] == 16
+        assert config.to_dict()["mixed_precision"] == "mixed_bfloat16"
+        assert config.compile_kwargs() == {"jit_compile": True, "steps_per_execution": 16}
+
+    @pytest.mark.parametrize("supported, expected", [(True, "mixed_bfloat16"), (False, None)])
+    def test_auto_precision_follows_cpu_support(self, supported, expected):
+        """Test that the auto policy only picks bfloat16 on CPUs that support it."""
+        with patch("src.pipeline.stages.apply_keras_sequential.supports_bfloat16", return_value=supported):
+            assert KerasConfig(mixed_precision="auto").precision_policy() == expected
+
+    def test_invalid_options_raise(self):
+        """Test that unknown policies and non-positive steps per execution are rejected."""
+        with pytest.raises(ValueError):
+            KerasConfig(mixed_precision="bfloat16")
+        with pytest.raises(ValueError):
+            KerasConfig(steps_per_execution=0)
+
+    def test_run_with_mixed_precision(self, dto_with_keras_inputs):
+        """Test that hidden layers train in bfloat16, the output layer in float32, and the policies are restored."""
+        config = KerasConfig(epochs=1, use_cache=False, steps_per_execution=2, mixed_precision="mixed_bfloat16")
+        layers = [
+            tf.keras.layers.Dense(8, activation='relu'),
+            tf.keras.layers.Dense(3, activation='softmax')
+        ]
+        dtypes = []
+        fit = tf.keras.Sequential.fit
+
+        def record_fit(model, *args, **kwargs):
+            dtypes.append([layer.compute_dtype for layer in layers])
+            return fit(model, *args, **kwargs)
+
+        with patch.object(tf.keras.Sequential, 'fit', autospec=True, side_effect=record_fit):
+            result = ApplyKerasSequential(config, layers).run(dto_with_keras_inputs)
+
+        assert dtypes == [["bfloat16", "float32"]]
+        assert [layer.compute_dtype for layer in layers] == ["float32", "float32"]
+        assert result.keras_model.predict(tf.zeros((2, 4)), verbose=0).dtype == "float32"
+
+    def test_mixed_float16_scales_loss(self, dto_with_keras_inputs):
+        """Test that float16 training wraps the optimizer in a loss scale optimizer."""
+        config = KerasConfig(epochs=1, use_cache=False, mixed_precision="mixed_float16")
+        layers = [
+            tf.keras.layers.Dense(8, activation='relu'),
+            tf.keras.layers.Dense(3, activation='softmax')
+        ]
+
+        with patch.object(tf.keras.Sequential, 'fit'):
+            model = ApplyKerasSequential(config, layers).run(dto_with_keras_inputs).keras_model
+
+        assert isinstance(model.optimizer, keras.optimizers.LossScaleOptimizer)
+
+
+class TestWarmStart:
+
+    @pytest.fixture
+    def model_cache(self):
+        """Deduplicated model cache in a temporary directory."""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            yield ModelCache(temp_dir, dedupe=True)
+
+    @staticmethod
+    def layers(head_units=3):
+        return [
+            tf.keras.layers.Dense(8, activation='relu'),
+            tf.keras.layers.Dense(head_units, activation='softmax')
+        ]
+
+    def test_trains_remaining_epochs(self, dto_with_keras_inputs, model_cache):
+        """Test that a cached model with the same layers is trained only for the missing epochs."""
+        ApplyKerasSequential(KerasConfig(epochs=2), self.layers(), model_cache=model_cache).run(dto_with_keras_inputs)
+
+        stage = ApplyKerasSequential(KerasConfig(epochs=3, warm_start=True), self.layers(), model_cache=model_cache)
+        with patch.object(tf.keras.Sequential, 'fit') as mock_fit:
+            stage.run(dto_with_keras_inputs)
+
+        assert mock_fit.call_args.kwargs["initial_epoch"] == 2
+        assert mock_fit.call_args.kwargs["epochs"] == 3
+
+    def test_continuation_is_not_transferred(self, dto_with_keras_inputs, model_cache):
+        """Test that continuing a cold-trained model records where it came from, but not as a transfer."""
+        first = ApplyKerasSequential(KerasConfig(epochs=1), self.layers(), model_cache=model_cache)
+        first_hash = first.run(dto_with_keras_inputs).model_hash
+
+        stage = ApplyKerasSequential(KerasConfig(epochs=2, warm_start=True), self.layers(), model_cache=model_cache)
+        result = stage.run(dto_with_keras_inputs)
+
+        provenance = model_cache.metadata[result.model_hash]["warm_start"]
+        assert provenance["warm_started_from"] == first_hash
+        assert provenance["initial_epoch"] == 1
+        assert not provenance["transferred"]
+
+    def test_transferred_model_is_not_a_cold_hit(self, dto_with_keras_inputs, model_cache):
+        """Test that a model trained on frozen shared layers is stored with its provenance and retrained cold."""
+        first = ApplyKerasSequential(KerasConfig(epochs=1), self.layers(), model_cache=model_cache)
+        first_hash = first.run(dto_with_keras_inputs).model_hash
+
+        layers = self.layers(head_units=4)
+        warm = ApplyKerasSequential(KerasConfig(epochs=1, warm_start=True), layers, model_cache=model_cache)
+        model_hash = warm.run(dto_with_keras_inputs).model_hash
+        provenance = model_cache.metadata[model_hash]["warm_start"]
+        assert provenance["warm_started_from"] == first_hash
+        assert provenance["shared_layers"] == 1
+        assert provenance["frozen"] == [layers[0].name]
+        assert provenance["transferred"]
+
+        with patch.object(tf.keras.Sequential, 'fit') as mock_fit:
+            ApplyKerasSequential(KerasConfig(epochs=1, warm_start=True), layers, model_cache=model_cache).run(
+                dto_with_keras_inputs)
+        mock_fit.assert_not_called()
+
+        cold = ApplyKerasSequential(KerasConfig(epochs=1), layers, model_cache=model_cache)
+        assert cold.run(dto_with_keras_inputs).model_hash == model_hash
+        assert "warm_start" not in model_cache.metadata[model_hash]
+
+    def test_warm_start_shares_cache_entry(self, dto_with_keras_inputs, model_cache):
+        """Test that warm-start options leave the cache key alone, so a cold-trained model is an exact hit."""
+        layers = self.layers()
+        ApplyKerasSequential(KerasConfig(epochs=2), layers, model_cache=model_cache).run(dto_with_keras_inputs)
+
+        stage = ApplyKerasSequential(KerasConfig(epochs=2, warm_start=True, freeze_shared_layers=False),
+                                     layers, model_cache=model_cache)
+        with patch.object(tf.keras.Sequential, 'fit') as mock_fit:
+            stage.run(dto_with_keras_inputs)
+
+        mock_fit.assert_not_called()
+
+    def test_unfreezes_layers_when_fit_fails(self, dto_with_keras_inputs, model_cache):
+        """Test that layers frozen for warm-starting are trainable again after a failed fit."""
+        ApplyKerasSequential(KerasConfig(epochs=1), self.layers(), model_cache=model_cache).run(dto_with_keras_inputs)
+
+        layers = self.layers(head_units=4)
+        stage = ApplyKerasSequential(KerasConfig(epochs=1, warm_start=True), layers, model_cache=model_cache)
+        with patch.object(tf.keras.Sequential, 'fit', side_effect=RuntimeError("interrupted")):
+            with pytest.raises(RuntimeError):
+                stage.run(dto_with_keras_inputs)
+
+        assert layers[0].trainable
+
+    def test_trains_only_new_head(self, dto_with_keras_inputs, model_cache):
+        """Test that shared layers are initialized from the cache and frozen while the new head trains."""
+        first = ApplyKerasSequential(KerasConfig(epochs=1), self.layers(), model_cache=model_cache)
+        cached_weights = first.run(dto_with_keras_inputs).keras_model.layers[0].get_weights()
+
+        layers = self.layers(head_units=4)
+        trainable = []
+        stage = ApplyKerasSequential(KerasConfig(epochs=1, warm_start=True), layers, model_cache=model_cache)
+        with patch.object(tf.keras.Sequential, 'fit', side_effect=lambda *a, **k: trainable.append(
+                [layer.trainable for layer in layers])) as mock_fit:
+            stage.run(dto_with_keras_inputs)
+
+        assert "initial_epoch" not in mock_fit.call_args.kwargs
+        assert trainable == [[False, True]]
+        assert layers[0].trainable
+        for expected, actual in zip(cached_weights, layers[0].get_weights()):
+            assert (expected == actual).all()
+
+    def test_without_compatible_entry_trains_from_scratch(self, dto_with_keras_inputs, model_cache):
+        """Test that training starts from scratch when nothing compatible is cached."""
+        stage = ApplyKerasSequential(KerasConfig(epochs=1, warm_start=True), self.layers(), model_cache=model_cache)
+        with patch.object(tf.keras.Sequential, 'fit') as mock_fit:
+            stage.run(dto_with_keras_inputs)
+
+        assert "initial_epoch" not in mock_fit.call_args.kwargs
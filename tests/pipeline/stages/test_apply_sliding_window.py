@@ -0,0 +1,119 @@
+import os
+import tempfile
+from unittest.mock import MagicMock
+
+import numpy as np
+import pytest
+import rasterio
+from rasterio.transform import from_origin
+
+from src.model import SkipPipelineError
+from src.pipeline.stages.apply_sliding_window import ApplySlidingWindow, SlidingWindowConfig, NODATA_CLASS
+
+
+@pytest.fixture
+def mean_model():
+    """Model predicting class 1 for windows with a high mean value and class 0 otherwise."""
+    model = MagicMock()
+
+    def predict(batch):
+        high = (batch.mean(axis=(1, 2, 3)) > 0.5).astype(np.float32)
+        return np.stack([1 - high, high], axis=-1)
+
+    model.predict_on_batch.side_effect = predict
+    return model
+
+
+@pytest.fixture
+def scene():
+    """8x8 scene whose right half is bright."""
+    scene = np.zeros((8, 8, 3), dtype=np.float32)
+    scene[:, 4:] = 1.0
+    return scene
+
+
+class TestApplySlidingWindow:
+
+    def test_config_rejects_invalid_values(self):
+        """Test that invalid merge modes and strides are rejected."""
+        with pytest.raises(ValueError, match="Unsupported merge"):
+            SlidingWindowConfig(merge="median")
+        with pytest.raises(ValueError, match="divisor"):
+            SlidingWindowConfig(window=64, stride=24)
+
+    def test_accept_without_model(self, dummy_dto, scene):
+        """Test that accept raises SkipPipelineError without a model."""
+        dummy_dto.raw_data = scene
+        stage = ApplySlidingWindow(SlidingWindowConfig(window=4, stride=2))
+        with pytest.raises(SkipPipelineError, match="No Keras model"):
+            stage.accept(dummy_dto)
+
+    def test_accept_without_scene(self, dummy_dto, mean_model):
+        """Test that accept raises SkipPipelineError without a scene."""
+        dummy_dto.keras_model = mean_model
+        stage = ApplySlidingWindow(SlidingWindowConfig(window=4, stride=2))
+        with pytest.raises(SkipPipelineError, match="needs a scene"):
+            stage.accept(dummy_dto)
+
+    @pytest.mark.parametrize("merge", ["mean", "max"])
+    def test_run_merges_overlapping_windows(self, dummy_dto, mean_model, scene, merge):
+        """Test that the class map covers the scene at cell resolution."""
+        dummy_dto.raw_data = scene
+        dummy_dto.keras_model = mean_model
+        stage = ApplySlidingWindow(SlidingWindowConfig(window=4, stride=2, batch_size=4, merge=merge))
+
+        result = stage.run(dummy_dto)
+
+        assert result.prediction_raster.shape == (4, 4)
+        assert (result.prediction_raster[:, 0] == 0).all()
+        assert (result.prediction_raster[:, 3] == 1).all()
+        # Nine windows in batches of four
+        assert mean_model.predict_on_batch.call_count == 3
+
+    def test_predict_cells_mean_and_max(self, scene):
+        """Test how overlapping window probabilities are merged per cell."""
+        # Soft model: the probability of class 1 is the window mean.
+        model = MagicMock()
+        model.predict_on_batch.side_effect = lambda batch: np.stack(
+            [1 - batch.mean(axis=(1, 2, 3)), batch.mean(axis=(1, 2, 3))], axis=-1)
+
+        mean = ApplySlidingWindow(SlidingWindowConfig(window=4, stride=2, merge="mean")).predict_cells(model, scene)
+        maxed = ApplySlidingWindow(SlidingWindowConfig(window=4, stride=2, merge="max")).predict_cells(model, scene)
+
+        # Cell column 2 is covered by a half-bright window [0.5, 0.5] and a bright window [0, 1].
+        np.testing.assert_allclose(mean[:, 2], [[0.25, 0.75]] * 4)
+        np.testing.assert_allclose(maxed[:, 2], [[0.5, 1.0]] * 4)
+        # Corner cells are only covered by one window.
+        np.testing.assert_allclose(mean[0, 0], [1.0, 0.0])
+
+    def test_run_pads_unaligned_scenes(self, dummy_dto, mean_model):
+        """Test that scenes not aligned to the stride are fully covered."""
+        dummy_dto.raw_data = np.zeros((9, 7, 3), dtype=np.float32)
+        dummy_dto.keras_model = mean_model
+
+        result = ApplySlidingWindow(SlidingWindowConfig(window=4, stride=2)).run(dummy_dto)
+
+        assert result.prediction_raster.shape == (5, 4)
+        assert (result.prediction_raster != NODATA_CLASS).all()
+
+    def test_run_writes_cog_from_scene_path(self, dummy_dto, mean_model, scene):
+        """Test that a georeferenced scene produces a tiled, compressed COG on the cell grid."""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            scene_path = os.path.join(temp_dir, "scene.tif")
+            output_path = os.path.join(temp_dir, "classes.tif")
+            transform = from_origin(500000, 4000000, 10, 10)
+            with rasterio.open(scene_path, "w", driver="GTiff", height=8, width=8, count=3, dtype="float32",
+                               crs="EPSG:32633", transform=transform) as dst:
+                dst.write(scene.transpose(2, 0, 1))
+
+            dummy_dto.keras_model = mean_model
+            stage = ApplySlidingWindow(SlidingWindowConfig(window=4, stride=2, output_path=output_path, blocksize=16),
+                                       scene_path=scene_path)
+            stage.run(dummy_dto)
+
+            with rasterio.open(output_path) as src:
+                assert src.crs.to_epsg() == 32633
+                assert src.transform.a == 20
+                assert src.profile["tiled"]
+                assert src.profile["compress"] == "deflate"
+                np.testing.assert_array_equal(src.read(1), dummy_dto.prediction_raster)
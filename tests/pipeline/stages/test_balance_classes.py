@@ -0,0 +1,130 @@
+import json
+import os
+import tempfile
+from collections import Counter
+
+import numpy as np
+import pytest
+import tensorflow as tf
+
+from src.model import SkipStageError, SkipPipelineError, SplitEnum
+from src.pipeline.stages.balance_classes import BalanceClasses, BalanceConfig, BalanceMethod
+
+
+@pytest.fixture
+def imbalanced_dto(dummy_dto):
+    """DTO with 90 elements of class 0 and 10 of class 1, each input being its own index."""
+    labels = np.array([0] * 90 + [1] * 10)
+    np.random.default_rng(0).shuffle(labels)
+    dummy_dto.raw_data = tf.data.Dataset.from_tensor_slices((np.arange(100), labels))
+    dummy_dto.class_names = ["forest", "river"]
+    return dummy_dto
+
+
+def label_counts(dataset):
+    return Counter(int(label) for _, label in dataset.as_numpy_iterator())
+
+
+class TestBalanceClasses:
+
+    def test_accept_without_dataset(self, dummy_dto):
+        """Test that accept skips the stage without a dataset."""
+        with pytest.raises(SkipStageError, match="TensorFlow Dataset"):
+            BalanceClasses(BalanceConfig()).accept(dummy_dto)
+
+    def test_accept_with_wrong_target(self, imbalanced_dto):
+        """Test that accept rejects a target distribution that does not cover every class."""
+        with pytest.raises(SkipPipelineError, match="Target distribution"):
+            BalanceClasses(BalanceConfig(target_distribution=[1.0])).accept(imbalanced_dto)
+
+    def test_counts_single_pass(self, imbalanced_dto):
+        """Test that per-class counts are computed once per cache key and then reused."""
+        stage = BalanceClasses(BalanceConfig(stratify=False, cache_key="toy:train"))
+        counts = stage.counts(imbalanced_dto.raw_data, 2)
+
+        assert counts.tolist() == [90, 10]
+        assert stage.counts(tf.data.Dataset.from_tensor_slices(([0], [0])), 2) is counts
+
+    def test_counts_without_key_are_recounted(self, imbalanced_dto):
+        """Test that a stage without a cache key counts every dataset it is given."""
+        stage = BalanceClasses(BalanceConfig(stratify=False))
+        stage.counts(imbalanced_dto.raw_data, 2)
+
+        assert stage.counts(tf.data.Dataset.from_tensor_slices(([0], [0])), 2).tolist() == [1, 0]
+
+    def test_counts_cache_file(self, imbalanced_dto):
+        """Test that counts are written to and read back from the counts cache."""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, "counts.json")
+            config = BalanceConfig(stratify=False, counts_cache=path, cache_key="toy:train")
+            BalanceClasses(config).counts(imbalanced_dto.raw_data, 2)
+
+            with open(path) as f:
+                assert json.load(f) == {"toy:train": [90, 10]}
+
+            # A fresh stage takes the cached counts without looking at the data.
+            empty = tf.data.Dataset.from_tensor_slices((np.zeros(0, np.int64), np.zeros(0, np.int64)))
+            assert BalanceClasses(config).counts(empty, 2).tolist() == [90, 10]
+
+    def test_run_resample(self, imbalanced_dto):
+        """Test that resampling draws classes evenly over an epoch of the original size."""
+        stage = BalanceClasses(BalanceConfig(stratify=False, seed=1, epoch_size=2000))
+
+        counts = label_counts(stage.run(imbalanced_dto).raw_data)
+
+        assert sum(counts.values()) == 2000
+        assert abs(counts[0] - counts[1]) < 200
+
+    def test_run_rejection(self, imbalanced_dto):
+        """Test that rejection resampling drops common classes rather than repeating rare ones."""
+        stage = BalanceClasses(BalanceConfig(method=BalanceMethod.REJECTION, stratify=False, seed=1))
+
+        counts = label_counts(stage.run(imbalanced_dto).raw_data)
+
+        assert counts[0] < 90
+        assert counts[1] / sum(counts.values()) > 0.1
+
+    def test_run_stratified(self, imbalanced_dto):
+        """Test that stratifying keeps the class mix in validation and shares no elements between splits."""
+        stage = BalanceClasses(BalanceConfig(stratify=True, train_ratio=0.8, seed=1))
+
+        result = stage.run(imbalanced_dto).raw_data
+
+        valid = list(result[SplitEnum.VALIDATION.value].as_numpy_iterator())
+        assert 10 <= len(valid) <= 30
+        assert Counter(int(y) for _, y in valid)[0] > Counter(int(y) for _, y in valid)[1]
+
+        train = list(result[SplitEnum.TRAIN.value].as_numpy_iterator())
+        assert len(train) == 100 - len(valid)
+        assert not {int(x) for x, _ in train} & {int(x) for x, _ in valid}
+        assert Counter(int(y) for _, y in train)[1] > 20
+
+    def test_stratifies_by_default(self, imbalanced_dto):
+        """Test that the default configuration splits before rebalancing, so no element is in both splits."""
+        result = BalanceClasses(BalanceConfig(seed=1)).run(imbalanced_dto).raw_data
+
+        assert set(result) == {SplitEnum.TRAIN.value, SplitEnum.VALIDATION.value}
+
+    def test_stratified_counts(self, imbalanced_dto):
+        """Test that stratified counts split every class between training and validation in one counting pass."""
+        stage = BalanceClasses(BalanceConfig(stratify=True, train_ratio=0.8))
+
+        train_counts, valid_counts = stage.counts(imbalanced_dto.raw_data, 2)
+
+        assert (train_counts + valid_counts).tolist() == [90, 10]
+        assert 60 <= train_counts[0] <= 85
+
+    def test_stratified_split_survives_reshuffling(self, dummy_dto):
+        """Test that the splits stay disjoint when the source reshuffles on every iteration."""
+        labels = np.arange(200) % 2
+        dummy_dto.raw_data = (tf.data.Dataset.from_tensor_slices((np.arange(200), labels))
+                              .shuffle(200, reshuffle_each_iteration=True))
+        dummy_dto.class_names = ["forest", "river"]
+        stage = BalanceClasses(BalanceConfig(stratify=True, train_ratio=0.8, seed=1))
+
+        result = stage.run(dummy_dto).raw_data
+
+        train = {int(x) for x, _ in result[SplitEnum.TRAIN.value].as_numpy_iterator()}
+        valid = {int(x) for x, _ in result[SplitEnum.VALIDATION.value].as_numpy_iterator()}
+        assert not train & valid
+        assert len(train) + len(valid) <= 200
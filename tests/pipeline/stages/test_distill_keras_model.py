@@ -0,0 +1,128 @@
+import os
+import tempfile
+
+import numpy as np
+import pytest
+import tensorflow as tf
+
+from src.model import SkipStageError, SplitEnum
+from src.pipeline.stages.distill_keras_model import DistillConfig, DistillKerasModel, distillation_loss, PREDICTIONS_DIR
+from src.utils.model_cache import ModelCache
+
+
+@pytest.fixture
+def model_cache():
+    """Deduplicated model cache in a temporary directory."""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        yield ModelCache(temp_dir, dedupe=True)
+
+
+@pytest.fixture
+def dto_with_teacher(dto_with_split_data):
+    """DTO with a trained teacher model."""
+    teacher = tf.keras.Sequential([
+        tf.keras.Input(shape=(4,)),
+        tf.keras.layers.Dense(32, activation='relu'),
+        tf.keras.layers.Dense(3, activation='softmax')
+    ])
+    teacher.compile(optimizer='adam', loss='sparse_categorical_crossentropy')
+    teacher.fit(dto_with_split_data.split_data[SplitEnum.TRAIN.value], epochs=1, verbose=0)
+    dto_with_split_data.keras_model = teacher
+    return dto_with_split_data
+
+
+class TestDistillKerasModel:
+
+    def test_accept_without_teacher(self, dto_with_split_data):
+        """Test that accept raises SkipStageError when there is no model to distill."""
+        with pytest.raises(SkipStageError, match="No teacher model"):
+            DistillKerasModel(DistillConfig()).accept(dto_with_split_data)
+
+    def test_accept_without_input_shape(self, dto_with_teacher):
+        """Test that accept skips the stage when the default student's input shape cannot be inferred."""
+        dto_with_teacher.split_data[SplitEnum.TRAIN.value] = dto_with_teacher.split_data[SplitEnum.TRAIN.value].take(0)
+        dto_with_teacher.class_names = ["a", "b", "c"]
+
+        with pytest.raises(SkipStageError, match="input shape"):
+            DistillKerasModel(DistillConfig()).accept(dto_with_teacher)
+
+    def test_invalid_config_raises(self):
+        """Test that non-positive temperatures and alphas outside [0, 1] are rejected."""
+        with pytest.raises(ValueError):
+            DistillConfig(temperature=0)
+        with pytest.raises(ValueError):
+            DistillConfig(alpha=1.5)
+
+    def test_distillation_loss(self):
+        """Test that the loss is the hard loss at alpha 1, and zero soft loss when the student matches the teacher."""
+        probabilities = tf.constant([[0.7, 0.2, 0.1]])
+        targets = tf.constant([[0.7, 0.2, 0.1, 0.0]])
+
+        hard = distillation_loss(temperature=1.0, alpha=1.0)(targets, probabilities)
+        soft = distillation_loss(temperature=1.0, alpha=0.0)(targets, probabilities)
+
+        np.testing.assert_allclose(hard, -np.log(0.7), rtol=1e-5)
+        np.testing.assert_allclose(soft, 0.0, atol=1e-5)
+
+    def test_run_replaces_teacher_with_student(self, dto_with_teacher, model_cache):
+        """Test that the student replaces the teacher, is cached with a link to it, and comes with a report."""
+        teacher = dto_with_teacher.keras_model
+        stage = DistillKerasModel(DistillConfig(epochs=1, dense_units=4, latency_runs=2), model_cache=model_cache)
+
+        result = stage.run(dto_with_teacher)
+
+        assert result.keras_model is not teacher
+        assert result.keras_model.count_params() < teacher.count_params()
+        entry = model_cache.metadata[result.model_hash]
+        assert entry["teacher"] == entry["dataset_info"]["teacher"]
+        assert set(stage.report) == {"teacher", "student", "speedup"}
+        assert 0.0 <= stage.report["student"]["accuracy"] <= 1.0
+        assert any(name.endswith(".npz") for name in os.listdir(os.path.join(model_cache.cache_dir, PREDICTIONS_DIR)))
+
+    def test_run_uses_cached_student(self, dto_with_teacher, model_cache, capsys):
+        """Test that a second run with the same teacher loads the student and its report from the cache."""
+        teacher = dto_with_teacher.keras_model
+        config = DistillConfig(epochs=1, dense_units=4, latency_runs=2)
+        first = DistillKerasModel(config, model_cache=model_cache).run(dto_with_teacher)
+        student_hash = first.model_hash
+
+        dto_with_teacher.keras_model = teacher
+        dto_with_teacher.model_hash = None
+        stage = DistillKerasModel(config, model_cache=model_cache)
+        stage.run(dto_with_teacher)
+
+        output = capsys.readouterr().out
+        assert "Using cached teacher predictions" not in output
+        assert "Using cached student model" in output
+        assert dto_with_teacher.model_hash == student_hash
+        assert stage.report["student"]["parameters"] == first.keras_model.count_params()
+
+    def test_run_reuses_teacher_predictions(self, dto_with_teacher, model_cache, capsys):
+        """Test that a different student of the same teacher reads the cached teacher predictions."""
+        teacher = dto_with_teacher.keras_model
+        DistillKerasModel(DistillConfig(epochs=1, dense_units=4, latency_runs=2), model_cache=model_cache).run(
+            dto_with_teacher)
+
+        dto_with_teacher.keras_model = teacher
+        dto_with_teacher.model_hash = None
+        DistillKerasModel(DistillConfig(epochs=1, dense_units=8, latency_runs=2), model_cache=model_cache).run(
+            dto_with_teacher)
+
+        assert "Using cached teacher predictions" in capsys.readouterr().out
+
+    def test_cached_predictions_follow_shuffled_inputs(self, dto_with_teacher, model_cache):
+        """Test that only predictions are cached, and that they are found by input when the order changes."""
+        teacher = dto_with_teacher.keras_model
+        train = dto_with_teacher.split_data[SplitEnum.TRAIN.value].unbatch().shuffle(16, seed=1).batch(2)
+        stage = DistillKerasModel(DistillConfig(temperature=2.0), model_cache=model_cache)
+
+        data = stage.soft_labels(teacher, train, "shuffled")
+
+        with np.load(os.path.join(model_cache.cache_dir, PREDICTIONS_DIR, "shuffled.npz")) as cached:
+            assert set(cached.files) == {"keys", "probabilities"}
+            keys = set(cached["keys"].tolist())
+        for _ in range(2):
+            for x, targets in data:
+                assert set(stage.element_keys(x).numpy().tolist()) <= keys
+                expected = tf.nn.softmax(tf.math.log(teacher(x, training=False) + 1e-7) / 2.0)
+                np.testing.assert_allclose(targets[:, :-1], expected, rtol=1e-4, atol=1e-6)
@@ -0,0 +1,165 @@
+import os
+import tempfile
+
+import numpy as np
+import pytest
+import tensorflow as tf
+
+from src.model import SkipPipelineError
+from src.pipeline.manifest import RunManifest
+from src.pipeline.stages.extract_from_shards import ExtractFromShards, ShardConfig, ShardFormat
+
+
+@pytest.fixture
+def shard_dir():
+    """Temporary directory for shards."""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        yield temp_dir
+
+
+def shard_data(shards=3, per_shard=5):
+    """Images whose every pixel equals their label, so pairs can be checked after shuffling."""
+    labels = np.arange(shards * per_shard)
+    images = np.broadcast_to(labels[:, None, None, None], (len(labels), 4, 4, 3)).astype(np.uint8)
+    return np.split(images, shards), np.split(labels, shards)
+
+
+def write_tfrecord_shards(directory):
+    images, labels = shard_data()
+    for i, (shard_images, shard_labels) in enumerate(zip(images, labels)):
+        with tf.io.TFRecordWriter(os.path.join(directory, f"train-{i:05d}.tfrecord")) as writer:
+            for image, label in zip(shard_images, shard_labels):
+                example = tf.train.Example(features=tf.train.Features(feature={
+                    "image": tf.train.Feature(bytes_list=tf.train.BytesList(
+                        value=[tf.io.serialize_tensor(image).numpy()])),
+                    "label": tf.train.Feature(int64_list=tf.train.Int64List(value=[int(label)])),
+                }))
+                writer.write(example.SerializeToString())
+
+
+def write_npy_shards(directory):
+    images, labels = shard_data()
+    for i, (shard_images, shard_labels) in enumerate(zip(images, labels)):
+        np.save(os.path.join(directory, f"image-{i:05d}.npy"), shard_images)
+        np.save(os.path.join(directory, f"label-{i:05d}.npy"), shard_labels)
+
+
+def read_pairs(dataset):
+    return [(int(image[0, 0, 0]), int(label)) for image, label in dataset.as_numpy_iterator()]
+
+
+class TestExtractFromShards:
+
+    def test_accept_without_shards(self, dummy_dto, shard_dir):
+        """Test that accept skips the pipeline when nothing matches the pattern."""
+        stage = ExtractFromShards(ShardConfig(os.path.join(shard_dir, "*.tfrecord")))
+        with pytest.raises(SkipPipelineError, match="No shards"):
+            stage.accept(dummy_dto)
+
+    def test_run_reads_tfrecord_shards(self, dummy_dto, shard_dir):
+        """Test that every record of every TFRecord shard is read and parsed."""
+        write_tfrecord_shards(shard_dir)
+        stage = ExtractFromShards(ShardConfig(os.path.join(shard_dir, "train-*.tfrecord"),
+                                              class_names=["a", "b"], seed=1))
+
+        result_dto = stage.run(dummy_dto)
+
+        pairs = read_pairs(result_dto.raw_data)
+        assert all(pixel == label for pixel, label in pairs)
+        assert sorted(label for _, label in pairs) == list(range(15))
+        assert result_dto.class_names == ["a", "b"]
+
+    def test_run_unshuffled_tfrecord_keeps_file_order(self, dummy_dto, shard_dir):
+        """Test that without file shuffling and with block_length covering a shard, order is preserved."""
+        write_tfrecord_shards(shard_dir)
+        stage = ExtractFromShards(ShardConfig(os.path.join(shard_dir, "train-*.tfrecord"),
+                                              shuffle_files=False, cycle_length=1))
+
+        pairs = read_pairs(stage.run(dummy_dto).raw_data)
+
+        assert [label for _, label in pairs] == list(range(15))
+
+    def test_run_reads_npy_shards(self, dummy_dto, shard_dir):
+        """Test that image and label shards are paired and fully read, with their shapes and dtypes."""
+        write_npy_shards(shard_dir)
+        stage = ExtractFromShards(ShardConfig(os.path.join(shard_dir, "image-*.npy"),
+                                              shard_format=ShardFormat.NPY, seed=3))
+
+        dataset = stage.run(dummy_dto).raw_data
+        pairs = read_pairs(dataset)
+
+        assert dataset.element_spec[0].shape == (4, 4, 3)
+        assert dataset.element_spec[0].dtype == tf.uint8
+        assert all(pixel == label for pixel, label in pairs)
+        assert sorted(label for _, label in pairs) == list(range(15))
+
+    def test_npy_shards_with_big_endian_labels(self, dummy_dto, shard_dir):
+        """Test that the byte order in the .npy header is honored."""
+        np.save(os.path.join(shard_dir, "image-00000.npy"), np.zeros((3, 2, 2, 3), dtype=np.float32))
+        np.save(os.path.join(shard_dir, "label-00000.npy"), np.array([1, 256, 70000], dtype=">i4"))
+        stage = ExtractFromShards(ShardConfig(os.path.join(shard_dir, "image-*.npy"), shard_format=ShardFormat.NPY))
+
+        labels = [int(label) for _, label in stage.run(dummy_dto).raw_data.as_numpy_iterator()]
+
+        assert labels == [1, 256, 70000]
+
+    def test_class_names_from_file(self, dummy_dto, shard_dir):
+        """Test that class names are read from class_names.txt next to the shards."""
+        write_npy_shards(shard_dir)
+        with open(os.path.join(shard_dir, "class_names.txt"), "w") as f:
+            f.write("forest\nriver\n")
+        stage = ExtractFromShards(ShardConfig(os.path.join(shard_dir, "image-*.npy"), shard_format=ShardFormat.NPY))
+
+        assert stage.run(dummy_dto).class_names == ["forest", "river"]
+
+    def test_mismatched_npy_shards(self, dummy_dto, shard_dir):
+        """Test that a label shard of the wrong length is rejected."""
+        np.save(os.path.join(shard_dir, "image-00000.npy"), np.zeros((3, 2, 2, 3), dtype=np.uint8))
+        np.save(os.path.join(shard_dir, "label-00000.npy"), np.zeros(2))
+        stage = ExtractFromShards(ShardConfig(os.path.join(shard_dir, "image-*.npy"), shard_format=ShardFormat.NPY))
+
+        with pytest.raises(ValueError, match="holds 3 images"):
+            stage.run(dummy_dto)
+
+    def test_select_inputs_restricts_shards(self, dummy_dto, shard_dir):
+        """Test that only the selected shards are read, and an empty selection skips the pipeline."""
+        write_npy_shards(shard_dir)
+        stage = ExtractFromShards(ShardConfig(os.path.join(shard_dir, "image-*.npy"), shard_format=ShardFormat.NPY,
+                                              shuffle_files=False))
+        assert len(stage.inputs()) == 6
+
+        stage.select_inputs(stage.inputs()[1:2])
+        assert [label for _, label in read_pairs(stage.run(dummy_dto).raw_data)] == list(range(5, 10))
+
+        stage.select_inputs([])
+        with pytest.raises(SkipPipelineError, match="No shards selected"):
+            stage.accept(dummy_dto)
+
+    def test_changed_label_file_selects_its_shard(self, dummy_dto, shard_dir):
+        """Test that a manifest sees changed .npy label files, and selecting one reads its image shard."""
+        write_npy_shards(shard_dir)
+        stage = ExtractFromShards(ShardConfig(os.path.join(shard_dir, "image-*.npy"), shard_format=ShardFormat.NPY,
+                                              shuffle_files=False))
+        manifest = RunManifest(os.path.join(shard_dir, "manifest.json"))
+        manifest.record(stage.inputs())
+
+        np.save(os.path.join(shard_dir, "label-00001.npy"), np.full(5, 7))
+        changed = manifest.changed(stage.inputs())
+        assert changed == [os.path.join(shard_dir, "label-00001.npy")]
+
+        stage.select_inputs(changed)
+        assert stage.selected == [os.path.join(shard_dir, "image-00001.npy")]
+        assert [label for _, label in read_pairs(stage.run(dummy_dto).raw_data)] == [7] * 5
+
+    def test_npy_shards_are_read_lazily(self, dummy_dto, shard_dir):
+        """Test that run only reads the shard headers, and the data is read as the dataset is consumed."""
+        write_npy_shards(shard_dir)
+        stage = ExtractFromShards(ShardConfig(os.path.join(shard_dir, "image-*.npy"), shard_format=ShardFormat.NPY))
+        dataset = stage.run(dummy_dto).raw_data
+
+        # Same layout, new contents: only a lazy reader sees them
+        for i in range(3):
+            np.save(os.path.join(shard_dir, f"image-{i:05d}.npy"), np.full((5, 4, 4, 3), 9, dtype=np.uint8))
+            np.save(os.path.join(shard_dir, f"label-{i:05d}.npy"), np.full(5, 9))
+
+        assert read_pairs(dataset) == [(9, 9)] * 15
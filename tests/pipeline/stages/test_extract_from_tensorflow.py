@@ -1,6 +1,7 @@
 import pytest
 from unittest.mock import patch, MagicMock
 import tensorflow as tf
+import tensorflow_datasets as tfds
 
 from src.model import DTO
 from src.pipeline.stages.extract_from_tensorflow import ExtractFromTensorFlow, DatasetSplit
@@ -50,4 +51,51 @@ class TestExtractFromTensorFlow:
         stage.run(dummy_dto)
         
         # Assert correct split was used
-        mock_load.assert_called_once_with("mnist", split=DatasetSplit.TEST, with_info=True, as_supervised=False)
\ No newline at end of file
+        mock_load.assert_called_once_with("mnist", split=DatasetSplit.TEST, with_info=True, as_supervised=False)
+
+    @patch("tensorflow_datasets.load")
+    def test_run_passes_read_options(self, mock_load, dummy_dto, mock_info):
+        """Test that read options are passed to tfds.load when set."""
+        mock_load.return_value = (tf.data.Dataset.range(5), mock_info)
+        read_config = tfds.ReadConfig(interleave_cycle_length=8, try_autocache=False)
+
+        stage = ExtractFromTensorFlow(name="mnist", with_info=True, read_config=read_config, skip_decoding=["image"],
+                                      shuffle_files=True, data_dir="/fast/tfds")
+        stage.run(dummy_dto)
+
+        kwargs = mock_load.call_args.kwargs
+        assert kwargs["read_config"] is read_config
+        assert isinstance(kwargs["decoders"]["image"], tfds.decode.SkipDecoding)
+        assert kwargs["shuffle_files"] is True
+        assert kwargs["data_dir"] == "/fast/tfds"
+
+    def test_load_kwargs_empty_by_default(self):
+        """Test that unset read options leave the TFDS defaults in place."""
+        assert ExtractFromTensorFlow(name="mnist").load_kwargs() == {}
+
+    @patch("tensorflow_datasets.load")
+    def test_run_with_split_expressions(self, mock_load, dummy_dto, mock_info):
+        """Test that a dictionary of split expressions loads a dictionary of datasets."""
+        datasets = {"train": tf.data.Dataset.range(8), "validation": tf.data.Dataset.range(2)}
+        mock_load.return_value = (datasets, mock_info)
+        split = {"train": "train[:80%]", "validation": "train[80%:]"}
+
+        result_dto = ExtractFromTensorFlow(name="mnist", split=split, with_info=True).run(dummy_dto)
+
+        assert mock_load.call_args.kwargs["split"] == split
+        assert result_dto.raw_data is datasets
+
+    @pytest.mark.parametrize("split, expected", [
+        (DatasetSplit.TEST, "test"),
+        ("train[:80%]", "train"),
+        ({"train": "train[:80%]", "validation": "train[80%:]"}, "train"),
+    ])
+    def test_base_split(self, split, expected):
+        """Test that the base split is recovered from split expressions."""
+        assert ExtractFromTensorFlow(name="mnist", split=split).base_split() == expected
+
+    def test_base_split_across_splits(self):
+        """Test that expressions over different splits have no single base split."""
+        stage = ExtractFromTensorFlow(name="mnist", split={"train": "train", "validation": "test"})
+        with pytest.raises(ValueError, match="more than one split"):
+            stage.base_split()
@@ -0,0 +1,32 @@
+from unittest.mock import MagicMock
+
+from src.model import SkipStageError
+from src.pipeline.stages.fan_out import FanOut
+
+
+class TestFanOut:
+
+    def test_accept_always_returns_none(self, dummy_dto):
+        """Test that accept has no preconditions."""
+        assert FanOut([]).accept(dummy_dto) is None
+
+    def test_run_calls_every_branch(self, dummy_dto):
+        """Test that every branch receives the same DTO and the input DTO is returned."""
+        sink1 = MagicMock()
+        sink2 = MagicMock()
+
+        result = FanOut([sink1, sink2]).run(dummy_dto)
+
+        sink1.run.assert_called_once_with(dummy_dto)
+        sink2.run.assert_called_once_with(dummy_dto)
+        assert result is dummy_dto
+
+    def test_run_continues_after_skipped_branch(self, dummy_dto):
+        """Test that a skipped branch does not stop the remaining branches."""
+        sink1 = MagicMock()
+        sink1.run.side_effect = SkipStageError("Skip")
+        sink2 = MagicMock()
+
+        FanOut([sink1, sink2]).run(dummy_dto)
+
+        sink2.run.assert_called_once_with(dummy_dto)
@@ -0,0 +1,104 @@
+from unittest.mock import MagicMock
+
+import numpy as np
+import pytest
+
+from src.model import SkipStageError
+from src.pipeline.stages.apply_sliding_window import ApplySlidingWindow, SlidingWindowConfig, NODATA_CLASS
+from src.pipeline.stages.filter_tiles import FilterTiles, TileFilterConfig
+
+
+@pytest.fixture
+def scene():
+    """8x8 scene of three bands: a nodata left quarter, a flat dark band, textured land and a cloud mask band."""
+    rng = np.random.default_rng(0)
+    scene = np.zeros((8, 8, 4), dtype=np.float32)
+    scene[:, 2:4, :3] = 0.05
+    scene[:, 4:, :3] = rng.uniform(0.2, 0.8, (8, 4, 3))
+    scene[6:, 4:, 3] = 1.0
+    return scene
+
+
+class TestFilterTiles:
+
+    def test_accept_without_scene(self, dummy_dto):
+        """Test that accept raises SkipStageError when there is no scene to filter."""
+        with pytest.raises(SkipStageError, match="needs a scene"):
+            FilterTiles(TileFilterConfig()).accept(dummy_dto)
+
+    def test_invalid_labels_raise(self):
+        """Test that labels for unknown skip reasons are rejected."""
+        with pytest.raises(ValueError, match="Unknown skip reasons"):
+            TileFilterConfig(labels={"water": 1})
+
+    def test_window_stats_match_direct_computation(self, scene):
+        """Test that statistics from cell sums equal those computed on each window."""
+        stage = FilterTiles(TileFilterConfig(window=4, stride=2, mask_band=3))
+
+        stats = stage.window_stats(scene)
+
+        assert stats["nodata"].shape == (3, 3)
+        window = scene[2:6, 4:8]
+        np.testing.assert_allclose(stats["brightness"][1, 2], window[..., :3].mean(), rtol=1e-5)
+        np.testing.assert_allclose(stats["variance"][1, 2], window[..., :3].var(axis=(0, 1)).mean(), rtol=1e-4)
+        np.testing.assert_allclose(stats["masked"][2, 2], 0.5)
+        np.testing.assert_allclose(stats["nodata"][:, 0], 0.5)
+
+    def test_window_stats_with_partial_cells(self):
+        """Test that scenes whose size is not a multiple of the stride are summed strip by strip correctly."""
+        scene = np.random.default_rng(1).uniform(0.1, 1.0, (37, 45, 3)).astype(np.float32)
+        scene[:5] = 0
+        stage = FilterTiles(TileFilterConfig(window=8, stride=4))
+
+        stats = stage.window_stats(scene)
+
+        window = scene[8:16, 12:20]
+        valid = window[~np.all(window == 0, axis=-1)]
+        np.testing.assert_allclose(stats["brightness"][2, 3], valid.mean(), rtol=1e-5)
+        np.testing.assert_allclose(stats["variance"][2, 3], valid.var(axis=0).mean(), rtol=1e-4)
+        np.testing.assert_allclose(stats["nodata"][0, 0], 5 / 8)
+
+    def test_variance_is_per_band(self):
+        """Test that a flat window with different values per band has no variance."""
+        flat = np.tile(np.array([10.0, 40.0, 80.0], dtype=np.float32), (4, 4, 1))
+        stage = FilterTiles(TileFilterConfig(window=4, stride=2, nodata=None, min_variance=1.0))
+
+        stats = stage.window_stats(flat)
+
+        np.testing.assert_allclose(stats["variance"], 0.0, atol=1e-6)
+        np.testing.assert_allclose(stats["brightness"], 130.0 / 3)
+        labels, skipped = stage.window_labels(stats)
+        assert skipped["variance"] == 1
+
+    def test_run_labels_skipped_windows(self, dummy_dto, scene):
+        """Test that windows are dropped or labeled per reason, and counted."""
+        dummy_dto.raw_data = scene
+        stage = FilterTiles(TileFilterConfig(window=4, stride=2, max_nodata_fraction=0.4, mask_band=3,
+                                             max_masked_fraction=0.4, min_variance=0.001, labels={"variance": 7}))
+
+        labels = stage.run(dummy_dto).window_labels
+
+        assert (labels[:, 0] == NODATA_CLASS).all()
+        assert (labels[:2, 2] == -1).all()
+        assert labels[2, 2] == NODATA_CLASS
+        assert stage.windows_total == 9
+        assert stage.windows_skipped["nodata"] == 3
+        assert stage.windows_skipped["masked"] == 1
+
+    def test_sliding_window_skips_filtered_windows(self, dummy_dto, scene):
+        """Test that inference only runs on kept windows, without the mask band, and fills labeled windows."""
+        dummy_dto.raw_data = scene
+        dummy_dto.window_labels = np.array([[NODATA_CLASS, 1, -1]] * 3, dtype=np.int16)
+        model = MagicMock()
+        model.predict_on_batch.side_effect = lambda batch: np.tile([[1.0, 0.0]], (len(batch), 1))
+        dummy_dto.keras_model = model
+        stage = ApplySlidingWindow(SlidingWindowConfig(window=4, stride=2, bands=[0, 1, 2]))
+
+        raster = stage.run(dummy_dto).prediction_raster
+
+        assert stage.windows_predicted == 3
+        assert model.predict_on_batch.call_args[0][0].shape == (3, 4, 4, 3)
+        # Cells only covered by dropped windows stay empty
+        assert (raster[:, 0] == NODATA_CLASS).all()
+        assert (raster[:, 1] == 1).all()
+        assert (raster[:, 3] == 0).all()
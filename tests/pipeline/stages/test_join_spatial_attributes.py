@@ -0,0 +1,102 @@
+import os
+import tempfile
+from unittest.mock import patch
+
+import geopandas as gpd
+import numpy as np
+import pytest
+from shapely.geometry import Point, box
+
+from src.model import SkipStageError
+from src.pipeline.stages.join_spatial_attributes import JoinSpatialAttributes, JoinSpatialAttributesConfig
+
+
+@pytest.fixture
+def polygons_dir():
+    """Directory with a layer of two regions, overlapping between x=1.5 and x=2."""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        regions = gpd.GeoDataFrame({"region_id": [10, 20], "name": ["west", "east"]},
+                                   geometry=[box(0, 0, 2, 2), box(1.5, 0, 4, 2)], crs="EPSG:4326")
+        regions.to_file(os.path.join(temp_dir, "regions.geojson"), driver="GeoJSON")
+        yield temp_dir
+
+
+@pytest.fixture
+def dto_with_predictions(dummy_dto):
+    """DTO with point predictions in the west region, the overlap, the east region and outside both."""
+    dummy_dto.processed_data = {
+        "label": np.array([0, 1, 2, 1]),
+        "geometry": [Point(0.5, 1), Point(1.75, 1), Point(3, 1), Point(9, 9)],
+    }
+    return dummy_dto
+
+
+class TestJoinSpatialAttributes:
+
+    def test_accept_without_geometries(self, dummy_dto, polygons_dir):
+        """Test that accept raises SkipStageError when predictions have no location."""
+        dummy_dto.processed_data = {"label": [0]}
+        regions = os.path.join(polygons_dir, "regions.geojson")
+        stage = JoinSpatialAttributes(JoinSpatialAttributesConfig(regions, ["name"]))
+
+        with pytest.raises(SkipStageError, match="geometry column"):
+            stage.accept(dummy_dto)
+
+    def test_run_attaches_attributes(self, dto_with_predictions, polygons_dir):
+        """Test that every prediction gets the attributes of the first polygon it falls in."""
+        config = JoinSpatialAttributesConfig(os.path.join(polygons_dir, "regions.geojson"), ["region_id", "name"],
+                                             prefix="region_", missing="none")
+        stage = JoinSpatialAttributes(config)
+
+        result = stage.run(dto_with_predictions)
+
+        assert list(result.processed_data["region_name"]) == ["west", "west", "east", "none"]
+        assert list(result.processed_data["region_region_id"][:3]) == [10, 10, 20]
+        assert stage.matched == 3
+
+    def test_run_with_lon_lat_columns(self, dummy_dto, polygons_dir):
+        """Test that lon/lat columns are joined as points and fully matched columns keep their dtype."""
+        dummy_dto.processed_data = {"lon": np.array([0.5, 3.0]), "lat": np.array([1.0, 1.0])}
+        regions = os.path.join(polygons_dir, "regions.geojson")
+        stage = JoinSpatialAttributes(JoinSpatialAttributesConfig(regions, ["region_id"]))
+
+        result = stage.run(dummy_dto)
+
+        assert result.processed_data["region_id"].dtype.kind == "i"
+        assert list(result.processed_data["region_id"]) == [10, 20]
+
+    def test_run_in_dto_crs(self, dummy_dto, polygons_dir):
+        """Test that the polygon layer is reprojected to the CRS of the predictions."""
+        # 500 km east of the origin of UTM zone 31N lies on its central meridian, 3 degrees east
+        dummy_dto.processed_data = {"geometry": [Point(500000, 100000)]}
+        dummy_dto.crs = "EPSG:32631"
+        regions = os.path.join(polygons_dir, "regions.geojson")
+        stage = JoinSpatialAttributes(JoinSpatialAttributesConfig(regions, ["name"]))
+
+        result = stage.run(dummy_dto)
+
+        assert list(result.processed_data["name"]) == ["east"]
+
+    def test_tree_cache_skips_reading_layer(self, dto_with_predictions, polygons_dir):
+        """Test that a second stage loads the tree from the cache, and a changed layer invalidates it."""
+        path = os.path.join(polygons_dir, "regions.geojson")
+        config = JoinSpatialAttributesConfig(path, ["name"],
+                                             tree_cache=os.path.join(polygons_dir, "cache", "regions.pkl"))
+        JoinSpatialAttributes(config).run(dto_with_predictions)
+
+        with patch("geopandas.read_file", side_effect=AssertionError("layer read again")):
+            result = JoinSpatialAttributes(config).run(dto_with_predictions)
+        assert list(result.processed_data["name"][:3]) == ["west", "west", "east"]
+
+        os.utime(path, ns=(0, 0))
+        with patch("geopandas.read_file", wraps=gpd.read_file) as read_file:
+            JoinSpatialAttributes(config).run(dto_with_predictions)
+        read_file.assert_called_once()
+
+    def test_missing_attribute_raises(self, dto_with_predictions, polygons_dir):
+        """Test that asking for a column the layer does not have fails with its name."""
+        regions = os.path.join(polygons_dir, "regions.geojson")
+        stage = JoinSpatialAttributes(JoinSpatialAttributesConfig(regions, ["admin_code"]))
+
+        with pytest.raises(ValueError, match="admin_code"):
+            stage.run(dto_with_predictions)
@@ -0,0 +1,156 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import numpy as np
+import pytest
+
+from src.model import SkipStageError
+from src.pipeline.stages.load_to_clickhouse import (
+    LoadToClickHouse, ClickHouseConfig, encode_native_block, FIXED_WIDTH_TYPES
+)
+
+
+def read_varuint(buf, pos):
+    result = shift = 0
+    while True:
+        byte = buf[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return result, pos
+        shift += 7
+
+
+def read_string(buf, pos):
+    length, pos = read_varuint(buf, pos)
+    return buf[pos:pos + length].decode(), pos + length
+
+
+def decode_native_block(buf):
+    """Minimal Native format decoder used to check the wire format."""
+    n_columns, pos = read_varuint(buf, 0)
+    n_rows, pos = read_varuint(buf, pos)
+    columns = {}
+    for _ in range(n_columns):
+        name, pos = read_string(buf, pos)
+        ch_type, pos = read_string(buf, pos)
+        if ch_type == "String":
+            values = []
+            for _ in range(n_rows):
+                value, pos = read_string(buf, pos)
+                values.append(value)
+        else:
+            dtype = np.dtype(FIXED_WIDTH_TYPES[ch_type])
+            values = np.frombuffer(buf[pos:pos + n_rows * dtype.itemsize], dtype=dtype).tolist()
+            pos += n_rows * dtype.itemsize
+        columns[name] = (ch_type, values)
+    assert pos == len(buf)
+    return columns
+
+
+@pytest.fixture
+def clickhouse_server():
+    """Local stand-in for the ClickHouse HTTP interface that records inserts."""
+    received = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers["Content-Length"]))
+            received.append({
+                "query": parse_qs(urlparse(self.path).query)["query"][0],
+                "user": self.headers["X-ClickHouse-User"],
+                "body": body,
+            })
+            status = 500 if b"fail" in body else 200
+            self.send_response(status)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}", received
+    server.shutdown()
+
+
+COLUMNS = [("tile_id", "UInt32"), ("probability", "Float32"), ("label", "String")]
+
+
+def make_dto(dummy_dto, rows):
+    dummy_dto.processed_data = {
+        "tile_id": np.arange(rows),
+        "probability": np.linspace(0, 1, rows),
+        "label": [f"class{i % 3}" for i in range(rows)],
+    }
+    return dummy_dto
+
+
+class TestLoadToClickHouse:
+
+    def test_config_rejects_unsupported_type(self):
+        """Test that unknown column types are rejected up front."""
+        with pytest.raises(ValueError, match="Unsupported ClickHouse type"):
+            ClickHouseConfig(table="t", columns=[("a", "Decimal(10, 2)")])
+
+    def test_config_rejects_url_with_path(self):
+        """Test that a database in the URL path is rejected instead of silently ignored."""
+        with pytest.raises(ValueError, match="database="):
+            ClickHouseConfig(table="t", columns=[("a", "String")], url="http://localhost:8123/geo")
+        ClickHouseConfig(table="t", columns=[("a", "String")], url="http://localhost:8123/")
+
+    def test_accept_without_processed_data(self, dummy_dto):
+        """Test that accept skips the stage when there is nothing to load."""
+        stage = LoadToClickHouse(ClickHouseConfig(table="t", columns=COLUMNS))
+        with pytest.raises(SkipStageError, match="No processed data"):
+            stage.accept(dummy_dto)
+
+    def test_accept_with_missing_column(self, dummy_dto):
+        """Test that accept skips the stage when a configured column is missing."""
+        dummy_dto.processed_data = {"tile_id": [1]}
+        stage = LoadToClickHouse(ClickHouseConfig(table="t", columns=COLUMNS))
+        with pytest.raises(SkipStageError, match="missing columns"):
+            stage.accept(dummy_dto)
+
+    def test_encode_native_block_round_trip(self):
+        """Test that a block decodes back to the original columns."""
+        data = {"tile_id": [1, 2, 3], "probability": [0.5, 0.25, 1.0], "label": ["a", "bb", "ccc"]}
+
+        decoded = decode_native_block(encode_native_block(COLUMNS, data, 1, 3))
+
+        assert decoded == {
+            "tile_id": ("UInt32", [2, 3]),
+            "probability": ("Float32", [0.25, 1.0]),
+            "label": ("String", ["bb", "ccc"]),
+        }
+
+    @pytest.mark.parametrize("async_flush", [True, False])
+    def test_run_inserts_batches(self, clickhouse_server, dummy_dto, async_flush):
+        """Test that run sends one Native INSERT per batch covering every row."""
+        url, received = clickhouse_server
+        config = ClickHouseConfig(table="predictions", columns=COLUMNS, url=url, database="geo", batch_size=4,
+                                  async_flush=async_flush)
+        stage = LoadToClickHouse(config)
+
+        result = stage.run(make_dto(dummy_dto, 10))
+
+        assert result is dummy_dto
+        assert len(received) == 3
+        assert received[0]["query"] == "INSERT INTO geo.predictions (tile_id, probability, label) FORMAT Native"
+        assert received[0]["user"] == "default"
+
+        tile_ids = sorted(i for r in received for i in decode_native_block(r["body"])["tile_id"][1])
+        assert tile_ids == list(range(10))
+        assert stage.rows_written == 10
+
+    def test_run_raises_on_server_error(self, clickhouse_server, dummy_dto):
+        """Test that a rejected insert raises so retry policies can handle it."""
+        url, _ = clickhouse_server
+        stage = LoadToClickHouse(ClickHouseConfig(table="t", columns=[("label", "String")], url=url))
+        dummy_dto.processed_data = {"label": ["fail"]}
+
+        with pytest.raises(IOError, match="ClickHouse insert failed with 500"):
+            stage.run(dummy_dto)
@@ -46,6 +46,7 @@ class TestLoadToGeoJSON:
         # Create a DTO with processed_data
         test_dto = MagicMock()
         test_dto.processed_data = {"column1": [1, 2, 3], "geometry": ["POINT(0 0)", "POINT(1 1)", "POINT(2 2)"]}
+        test_dto.crs = None
         
         result = stage.run(test_dto)
         
@@ -78,4 +79,15 @@ class TestLoadToGeoJSON:
         mock_print.assert_called_once_with("Error loading GeoJSON data: Test error")
         
         # Assert that the function returns the input DTO
-        assert result is test_dto
\ No newline at end of file
+        assert result is test_dto
+    
+    @patch("geopandas.GeoDataFrame")
+    def test_run_uses_dto_crs(self, mock_geodataframe):
+        """Test that the GeoJSON is written in the CRS recorded in the DTO."""
+        stage = LoadToGeoJSON("/valid/path")
+        test_dto = MagicMock()
+        test_dto.crs = "EPSG:32633"
+
+        stage.run(test_dto)
+
+        mock_geodataframe.assert_called_once_with(test_dto.processed_data, crs="EPSG:32633")
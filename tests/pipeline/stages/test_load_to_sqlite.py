@@ -0,0 +1,91 @@
+import os
+import sqlite3
+import tempfile
+
+import pytest
+from shapely.geometry import Point, box
+
+from src.model import SkipStageError
+from src.pipeline.stages.load_to_sqlite import LoadToSQLite, SQLiteConfig, query_bbox
+
+
+@pytest.fixture
+def db_path():
+    """Temporary database file."""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        yield os.path.join(temp_dir, "predictions.sqlite")
+
+
+def predictions(labels):
+    return {
+        "tile_id": list(range(len(labels))),
+        "label": labels,
+        "geometry": [box(i, i, i + 1, i + 1) for i in range(len(labels))],
+    }
+
+
+class TestLoadToSQLite:
+
+    def test_accept_without_processed_data(self, dummy_dto, db_path):
+        """Test that accept skips the stage when there is nothing to load."""
+        stage = LoadToSQLite(SQLiteConfig(db_path, columns=["label"]))
+        with pytest.raises(SkipStageError, match="No processed data"):
+            stage.accept(dummy_dto)
+
+    def test_accept_with_missing_column(self, dummy_dto, db_path):
+        """Test that accept skips the stage when a configured column is missing."""
+        dummy_dto.processed_data = {"tile_id": [1], "geometry": [Point(0, 0)]}
+        stage = LoadToSQLite(SQLiteConfig(db_path, columns=["label"]))
+        with pytest.raises(SkipStageError, match="missing columns"):
+            stage.accept(dummy_dto)
+
+    def test_run_inserts_and_indexes_rows(self, dummy_dto, db_path):
+        """Test that every tile is stored and reachable through the spatial index."""
+        dummy_dto.processed_data = predictions(["forest", "river", "sea"])
+        stage = LoadToSQLite(SQLiteConfig(db_path, columns=["label"]))
+
+        result = stage.run(dummy_dto)
+
+        assert result is dummy_dto
+        assert stage.rows_written == 3
+
+        rows = query_bbox(db_path, 1.5, 1.5, 1.8, 1.8)
+        assert [r["label"] for r in rows] == ["river"]
+        assert rows[0]["geometry"].equals(box(1, 1, 2, 2))
+
+    def test_repeat_run_only_writes_changed_tiles(self, dummy_dto, db_path):
+        """Test that an unchanged rerun writes nothing and changed tiles are updated."""
+        stage = LoadToSQLite(SQLiteConfig(db_path, columns=["label"]))
+
+        dummy_dto.processed_data = predictions(["forest", "river", "sea"])
+        stage.run(dummy_dto)
+        stage.run(dummy_dto)
+        assert stage.rows_written == 0
+
+        dummy_dto.processed_data = predictions(["forest", "lake", "sea", "highway"])
+        stage.run(dummy_dto)
+        assert stage.rows_written == 2
+
+        conn = sqlite3.connect(db_path)
+        labels = conn.execute("SELECT label FROM predictions ORDER BY tile_id").fetchall()
+        index_size = conn.execute("SELECT COUNT(*) FROM predictions_bbox").fetchone()[0]
+        conn.close()
+
+        assert [l for l, in labels] == ["forest", "lake", "sea", "highway"]
+        assert index_size == 4
+
+    def test_index_survives_vacuum(self, dummy_dto, db_path):
+        """Test that bbox queries return the right tiles after rows were deleted and the database vacuumed."""
+        dummy_dto.processed_data = predictions(["forest", "river", "sea"])
+        LoadToSQLite(SQLiteConfig(db_path, columns=["label"])).run(dummy_dto)
+
+        conn = sqlite3.connect(db_path)
+        with conn:
+            fid = conn.execute("SELECT fid FROM predictions WHERE tile_id = '0'").fetchone()[0]
+            conn.execute("DELETE FROM predictions WHERE fid = ?", (fid,))
+            conn.execute("DELETE FROM predictions_bbox WHERE id = ?", (fid,))
+        conn.execute("VACUUM")
+        conn.close()
+
+        assert [r["label"] for r in query_bbox(db_path, 1.5, 1.5, 1.8, 1.8)] == ["river"]
+        assert [r["label"] for r in query_bbox(db_path, 2.5, 2.5, 2.8, 2.8)] == ["sea"]
@@ -0,0 +1,102 @@
+import os
+import json
+import tempfile
+
+import numpy as np
+import pytest
+from shapely.geometry import Point
+
+from src.model import SkipStageError
+from src.pipeline.stages.load_to_vector_tiles import LoadToVectorTiles, VectorTileConfig
+from tests.utils.test_mvt import decode_point_tile
+
+
+@pytest.fixture
+def output_dir():
+    """Temporary tile directory."""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        yield temp_dir
+
+
+def read_zoom(output_dir, zoom):
+    features = []
+    for dirpath, _, filenames in os.walk(os.path.join(output_dir, str(zoom))):
+        for filename in filenames:
+            with open(os.path.join(dirpath, filename), "rb") as f:
+                features.extend(decode_point_tile(f.read())[2])
+    return features
+
+
+class TestLoadToVectorTiles:
+
+    def test_accept_without_processed_data(self, dummy_dto, output_dir):
+        """Test that accept skips the stage when there is nothing to tile."""
+        stage = LoadToVectorTiles(VectorTileConfig(output_dir))
+        with pytest.raises(SkipStageError, match="No processed data"):
+            stage.accept(dummy_dto)
+
+    def test_accept_with_projected_crs(self, dummy_dto, output_dir):
+        """Test that accept raises SkipStageError when coordinates are not longitude/latitude."""
+        dummy_dto.processed_data = {"lon": [500000.0], "lat": [5500000.0], "label": ["a"]}
+        dummy_dto.crs = "EPSG:32633"
+        stage = LoadToVectorTiles(VectorTileConfig(output_dir))
+
+        with pytest.raises(SkipStageError, match="Reproject"):
+            stage.accept(dummy_dto)
+
+    def test_accept_without_locations(self, dummy_dto, output_dir):
+        """Test that accept skips the stage without geometries or lon/lat."""
+        dummy_dto.processed_data = {"label": ["a"]}
+        stage = LoadToVectorTiles(VectorTileConfig(output_dir))
+        with pytest.raises(SkipStageError, match="geometry column"):
+            stage.accept(dummy_dto)
+
+    def test_accept_without_rows(self, dummy_dto, output_dir):
+        """Test that accept skips the stage when the processed data is empty."""
+        dummy_dto.processed_data = {"lon": [], "lat": [], "label": []}
+        stage = LoadToVectorTiles(VectorTileConfig(output_dir))
+        with pytest.raises(SkipStageError, match="no rows"):
+            stage.accept(dummy_dto)
+
+    def test_project_corners(self):
+        """Test that Web Mercator maps the origin to the center of the world."""
+        x, y = LoadToVectorTiles.project(np.array([0.0, -180.0]), np.array([0.0, 0.0]))
+        np.testing.assert_allclose(x, [0.5, 0.0])
+        np.testing.assert_allclose(y, [0.5, 0.5])
+
+    def test_run_writes_clustered_pyramid(self, dummy_dto, output_dir):
+        """Test that low zooms hold clusters covering every point and high zooms every point."""
+        rng = np.random.default_rng(0)
+        lon = rng.uniform(10.0, 10.5, 500)
+        lat = rng.uniform(50.0, 50.5, 500)
+        dummy_dto.processed_data = {
+            "geometry": [Point(x, y) for x, y in zip(lon, lat)],
+            "label": ["forest"] * 400 + ["river"] * 100,
+            "probability": rng.random(500),
+        }
+        config = VectorTileConfig(output_dir, min_zoom=0, max_zoom=12, cluster_max_zoom=10,
+                                  properties=("probability",))
+
+        LoadToVectorTiles(config).run(dummy_dto)
+
+        world = read_zoom(output_dir, 0)
+        assert len(world) < 500
+        assert sum(p["count"] for _, _, p in world) == 500
+        assert max(world, key=lambda f: f[2]["count"])[2]["label"] == "forest"
+
+        detail = read_zoom(output_dir, 12)
+        assert len(detail) == 500
+        assert all("probability" in p for _, _, p in detail)
+
+    def test_run_writes_viewer_and_metadata(self, dummy_dto, output_dir):
+        """Test that the viewer and TileJSON metadata are written next to the tiles."""
+        dummy_dto.processed_data = {"lon": [10.0, 11.0], "lat": [50.0, 51.0], "label": [1, 2]}
+
+        LoadToVectorTiles(VectorTileConfig(output_dir, max_zoom=3)).run(dummy_dto)
+
+        with open(os.path.join(output_dir, "metadata.json")) as f:
+            metadata = json.load(f)
+        assert metadata["bounds"] == [10.0, 50.0, 11.0, 51.0]
+        assert metadata["labels"] == ["1", "2"]
+        assert os.path.exists(os.path.join(output_dir, "index.html"))
+        assert os.path.exists(os.path.join(output_dir, "0", "0", "0.pbf"))
@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+import shapely
+from shapely.geometry import Point, box
+
+from src.model import SkipStageError
+from src.pipeline.stages.reproject_geometries import ReprojectConfig, ReprojectGeometries, get_transformer
+
+
+@pytest.fixture
+def dto_with_utm_predictions(dummy_dto):
+    """DTO with predictions from rasters in UTM zones 32N and 33N, and one already in WGS 84."""
+    dummy_dto.processed_data = {
+        "label": np.array([0, 1, 2]),
+        "crs": ["EPSG:32632", "EPSG:32633", None],
+        "geometry": [Point(500000, 5500000), box(500000, 5500000, 501000, 5501000), Point(10, 50)],
+        "lon": np.array([500000.0, 500000.0, 10.0]),
+        "lat": np.array([5500000.0, 5500000.0, 50.0]),
+    }
+    dummy_dto.crs = "EPSG:4326"
+    return dummy_dto
+
+
+class TestReprojectGeometries:
+
+    def test_accept_without_geometries(self, dummy_dto):
+        """Test that accept raises SkipStageError when there is nothing to reproject."""
+        dummy_dto.processed_data = {"label": [0]}
+
+        with pytest.raises(SkipStageError, match="no geometries"):
+            ReprojectGeometries(ReprojectConfig()).accept(dummy_dto)
+
+    def test_run_reprojects_each_source_crs(self, dto_with_utm_predictions):
+        """Test that rows are reprojected from their own CRS, and the target CRS is recorded in the DTO."""
+        stage = ReprojectGeometries(ReprojectConfig(target_crs="EPSG:4326"))
+
+        result = stage.run(dto_with_utm_predictions)
+
+        data = result.processed_data
+        # The central meridians of zones 32N and 33N are 9 and 15 degrees east
+        assert data["geometry"][0].x == pytest.approx(9.0)
+        assert shapely.centroid(data["geometry"][1]).x == pytest.approx(15.0, abs=0.01)
+        assert data["geometry"][2].equals(Point(10, 50))
+        np.testing.assert_allclose(data["lon"], [9.0, 15.0, 10.0])
+        assert data["lat"][0] == pytest.approx(data["geometry"][0].y)
+        assert list(data["crs"]) == ["EPSG:4326"] * 3
+        assert result.crs == "EPSG:4326"
+        assert stage.rows_reprojected == 2
+
+    def test_run_uses_dto_crs_without_crs_column(self, dummy_dto):
+        """Test that the DTO's CRS is the source when rows have no CRS of their own."""
+        dummy_dto.processed_data = {"geometry": [Point(9, 0)]}
+        dummy_dto.crs = "EPSG:4326"
+
+        result = ReprojectGeometries(ReprojectConfig(target_crs="EPSG:32632")).run(dummy_dto)
+
+        assert result.processed_data["geometry"][0].x == pytest.approx(500000.0)
+        assert result.crs == "EPSG:32632"
+
+    def test_transformers_are_cached(self):
+        """Test that a pair of CRSs reuses its transformer."""
+        assert get_transformer("EPSG:32632", "EPSG:4326") is get_transformer("EPSG:32632", "EPSG:4326")
@@ -2,6 +2,7 @@ import pytest
 import tensorflow as tf
 
 from src.model import DTO, SplitEnum, SkipPipelineError
+from src.pipeline.stages.extract_from_tensorflow import ExtractFromTensorFlow, DatasetSplit
 from src.pipeline.stages.split_tf_dataset import SplitTFDataset, SplitConfig
 
 
@@ -72,4 +73,48 @@ class TestSplitTFDataset:
         for batch in train_ds.take(1):
             # Assuming a tuple of (features, labels)
             features, _ = batch
-            assert features.shape[0] <= 2  # Batch size should be 2 or less
\ No newline at end of file
+            assert features.shape[0] <= 2  # Batch size should be 2 or less
+
+    def test_push_split_slices_extractor_split(self):
+        """Test that the ratios are pushed down into the extractor as TFDS split expressions."""
+        config = SplitConfig(train_ratio=0.7, valid_ratio=0.2)
+        extractor = ExtractFromTensorFlow(name="eurosat/rgb", split=DatasetSplit.TRAIN)
+
+        extractor.push_split(config.train_ratio, config.valid_ratio)
+
+        assert extractor.split == {
+            SplitEnum.TRAIN.value: "train[:70%]",
+            SplitEnum.VALIDATION.value: "train[70%:90%]",
+        }
+
+    def test_constructor_leaves_extractor_untouched(self):
+        """Test that building the stage does not change the split of an extractor used elsewhere."""
+        extractor = ExtractFromTensorFlow(name="eurosat/rgb", split=DatasetSplit.TRAIN)
+
+        SplitTFDataset(SplitConfig(train_ratio=0.7, valid_ratio=0.2))
+
+        assert extractor.split is DatasetSplit.TRAIN
+
+    def test_accept_with_incomplete_pre_split_data(self, dummy_dto):
+        """Test that accept rejects pre-split raw data without a validation dataset."""
+        dummy_dto.raw_data = {SplitEnum.TRAIN.value: tf.data.Dataset.range(5)}
+        stage = SplitTFDataset(SplitConfig())
+
+        with pytest.raises(SkipPipelineError, match="Pre-split raw data"):
+            stage.accept(dummy_dto)
+
+    def test_run_with_pre_split_data(self, dummy_dto):
+        """Test that pre-split raw data is batched as is, without take/skip."""
+        dummy_dto.raw_data = {
+            SplitEnum.TRAIN.value: tf.data.Dataset.range(8),
+            SplitEnum.VALIDATION.value: tf.data.Dataset.range(8, 10),
+        }
+        stage = SplitTFDataset(SplitConfig(batch=4, size=1))
+
+        stage.accept(dummy_dto)
+        result = stage.run(dummy_dto)
+
+        train = [int(x) for batch in result.split_data[SplitEnum.TRAIN.value] for x in batch]
+        valid = [int(x) for batch in result.split_data[SplitEnum.VALIDATION.value] for x in batch]
+        assert sorted(train) == list(range(8))
+        assert valid == [8, 9]
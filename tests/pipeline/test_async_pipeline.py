@@ -0,0 +1,152 @@
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import pytest
+from unittest.mock import MagicMock
+
+from src.model import SkipStageError, SkipPipelineError
+from src.pipeline.async_pipeline import AsyncPipeline, with_concurrency, with_executor, DEFAULT_CONCURRENCY
+from src.pipeline.pipeline import with_tracing
+from src.pipeline.stage import Stage
+from src.pipeline.stages.fan_out import FanOut
+
+
+class AsyncAddStage(Stage):
+    """Stage with an async hook that records how many runs overlap."""
+
+    def __init__(self, value, delay=0.0):
+        self.value = value
+        self.delay = delay
+        self.active = 0
+        self.max_active = 0
+
+    def accept(self, dto):
+        return None
+
+    def run(self, dto):
+        raise AssertionError("run_async should be used")
+
+    async def run_async(self, dto):
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        await asyncio.sleep(self.delay)
+        self.active -= 1
+        return dto + self.value
+
+
+class TestAsyncPipeline:
+
+    def test_init_defaults(self):
+        """Test that AsyncPipeline uses the default executor and concurrency."""
+        pipeline = AsyncPipeline([])
+        assert pipeline.executor is None
+        assert pipeline.concurrency == DEFAULT_CONCURRENCY
+
+    def test_options_are_applied(self):
+        """Test that with_executor and with_concurrency configure the pipeline."""
+        executor = MagicMock()
+        pipeline = AsyncPipeline([], with_executor(executor), with_concurrency(3))
+        assert pipeline.executor is executor
+        assert pipeline.concurrency == 3
+
+    def test_run_async_awaits_async_hooks(self):
+        """Test that stages with run_async are awaited."""
+        pipeline = AsyncPipeline([AsyncAddStage(1), AsyncAddStage(2)])
+        assert asyncio.run(pipeline.run_async(0)) == 3
+
+    def test_run_async_runs_blocking_stages_in_executor(self):
+        """Test that synchronous stages run off the event loop thread."""
+        threads = []
+        stage = MagicMock()
+        stage.run.side_effect = lambda dto: threads.append(threading.get_ident()) or dto
+
+        pipeline = AsyncPipeline([stage])
+        dto = MagicMock()
+
+        assert asyncio.run(pipeline.run_async(dto)) is dto
+        assert threads and threads[0] != threading.get_ident()
+
+    def test_run_async_handles_skip_stage_error(self):
+        """Test that SkipStageError skips the stage and continues."""
+        stage1 = MagicMock()
+        stage1.run.side_effect = SkipStageError("Skip stage")
+
+        pipeline = AsyncPipeline([stage1, AsyncAddStage(1)])
+        pipeline.log = MagicMock()
+
+        assert asyncio.run(pipeline.run_async(1)) == 2
+        pipeline.log.assert_called_once()
+
+    def test_run_async_propagates_skip_pipeline_error(self):
+        """Test that SkipPipelineError aborts the run."""
+        stage1 = MagicMock()
+        stage1.run.side_effect = SkipPipelineError("Skip pipeline")
+
+        pipeline = AsyncPipeline([stage1])
+        pipeline.log = MagicMock()
+
+        with pytest.raises(SkipPipelineError, match="Skip pipeline"):
+            asyncio.run(pipeline.run_async(MagicMock()))
+
+    def test_fan_out_branches_run_concurrently(self):
+        """Test that FanOut branches overlap and the input DTO is returned."""
+        barrier = threading.Barrier(2, timeout=5)
+        sink1 = MagicMock()
+        sink2 = MagicMock()
+        sink1.run.side_effect = lambda dto: barrier.wait()
+        sink2.run.side_effect = lambda dto: barrier.wait()
+
+        pipeline = AsyncPipeline([FanOut([sink1, sink2])])
+        dto = MagicMock()
+
+        # Both sinks must be inside run at the same time to pass the barrier
+        assert asyncio.run(pipeline.run_async(dto)) is dto
+
+    def test_run_many_respects_concurrency_limit(self):
+        """Test that run_many returns results in order and limits concurrency."""
+        stage = AsyncAddStage(1, delay=0.01)
+        pipeline = AsyncPipeline([stage], with_concurrency(2))
+
+        assert asyncio.run(pipeline.run_many(range(10))) == list(range(1, 11))
+        assert stage.max_active == 2
+
+    def test_run_many_can_return_exceptions(self):
+        """Test that failures can be returned in place of their results."""
+        def run(dto):
+            if not dto:
+                raise ValueError("bad")
+            return dto
+
+        stage = MagicMock()
+        stage.run.side_effect = run
+
+        pipeline = AsyncPipeline([stage])
+        results = asyncio.run(pipeline.run_many([1, 0], return_exceptions=True))
+
+        assert results[0] == 1
+        assert isinstance(results[1], ValueError)
+
+    def test_run_many_writes_one_trace_per_run(self):
+        """Test that concurrent runs write their own trace, with the spans of the stages run in the executor."""
+        class SlowStage(Stage):
+            def accept(self, dto):
+                return None
+
+            def run(self, dto):
+                threading.Event().wait(0.02)
+                return dto
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            pipeline = AsyncPipeline([SlowStage(), AsyncAddStage(1, delay=0.01)], with_tracing(temp_dir))
+            pipeline.log = MagicMock()
+
+            asyncio.run(pipeline.run_many([0, 1, 2]))
+
+            traces = os.listdir(temp_dir)
+            assert len(traces) == 3
+            for name in traces:
+                with open(os.path.join(temp_dir, name)) as f:
+                    spans = [e["name"] for e in json.load(f)["traceEvents"] if e["ph"] == "X"]
+                assert sorted(spans) == ["AsyncAddStage", "SlowStage"]
@@ -0,0 +1,96 @@
+import json
+import os
+import tempfile
+
+import pytest
+
+from src.pipeline.manifest import RunManifest, content_hash
+
+
+@pytest.fixture
+def input_dir():
+    """Temporary directory with three input files."""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for i in range(3):
+            with open(os.path.join(temp_dir, f"scene-{i}.tif"), "wb") as f:
+                f.write(bytes([i]) * 100)
+        yield temp_dir
+
+
+def inputs(directory):
+    return sorted(os.path.join(directory, name) for name in os.listdir(directory) if name.endswith(".tif"))
+
+
+class TestRunManifest:
+
+    def test_new_inputs_are_changed(self, input_dir):
+        """Test that every input counts as changed before anything was recorded."""
+        manifest = RunManifest(os.path.join(input_dir, "manifest.json"))
+        assert manifest.changed(inputs(input_dir)) == inputs(input_dir)
+
+    def test_recorded_inputs_are_unchanged(self, input_dir):
+        """Test that recorded inputs are skipped by a new manifest on the same file, and new inputs are not."""
+        path = os.path.join(input_dir, "manifest.json")
+        RunManifest(path).record(inputs(input_dir), model_hash="abc")
+        new_input = os.path.join(input_dir, "scene-9.tif")
+        with open(new_input, "wb") as f:
+            f.write(b"new")
+
+        assert RunManifest(path).changed(inputs(input_dir)) == [new_input]
+
+    def test_fingerprint_reuses_hash_of_untouched_inputs(self, input_dir):
+        """Test that inputs with the recorded size and mtime are not read again."""
+        manifest = RunManifest(os.path.join(input_dir, "manifest.json"))
+        manifest.record(inputs(input_dir))
+        key = os.path.abspath(inputs(input_dir)[0])
+        manifest.entries[key]["sha256"] = "recorded"
+
+        assert manifest.fingerprint(key)["sha256"] == "recorded"
+
+    def test_modified_content_is_changed(self, input_dir):
+        """Test that an input whose bytes changed is processed again, but a touched one is not."""
+        manifest = RunManifest(os.path.join(input_dir, "manifest.json"))
+        manifest.record(inputs(input_dir))
+        modified, touched = inputs(input_dir)[:2]
+        with open(modified, "wb") as f:
+            f.write(b"x" * 100)
+        os.utime(touched, ns=(0, 0))
+
+        assert manifest.changed(inputs(input_dir)) == [modified]
+
+    def test_other_model_is_changed(self, input_dir):
+        """Test that inputs processed with another model count as changed only when a model hash is given."""
+        manifest = RunManifest(os.path.join(input_dir, "manifest.json"))
+        manifest.record(inputs(input_dir), model_hash="old")
+
+        assert manifest.changed(inputs(input_dir)) == []
+        assert manifest.changed(inputs(input_dir), model_hash="old") == []
+        assert manifest.changed(inputs(input_dir), model_hash="new") == inputs(input_dir)
+
+    def test_record_writes_fingerprints(self, input_dir):
+        """Test that the manifest file holds the fingerprint and model hash of every input."""
+        path = os.path.join(input_dir, "manifest.json")
+        RunManifest(path).record(inputs(input_dir)[:1], model_hash="abc")
+
+        with open(path) as f:
+            entry = json.load(f)["inputs"][os.path.abspath(inputs(input_dir)[0])]
+        assert entry["size"] == 100
+        assert entry["sha256"] == content_hash(inputs(input_dir)[0])
+        assert entry["model_hash"] == "abc"
+        assert "mtime_ns" in entry and "processed_at" in entry
+
+    def test_forget_reprocesses_inputs(self, input_dir):
+        """Test that forgotten inputs count as changed again."""
+        manifest = RunManifest(os.path.join(input_dir, "manifest.json"))
+        manifest.record(inputs(input_dir))
+        manifest.forget(inputs(input_dir)[:1])
+
+        assert manifest.changed(inputs(input_dir)) == inputs(input_dir)[:1]
+
+    def test_unreadable_manifest_is_ignored(self, input_dir):
+        """Test that a corrupt manifest file starts an empty manifest."""
+        path = os.path.join(input_dir, "manifest.json")
+        with open(path, "w") as f:
+            f.write("{not json")
+
+        assert RunManifest(path).entries == {}
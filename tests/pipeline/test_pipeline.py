@@ -1,9 +1,132 @@
 import pytest
+import json
 import logging
+import os
+import tempfile
+import threading
 from unittest.mock import MagicMock, patch
 
 from src.model import DTO, SkipStageError, SkipPipelineError
-from src.pipeline.pipeline import Pipeline, with_logger
+from src.pipeline.pipeline import Pipeline, with_logger, with_queue_depth, DEFAULT_QUEUE_DEPTH, MapStats
+from src.pipeline.pipeline import with_retry, with_timeout, with_circuit_breaker, with_memory_report, with_tracing
+from src.pipeline.pipeline import with_resources, with_manifest
+from src.pipeline.manifest import RunManifest
+from src.pipeline.stages.fan_out import FanOut
+from src.pipeline.resources import ResourceConfig, ResourceRegistry
+from src.pipeline.stage import Stage
+
+
+class AddStage(Stage):
+    """Stage that adds a constant to an integer payload."""
+
+    def __init__(self, value):
+        self.value = value
+
+    def accept(self, dto):
+        return None
+
+    def run(self, dto):
+        return dto + self.value
+
+
+class ConsumingStage(Stage):
+    """Stage that declares the DTO fields it reads."""
+
+    def __init__(self, *consumes):
+        self.consumes = consumes
+        self.seen = []
+
+    def accept(self, dto):
+        return None
+
+    def run(self, dto):
+        self.seen.append({field: getattr(dto, field) for field in self.consumes})
+        return dto
+
+
+class CountingStage(Stage):
+    """Stage that reports the worker process and how many DTOs this stage instance has seen."""
+
+    def __init__(self):
+        self.count = 0
+
+    def accept(self, dto):
+        return None
+
+    def run(self, dto):
+        self.count += 1
+        return os.getpid(), self.count
+
+
+class ThreadingStage(Stage):
+    """Stage that reports the CPUs and TensorFlow thread pool it runs with."""
+
+    def accept(self, dto):
+        return None
+
+    def run(self, dto):
+        import tensorflow as tf
+        return sorted(os.sched_getaffinity(0)), tf.config.threading.get_intra_op_parallelism_threads()
+
+
+class FileStage(Stage):
+    """Extractor over the files of a directory that records the files each run reads."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.selected = None
+        self.read = []
+
+    def accept(self, dto):
+        return None
+
+    def inputs(self):
+        return sorted(os.path.join(self.directory, name) for name in os.listdir(self.directory)
+                      if name.endswith(".tif"))
+
+    def select_inputs(self, paths):
+        self.selected = paths
+
+    def run(self, dto):
+        self.read.append(self.selected)
+        return dto
+
+
+class FailingStage(Stage):
+    """Stage that fails on negative payloads."""
+
+    def accept(self, dto):
+        return None
+
+    def run(self, dto):
+        if dto < 0:
+            raise SkipPipelineError("negative")
+        return dto
+
+
+class SkippingStage(Stage):
+    """Sink that is always skipped, e.g. because its database is unreachable."""
+
+    def accept(self, dto):
+        return None
+
+    def run(self, dto):
+        raise SkipStageError("db unreachable")
+
+
+class SplitStage(Stage):
+    """Streaming stage that turns every chunk into two."""
+
+    def accept(self, dto):
+        return None
+
+    def run(self, dto):
+        return dto
+
+    def run_stream(self, chunks):
+        for dto in chunks:
+            yield dto
+            yield dto
 
 
 class TestPipeline:
@@ -144,4 +267,389 @@ class TestPipeline:
         assert len(logger.handlers) == 1
         
         # Cleanup
-        logger.handlers = []
\ No newline at end of file
+        logger.handlers = []
+
+    def test_init_applies_options(self):
+        """Test that Pipeline.__init__ applies functional options."""
+        mock_logger = MagicMock()
+        mock_logger.handlers = [MagicMock()]
+
+        pipeline = Pipeline([], with_logger(mock_logger), with_queue_depth(2))
+
+        assert pipeline.logger is mock_logger
+        assert pipeline.queue_depth == 2
+
+    def test_with_queue_depth_rejects_invalid_depth(self):
+        """Test that with_queue_depth rejects depths below one."""
+        with pytest.raises(ValueError):
+            with_queue_depth(0)
+
+
+    @patch("src.pipeline.policy.time.sleep")
+    def test_run_retries_stage_with_retry_option(self, mock_sleep):
+        """Test that with_retry makes run retry a failing stage."""
+        stage1 = MagicMock()
+        stage1.run.side_effect = [IOError("flaky"), "dto"]
+
+        pipeline = Pipeline([stage1], with_retry(attempts=2))
+        pipeline.log = MagicMock()
+
+        assert pipeline.run(MagicMock()) == "dto"
+        assert stage1.run.call_count == 2
+
+    def test_policy_options_target_given_stages(self):
+        """Test that policy options only apply to the stages passed in."""
+        stage1 = MagicMock()
+        stage2 = MagicMock()
+
+        pipeline = Pipeline([stage1, stage2], with_timeout(10, stage2), with_circuit_breaker(stage2))
+
+        assert stage1 not in pipeline.policies
+        assert pipeline.policies[stage2].timeout == 10
+        assert pipeline.policies[stage2].breaker is not None
+
+    def test_run_skips_stage_with_open_circuit(self):
+        """Test that a stage with an open circuit is skipped and the pipeline continues."""
+        sink = MagicMock()
+        sink.run.side_effect = IOError("down")
+        stage2 = MagicMock()
+        stage2.run.side_effect = lambda dto: dto
+
+        pipeline = Pipeline([sink, stage2], with_circuit_breaker(sink, failure_threshold=1))
+        pipeline.log = MagicMock()
+
+        with pytest.raises(IOError):
+            pipeline.run(MagicMock())
+
+        dto = MagicMock()
+        assert pipeline.run(dto) is dto
+        sink.run.assert_called_once()
+
+    def test_fan_out_branches_run_under_their_policies(self):
+        """Test that a FanOut branch with an open circuit is skipped while the other branches keep running."""
+        failing = MagicMock()
+        failing.run.side_effect = IOError("down")
+        healthy = MagicMock()
+
+        pipeline = Pipeline([FanOut([failing, healthy])], with_circuit_breaker(failing, failure_threshold=1))
+        pipeline.log = MagicMock()
+
+        with pytest.raises(IOError):
+            pipeline.run(MagicMock())
+        for _ in range(2):
+            pipeline.run(MagicMock())
+
+        failing.run.assert_called_once()
+        assert healthy.run.call_count == 2
+        assert "skipping branch" in pipeline.log.call_args[0][0]
+
+    def test_release_plan_releases_after_last_consumer(self):
+        """Test that transient fields are released after the last stage reading them."""
+        pipeline = Pipeline([
+            ConsumingStage(),
+            ConsumingStage("raw_data"),
+            ConsumingStage("split_data", "raw_data"),
+            ConsumingStage("processed_data"),
+        ])
+
+        assert pipeline.release_plan() == [[], [], ["raw_data", "split_data"], []]
+
+    def test_release_plan_stops_at_undeclared_stage(self):
+        """Test that nothing is released before a stage that doesn't declare what it reads."""
+        pipeline = Pipeline([ConsumingStage("raw_data"), MagicMock(), ConsumingStage("split_data")])
+
+        assert pipeline.release_plan() == [[], [], ["split_data"]]
+
+    def test_run_releases_transient_fields(self, dto_with_split_data):
+        """Test that run drops transient fields once no later stage needs them."""
+        reader = ConsumingStage("split_data")
+        pipeline = Pipeline([ConsumingStage("raw_data"), reader, ConsumingStage("class_names")])
+
+        result = pipeline.run(dto_with_split_data)
+
+        assert reader.seen[0]["split_data"] is not None
+        assert result.raw_data is None
+        assert result.split_data is None
+        assert result.class_names is not None
+
+    def test_with_memory_report_logs_after_each_stage(self, dummy_dto):
+        """Test that with_memory_report logs the DTO size after every stage."""
+        pipeline = Pipeline([ConsumingStage(), ConsumingStage()], with_memory_report())
+        pipeline.log = MagicMock()
+
+        pipeline.run(dummy_dto)
+
+        assert pipeline.log.call_count == 2
+        assert "DTO after ConsumingStage" in pipeline.log.call_args[0][0]
+
+    def test_with_tracing_writes_stage_spans(self):
+        """Test that a traced run writes one Chrome trace with a span per stage inside the run span."""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            pipeline = Pipeline([AddStage(1), AddStage(2)], with_tracing(temp_dir))
+            pipeline.log = MagicMock()
+
+            assert pipeline.run(1) == 4
+
+            with open(pipeline.tracer.last_trace) as f:
+                events = [e for e in json.load(f)["traceEvents"] if e["ph"] == "X"]
+            assert [e["name"] for e in events if e["cat"] == "stage"] == ["AddStage", "AddStage"]
+            run = next(e for e in events if e["cat"] == "run")
+            assert all(run["ts"] <= e["ts"] and e["ts"] + e["dur"] <= run["ts"] + run["dur"] for e in events)
+
+    def test_with_tracing_skips_unsampled_runs(self):
+        """Test that a zero sample rate writes no trace."""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            pipeline = Pipeline([AddStage(1)], with_tracing(temp_dir, sample_rate=0.0))
+
+            pipeline.run(1)
+
+            assert os.listdir(temp_dir) == []
+
+    def test_with_resources_applies_data_threads_per_stage(self, dto_with_raw_data):
+        """Test that a stage sees its tf.data pool size on the DTO datasets."""
+        reader = ConsumingStage("raw_data")
+        pipeline = Pipeline([reader], with_resources(ResourceConfig(data_threads=2), reader))
+
+        pipeline.run(dto_with_raw_data)
+
+        assert reader.seen[0]["raw_data"].options().threading.private_threadpool_size == 2
+
+    def test_with_resources_applies_process_data_threads_to_extracted_data(self, dummy_dto):
+        """Test that process tf.data options reach datasets created by the extractor during the run."""
+        import tensorflow as tf
+
+        class ExtractStage(ConsumingStage):
+            def run(self, dto):
+                dto.raw_data = tf.data.Dataset.range(3)
+                return dto
+
+        reader = ConsumingStage("raw_data")
+        with tempfile.TemporaryDirectory() as temp_dir:
+            pipeline = Pipeline([ExtractStage(), reader],
+                                with_resources(ResourceConfig(data_threads=2), registry=ResourceRegistry(temp_dir)))
+            pipeline.run(dummy_dto)
+
+        assert reader.seen[0]["raw_data"].options().threading.private_threadpool_size == 2
+
+    def test_with_resources_registers_run(self, dummy_dto):
+        """Test that a run registers its planned threads and warns when the host is oversubscribed."""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            registry = ResourceRegistry(temp_dir)
+            registry.register(10_000, pid=os.getppid())
+            seen = []
+
+            class UsageStage(ConsumingStage):
+                def run(self, dto):
+                    seen.append(registry.usage())
+                    return dto
+
+            pipeline = Pipeline([UsageStage()], with_resources(ResourceConfig(intra_op_threads=1), registry=registry))
+            pipeline.log = MagicMock()
+            pipeline.run(dummy_dto)
+
+            assert seen[0][os.getpid()] == 1
+            assert os.getpid() not in registry.usage()
+            assert "CPU oversubscription" in pipeline.log.call_args[0][0]
+
+    def test_with_manifest_processes_only_changed_inputs(self, dummy_dto):
+        """Test that repeat runs only read new inputs, record the model hash, and skip when nothing changed."""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            for name in ("a.tif", "b.tif"):
+                with open(os.path.join(temp_dir, name), "w") as f:
+                    f.write(name)
+            extract = FileStage(temp_dir)
+            manifest = RunManifest(os.path.join(temp_dir, "manifest.json"))
+            pipeline = Pipeline([extract], with_manifest(manifest, extract))
+            pipeline.log = MagicMock()
+            dummy_dto.model_hash = "abc"
+
+            pipeline.run(dummy_dto)
+            with open(os.path.join(temp_dir, "c.tif"), "w") as f:
+                f.write("c")
+            pipeline.run(dummy_dto)
+            with pytest.raises(SkipPipelineError, match="unchanged"):
+                pipeline.run(dummy_dto)
+
+            assert [[os.path.basename(p) for p in paths] for paths in extract.read] == [["a.tif", "b.tif"], ["c.tif"]]
+            assert {entry["model_hash"] for entry in manifest.entries.values()} == {"abc"}
+
+    def test_with_manifest_keeps_failed_inputs(self, dummy_dto):
+        """Test that inputs of a failed run are not recorded, so the next run retries them."""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            with open(os.path.join(temp_dir, "a.tif"), "w") as f:
+                f.write("a")
+            extract = FileStage(temp_dir)
+            manifest = RunManifest(os.path.join(temp_dir, "manifest.json"))
+            pipeline = Pipeline([extract, FailingStage()], with_manifest(manifest, extract))
+            pipeline.log = MagicMock()
+
+            with pytest.raises(SkipPipelineError):
+                pipeline.run(-1)
+
+            assert manifest.entries == {}
+
+    def test_with_manifest_keeps_inputs_of_skipped_stages(self, dummy_dto):
+        """Test that inputs of a run with a skipped sink are not recorded, so the next run writes them."""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            with open(os.path.join(temp_dir, "a.tif"), "w") as f:
+                f.write("a")
+            extract = FileStage(temp_dir)
+            manifest = RunManifest(os.path.join(temp_dir, "manifest.json"))
+            pipeline = Pipeline([extract, SkippingStage()], with_manifest(manifest, extract))
+            pipeline.log = MagicMock()
+
+            pipeline.run(dummy_dto)
+            pipeline.run(dummy_dto)
+
+            assert manifest.entries == {}
+            assert len(extract.read) == 2
+            assert "not recording 1 inputs, skipped SkippingStage" in pipeline.log.call_args[0][0]
+
+    def test_with_manifest_rejects_extractor_without_inputs(self):
+        """Test that the extractor must expose its inputs."""
+        with pytest.raises(ValueError, match="does not expose its inputs"):
+            with_manifest(RunManifest("manifest.json"), AddStage(1))
+
+
+class TestPipelineStream:
+
+    def test_run_stream_preserves_order(self):
+        """Test that run_stream runs every chunk through every stage in order."""
+        pipeline = Pipeline([AddStage(1), AddStage(10)])
+
+        assert list(pipeline.run_stream(range(20))) == [i + 11 for i in range(20)]
+
+    def test_run_stream_uses_custom_run_stream(self):
+        """Test that stages overriding run_stream control the chunking."""
+        pipeline = Pipeline([SplitStage(), AddStage(1)])
+
+        assert list(pipeline.run_stream([1, 2])) == [2, 2, 3, 3]
+
+    def test_run_stream_handles_skip_stage_error(self):
+        """Test that a skipped stage passes the chunk through unchanged."""
+        stage1 = MagicMock()
+        stage1.run.side_effect = SkipStageError("Skip stage")
+
+        pipeline = Pipeline([stage1, AddStage(1)])
+        pipeline.log = MagicMock()
+
+        assert list(pipeline.run_stream([1, 2])) == [2, 3]
+        assert pipeline.log.call_count == 2
+
+    def test_run_stream_propagates_errors(self):
+        """Test that a failing stage aborts the stream and raises in the consumer."""
+        stage1 = MagicMock()
+        stage1.run.side_effect = SkipPipelineError("Skip pipeline")
+
+        pipeline = Pipeline([stage1])
+        pipeline.log = MagicMock()
+
+        with pytest.raises(SkipPipelineError, match="Skip pipeline"):
+            list(pipeline.run_stream([1, 2, 3]))
+
+    def test_run_stream_applies_backpressure(self):
+        """Test that the source is not consumed further ahead than the queues allow."""
+        produced = []
+
+        def source():
+            for i in range(1000):
+                produced.append(i)
+                yield i
+
+        pipeline = Pipeline([AddStage(0)], with_queue_depth(1))
+        stream = pipeline.run_stream(source())
+        next(stream)
+
+        # Give the workers time to fill every queue
+        threading.Event().wait(0.3)
+        assert len(produced) < 10
+        stream.close()
+
+    def test_run_stream_traces_stages_on_their_threads(self):
+        """Test that a traced stream records stage spans on each stage's worker thread."""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            pipeline = Pipeline([AddStage(1), AddStage(10)], with_tracing(temp_dir))
+            pipeline.log = MagicMock()
+
+            list(pipeline.run_stream(range(5)))
+
+            with open(pipeline.tracer.last_trace) as f:
+                events = json.load(f)["traceEvents"]
+            stage_threads = {e["tid"] for e in events if e.get("cat") == "stage"}
+            thread_names = {e["args"]["name"] for e in events if e["ph"] == "M"}
+            assert len(stage_threads) == 2
+            assert thread_names == {"pipeline-AddStage"}
+
+    def test_default_queue_depth(self):
+        """Test that pipelines default to the module queue depth."""
+        assert Pipeline([]).queue_depth == DEFAULT_QUEUE_DEPTH
+
+
+class TestPipelineMap:
+
+    def test_map_preserves_order(self):
+        """Test that map yields results in input order by default."""
+        pipeline = Pipeline([AddStage(1), AddStage(10)])
+        pipeline.log = MagicMock()
+
+        assert list(pipeline.map(range(20), workers=2)) == [i + 11 for i in range(20)]
+
+    def test_map_unordered_yields_every_result(self):
+        """Test that map can yield results as they complete."""
+        pipeline = Pipeline([AddStage(1)])
+        pipeline.log = MagicMock()
+
+        assert sorted(pipeline.map(range(20), workers=2, ordered=False)) == list(range(1, 21))
+
+    def test_map_reuses_stage_state_per_worker(self):
+        """Test that stages are sent to each worker once and reused across DTOs."""
+        pipeline = Pipeline([CountingStage()])
+        pipeline.log = MagicMock()
+
+        results = list(pipeline.map(range(20), workers=2))
+
+        assert len({pid for pid, _ in results}) <= 2
+        assert max(count for _, count in results) > 1
+
+    def test_map_records_stats(self):
+        """Test that map records and logs aggregate throughput."""
+        pipeline = Pipeline([AddStage(1)])
+        pipeline.log = MagicMock()
+
+        list(pipeline.map(range(5), workers=1))
+
+        assert isinstance(pipeline.map_stats, MapStats)
+        assert pipeline.map_stats.completed == 5
+        assert pipeline.map_stats.failed == 0
+        assert pipeline.map_stats.throughput > 0
+        pipeline.log.assert_called_once()
+
+    @pytest.mark.skipif(not hasattr(os, "sched_getaffinity"), reason="No CPU affinity API")
+    def test_map_sizes_worker_resources(self):
+        """Test that map workers pin to their CPU slice and size TensorFlow's pool before it starts."""
+        cpus = sorted(os.sched_getaffinity(0))
+        pipeline = Pipeline([ThreadingStage()], with_resources(ResourceConfig(cpus=cpus[:1]),
+                                                               registry=ResourceRegistry(tempfile.mkdtemp())))
+        pipeline.log = MagicMock()
+
+        assert list(pipeline.map([None], workers=1)) == [(cpus[:1], 1)]
+
+    def test_map_raises_first_failure(self):
+        """Test that a failing DTO aborts the map."""
+        pipeline = Pipeline([FailingStage()])
+        pipeline.log = MagicMock()
+
+        with pytest.raises(SkipPipelineError, match="negative"):
+            list(pipeline.map([1, -1, 2], workers=1))
+
+    def test_map_can_return_exceptions(self):
+        """Test that failures can be yielded in place of their results."""
+        pipeline = Pipeline([FailingStage()])
+        pipeline.log = MagicMock()
+
+        results = list(pipeline.map([1, -1, 2], workers=1, return_exceptions=True))
+
+        assert results[0] == 1
+        assert isinstance(results[1], SkipPipelineError)
+        assert results[2] == 2
+        assert pipeline.map_stats.failed == 1
@@ -0,0 +1,169 @@
+import threading
+import pytest
+from unittest.mock import MagicMock, patch
+
+from src.model import SkipStageError, StageTimeoutError, CircuitOpenError
+from src.pipeline.policy import RetryPolicy, CircuitBreaker, StagePolicy
+
+
+class TestRetryPolicy:
+
+    def test_delay_grows_exponentially_and_is_capped(self):
+        """Test that delays double per attempt up to max_delay without jitter."""
+        retry = RetryPolicy(base_delay=1.0, max_delay=5.0, jitter=False)
+        assert [retry.delay(a) for a in range(1, 5)] == [1.0, 2.0, 4.0, 5.0]
+
+    def test_delay_with_jitter_stays_in_bounds(self):
+        """Test that jittered delays never exceed the backoff delay."""
+        retry = RetryPolicy(base_delay=1.0, max_delay=5.0, jitter=True)
+        assert all(0 <= retry.delay(3) <= 4.0 for _ in range(100))
+
+    def test_invalid_attempts_raise(self):
+        """Test that fewer than one attempt is rejected."""
+        with pytest.raises(ValueError):
+            RetryPolicy(attempts=0)
+
+
+class TestCircuitBreaker:
+
+    def test_opens_after_threshold(self):
+        """Test that the circuit opens after consecutive failures."""
+        breaker = CircuitBreaker(failure_threshold=2, reset_after=60)
+        breaker.record_failure()
+        assert breaker.allow()
+        breaker.record_failure()
+        assert not breaker.allow()
+
+    def test_success_resets_failures(self):
+        """Test that a success closes the circuit and resets the count."""
+        breaker = CircuitBreaker(failure_threshold=2, reset_after=60)
+        breaker.record_failure()
+        breaker.record_success()
+        breaker.record_failure()
+        assert breaker.allow()
+
+    def test_half_open_after_reset(self):
+        """Test that a single trial call is allowed after reset_after."""
+        breaker = CircuitBreaker(failure_threshold=1, reset_after=0)
+        breaker.record_failure()
+        assert breaker.allow()
+
+
+class TestStagePolicy:
+
+    @patch("src.pipeline.policy.time.sleep")
+    def test_retries_transient_errors(self, mock_sleep):
+        """Test that a failing stage is retried until it succeeds."""
+        stage = MagicMock()
+        stage.run.side_effect = [IOError("flaky"), IOError("flaky"), "done"]
+        log = MagicMock()
+
+        policy = StagePolicy(retry=RetryPolicy(attempts=3, jitter=False))
+
+        assert policy.call(stage, MagicMock(), log) == "done"
+        assert stage.run.call_count == 3
+        assert mock_sleep.call_count == 2
+        assert log.call_count == 2
+
+    @patch("src.pipeline.policy.time.sleep")
+    def test_raises_after_last_attempt(self, mock_sleep):
+        """Test that the last error is raised once attempts are exhausted."""
+        stage = MagicMock()
+        stage.run.side_effect = IOError("down")
+
+        policy = StagePolicy(retry=RetryPolicy(attempts=2))
+
+        with pytest.raises(IOError, match="down"):
+            policy.call(stage, MagicMock(), MagicMock())
+        assert stage.run.call_count == 2
+
+    def test_does_not_retry_unlisted_errors(self):
+        """Test that errors outside retry_on fail immediately."""
+        stage = MagicMock()
+        stage.run.side_effect = ValueError("bug")
+
+        policy = StagePolicy(retry=RetryPolicy(attempts=3, retry_on=(IOError,)))
+
+        with pytest.raises(ValueError):
+            policy.call(stage, MagicMock(), MagicMock())
+        stage.run.assert_called_once()
+
+    def test_does_not_retry_skip_errors(self):
+        """Test that skip errors are passed through untouched."""
+        stage = MagicMock()
+        stage.run.side_effect = SkipStageError("skip")
+
+        policy = StagePolicy(retry=RetryPolicy(attempts=3))
+
+        with pytest.raises(SkipStageError):
+            policy.call(stage, MagicMock(), MagicMock())
+        stage.run.assert_called_once()
+
+    def test_timeout_raises(self):
+        """Test that a hung stage raises StageTimeoutError."""
+        release = threading.Event()
+        stage = MagicMock()
+        stage.run.side_effect = lambda dto: release.wait(5)
+
+        policy = StagePolicy(timeout=0.05)
+
+        with pytest.raises(StageTimeoutError):
+            policy.call(stage, MagicMock(), MagicMock())
+        release.set()
+
+    def test_timeout_is_not_retried(self):
+        """Test that a timed-out stage is not run again while its first attempt is still running."""
+        release = threading.Event()
+        stage = MagicMock()
+        stage.run.side_effect = lambda dto: release.wait(5)
+
+        policy = StagePolicy(retry=RetryPolicy(attempts=3, base_delay=0), timeout=0.05)
+
+        with pytest.raises(StageTimeoutError):
+            policy.call(stage, MagicMock(), MagicMock())
+        stage.run.assert_called_once()
+        release.set()
+
+    def test_timed_out_stage_runs_on_copy(self, dummy_dto):
+        """Test that fields a timed-out stage sets afterwards don't reach the caller's DTO."""
+        release, done = threading.Event(), threading.Event()
+
+        def run(dto):
+            release.wait(5)
+            dto.class_names = ["late"]
+            done.set()
+            return dto
+
+        stage = MagicMock()
+        stage.run.side_effect = run
+        dummy_dto.class_names = ["forest"]
+
+        with pytest.raises(StageTimeoutError):
+            StagePolicy(timeout=0.05).call(stage, dummy_dto, MagicMock())
+        release.set()
+        done.wait(5)
+
+        assert dummy_dto.class_names == ["forest"]
+
+    def test_timeout_returns_result_in_time(self):
+        """Test that a stage finishing within the timeout returns its DTO."""
+        stage = MagicMock()
+        stage.run.side_effect = lambda dto: dto
+        dto = MagicMock()
+
+        assert StagePolicy(timeout=5).call(stage, dto, MagicMock()) is dto
+
+    def test_open_circuit_skips_stage(self):
+        """Test that an open circuit raises CircuitOpenError without calling the stage."""
+        stage = MagicMock()
+        stage.run.side_effect = IOError("down")
+
+        policy = StagePolicy(breaker=CircuitBreaker(failure_threshold=1, reset_after=60))
+
+        with pytest.raises(IOError):
+            policy.call(stage, MagicMock(), MagicMock())
+        with pytest.raises(CircuitOpenError):
+            policy.call(stage, MagicMock(), MagicMock())
+
+        stage.run.assert_called_once()
+        assert issubclass(CircuitOpenError, SkipStageError)
@@ -0,0 +1,99 @@
+import os
+import tempfile
+from unittest.mock import patch
+
+import pytest
+import tensorflow as tf
+
+from src.model import SplitEnum
+from src.pipeline.resources import ResourceConfig, ResourceRegistry, apply_dataset_options, available_cpus, pinned
+
+
+@pytest.fixture
+def registry():
+    """Registry in a temporary directory."""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        yield ResourceRegistry(temp_dir)
+
+
+class TestResourceConfig:
+
+    def test_invalid_threads_raise(self):
+        """Test that thread counts below one are rejected."""
+        with pytest.raises(ValueError):
+            ResourceConfig(intra_op_threads=0)
+        with pytest.raises(ValueError):
+            ResourceConfig(cpus=[])
+
+    def test_planned_threads(self):
+        """Test that planned threads count the intra-op pool, per core by default, and the tf.data pool."""
+        assert ResourceConfig(intra_op_threads=4, inter_op_threads=2, data_threads=2).planned_threads() == 6
+        assert ResourceConfig(cpus=[0, 1, 2]).planned_threads() == 3
+
+    def test_dataset_options(self):
+        """Test that tf.data options are only built when data threads are configured."""
+        assert ResourceConfig(intra_op_threads=2).dataset_options() is None
+
+        options = ResourceConfig(data_threads=3, data_intra_op_threads=1).dataset_options()
+        assert options.threading.private_threadpool_size == 3
+        assert options.threading.max_intra_op_parallelism == 1
+
+    def test_for_worker_splits_cpus(self):
+        """Test that workers get disjoint CPU slices and pools sized to them."""
+        config = ResourceConfig(cpus=range(8))
+        shares = [config.for_worker(i, 3) for i in range(3)]
+
+        assert sorted(cpu for share in shares for cpu in share.cpus) == list(range(8))
+        assert [share.intra_op_threads for share in shares] == [3, 3, 2]
+        assert sum(share.planned_threads() for share in shares) == 8
+
+
+class TestAffinity:
+
+    @pytest.mark.skipif(not hasattr(os, "sched_setaffinity"), reason="No CPU affinity API")
+    def test_pinned_restores_affinity(self):
+        """Test that pinning applies inside the block and is undone after it."""
+        before = available_cpus()
+        with pinned(before[:1]):
+            assert available_cpus() == before[:1]
+        assert available_cpus() == before
+
+    def test_apply_dataset_options(self, dto_with_split_data):
+        """Test that options reach the raw and split datasets of the DTO."""
+        options = ResourceConfig(data_threads=2).dataset_options()
+
+        apply_dataset_options(dto_with_split_data, options)
+
+        assert dto_with_split_data.raw_data.options().threading.private_threadpool_size == 2
+        train = dto_with_split_data.split_data[SplitEnum.TRAIN.value]
+        assert train.options().threading.private_threadpool_size == 2
+
+    def test_apply_dataset_options_twice_keeps_dataset(self, dto_with_split_data):
+        """Test that datasets already carrying the options are left as they are."""
+        options = ResourceConfig(data_threads=2).dataset_options()
+        apply_dataset_options(dto_with_split_data, options)
+        raw_data = dto_with_split_data.raw_data
+
+        apply_dataset_options(dto_with_split_data, options)
+
+        assert dto_with_split_data.raw_data is raw_data
+
+
+class TestResourceRegistry:
+
+    def test_usage_of_live_processes(self, registry):
+        """Test that registered live processes are reported and dead ones are removed."""
+        registry.register(4)
+        with patch("src.pipeline.resources._process_alive", side_effect=lambda pid: pid == os.getpid()):
+            registry.register(8, pid=999999)
+            assert registry.usage() == {os.getpid(): 4}
+        assert not os.path.exists(registry.path(999999))
+
+    def test_oversubscription(self, registry):
+        """Test that a warning is produced once the planned threads exceed the CPUs."""
+        registry.register(3)
+        assert registry.oversubscription(cpus=4) is None
+        assert "plan 3 busy threads on 2 CPUs" in registry.oversubscription(cpus=2)
+
+        registry.unregister()
+        assert registry.usage() == {}
@@ -19,4 +19,15 @@ class TestStage:
     def test_run_is_abstract_method(self):
         """Test that run is an abstract method."""
         with pytest.raises(TypeError):
-            Stage().run(DTO(uuid=None))
\ No newline at end of file
+            Stage().run(DTO(uuid=None))
+
+    def test_run_stream_defaults_to_run_per_chunk(self):
+        """Test that the default run_stream calls run for every chunk."""
+        class Double(Stage):
+            def accept(self, dto):
+                return None
+
+            def run(self, dto):
+                return dto * 2
+
+        assert list(Double().run_stream(iter([1, 2, 3]))) == [2, 4, 6]
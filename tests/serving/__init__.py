@@ -0,0 +1 @@
+# This file marks the serving tests directory as a Python package
@@ -0,0 +1,107 @@
+import threading
+import pytest
+import numpy as np
+
+from src.serving.batcher import InvalidInputError, MicroBatcher
+from src.serving.metrics import ServingMetrics
+
+
+class TestMicroBatcher:
+
+    def test_predict_returns_outputs_for_own_inputs(self):
+        """Test that each request gets the outputs for its own rows."""
+        batcher = MicroBatcher(lambda x: x * 2, max_batch_size=8, max_wait_ms=1)
+
+        result = batcher.predict(np.array([[1.0], [2.0]]))
+        batcher.close()
+
+        np.testing.assert_array_equal(result, [[2.0], [4.0]])
+
+    def test_concurrent_requests_are_coalesced(self):
+        """Test that concurrent requests share model calls."""
+        calls = []
+        gate = threading.Event()
+
+        def predict(x):
+            gate.wait(5)
+            calls.append(len(x))
+            return x + 1
+
+        batcher = MicroBatcher(predict, max_batch_size=4, max_wait_ms=200)
+        futures = [batcher.submit(np.array([[float(i)]])) for i in range(8)]
+        gate.set()
+        results = [f.result(5) for f in futures]
+        batcher.close()
+
+        assert [r[0][0] for r in results] == [float(i + 1) for i in range(8)]
+        assert sum(calls) == 8
+        assert max(calls) <= 4
+        assert len(calls) < 8
+
+    def test_max_wait_flushes_partial_batch(self):
+        """Test that a lone request is served once max_wait_ms has passed."""
+        batcher = MicroBatcher(lambda x: x, max_batch_size=100, max_wait_ms=1)
+
+        assert batcher.submit(np.zeros((1, 2))).result(5).shape == (1, 2)
+        batcher.close()
+
+    def test_errors_fail_every_request_in_batch(self):
+        """Test that a failing model call fails the requests of that batch."""
+        def predict(x):
+            raise RuntimeError("model down")
+
+        metrics = ServingMetrics()
+        batcher = MicroBatcher(predict, max_batch_size=4, max_wait_ms=1, metrics=metrics)
+
+        with pytest.raises(RuntimeError, match="model down"):
+            batcher.predict(np.zeros((1, 1)), timeout=5)
+        batcher.close()
+
+        assert metrics.errors == 1
+
+    def test_metrics_are_recorded(self):
+        """Test that batches and request latencies are recorded."""
+        metrics = ServingMetrics()
+        batcher = MicroBatcher(lambda x: x, max_batch_size=4, max_wait_ms=1, metrics=metrics)
+
+        for _ in range(3):
+            batcher.predict(np.zeros((2, 1)), timeout=5)
+        batcher.close()
+
+        snapshot = metrics.snapshot()
+        assert snapshot["requests"] == 3
+        assert snapshot["rows"] == 6
+        assert snapshot["batches"] >= 1
+        assert snapshot["p99_ms"] >= snapshot["p50_ms"] > 0
+
+    def test_submit_rejects_wrong_shape(self):
+        """Test that inputs that don't match the input shape are rejected before they reach a batch."""
+        batcher = MicroBatcher(lambda x: x, max_batch_size=4, max_wait_ms=1, input_shape=(None, 3))
+
+        with pytest.raises(InvalidInputError, match="shape"):
+            batcher.submit(np.zeros((1, 2, 4)))
+        assert batcher.predict(np.zeros((1, 5, 3)), timeout=5).shape == (1, 5, 3)
+        batcher.close()
+
+    def test_mismatched_requests_run_separately(self):
+        """Test that requests of different shapes in one batch don't fail each other."""
+        gate = threading.Event()
+
+        def predict(x):
+            gate.wait(5)
+            return x.sum(axis=1, keepdims=True)
+
+        batcher = MicroBatcher(predict, max_batch_size=8, max_wait_ms=200)
+        futures = [batcher.submit(np.ones((1, 2))), batcher.submit(np.ones((1, 3)))]
+        gate.set()
+
+        assert [f.result(5)[0][0] for f in futures] == [2.0, 3.0]
+        batcher.close()
+
+    def test_submit_after_close_raises(self):
+        """Test that a closed batcher rejects new requests instead of leaving them unanswered."""
+        batcher = MicroBatcher(lambda x: x, max_wait_ms=1)
+        batcher.close()
+
+        with pytest.raises(RuntimeError, match="closed"):
+            batcher.submit(np.zeros((1, 1)))
@@ -0,0 +1,143 @@
+import http.client
+import json
+import threading
+from unittest.mock import MagicMock
+
+import numpy as np
+import pytest
+
+from src.serving.server import PredictionService, ModelNotFoundError, make_server
+
+
+@pytest.fixture
+def mock_cache():
+    """Model cache with one model that returns fixed probabilities."""
+    model = MagicMock()
+    model.predict_on_batch.side_effect = lambda x: np.tile([0.1, 0.9], (len(x), 1))
+
+    cache = MagicMock()
+    cache.get_model.side_effect = lambda model_hash: model if model_hash == "abc123" else None
+    return cache
+
+
+@pytest.fixture
+def server(mock_cache):
+    """Running prediction server on a free port."""
+    service = PredictionService(mock_cache, max_batch_size=8, max_wait_ms=1)
+    server = make_server(service, port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    service.close()
+
+
+def request(server, method, path, body=None):
+    conn = http.client.HTTPConnection("127.0.0.1", server.server_address[1])
+    conn.request(method, path, body=json.dumps(body) if body is not None else None)
+    response = conn.getresponse()
+    payload = json.loads(response.read())
+    conn.close()
+    return response.status, payload
+
+
+class TestPredictionService:
+
+    def test_unknown_model_raises(self, mock_cache):
+        """Test that unknown hashes raise ModelNotFoundError."""
+        service = PredictionService(mock_cache)
+        with pytest.raises(ModelNotFoundError):
+            service.predict("missing", np.zeros((1, 2)))
+
+    def test_model_is_loaded_once(self, mock_cache):
+        """Test that a model is loaded from the cache once and reused."""
+        service = PredictionService(mock_cache, max_wait_ms=1)
+        service.predict("abc123", np.zeros((1, 2)))
+        service.predict("abc123", np.zeros((1, 2)))
+        service.close()
+
+        mock_cache.get_model.assert_called_once_with("abc123")
+
+    def test_loading_does_not_block_other_models(self, mock_cache):
+        """Test that a slow model load holds up neither other models nor concurrent requests for the same model."""
+        loading, release = threading.Event(), threading.Event()
+        slow_model = MagicMock()
+        slow_model.predict_on_batch.side_effect = lambda x: np.zeros((len(x), 2))
+        fast_model = mock_cache.get_model("abc123")
+
+        def get_model(model_hash):
+            if model_hash == "slow":
+                loading.set()
+                release.wait(5)
+                return slow_model
+            return fast_model
+
+        mock_cache.get_model.side_effect = get_model
+        service = PredictionService(mock_cache, max_wait_ms=1)
+        results = []
+        slow = [threading.Thread(target=lambda: results.append(service.predict("slow", np.zeros((1, 2)))))
+                for _ in range(2)]
+        for thread in slow:
+            thread.start()
+        loading.wait(5)
+
+        assert service.predict("abc123", np.zeros((1, 2))).shape == (1, 2)
+        release.set()
+        for thread in slow:
+            thread.join(5)
+        service.close()
+
+        assert len(results) == 2
+        assert [call.args[0] for call in mock_cache.get_model.call_args_list].count("slow") == 1
+
+
+class TestPredictionServer:
+
+    def test_predict_single_instance(self, server):
+        """Test that a single tile is classified."""
+        status, payload = request(server, "POST", "/models/abc123/predict", {"instance": [[1, 2], [3, 4]]})
+
+        assert status == 200
+        assert payload["classes"] == [1]
+        assert payload["predictions"] == [pytest.approx([0.1, 0.9])]
+
+    def test_predict_batch(self, server):
+        """Test that a small batch returns one prediction per instance."""
+        status, payload = request(server, "POST", "/models/abc123/predict", {"instances": [[1], [2], [3]]})
+
+        assert status == 200
+        assert payload["classes"] == [1, 1, 1]
+
+    def test_predict_unknown_model(self, server):
+        """Test that unknown models return 404."""
+        status, _ = request(server, "POST", "/models/def456/predict", {"instances": [[1]]})
+        assert status == 404
+
+    def test_predict_invalid_body(self, server):
+        """Test that malformed requests return 400."""
+        status, _ = request(server, "POST", "/models/abc123/predict", {"wrong": 1})
+        assert status == 400
+
+    def test_predict_wrong_shape(self, mock_cache):
+        """Test that instances that don't fit the model's input shape are rejected with 400."""
+        mock_cache.get_model("abc123").input_shape = (None, 2)
+        service = PredictionService(mock_cache, max_batch_size=8, max_wait_ms=1)
+        server = make_server(service, port=0)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        status, payload = request(server, "POST", "/models/abc123/predict", {"instance": [1.0, 2.0, 3.0]})
+        server.shutdown()
+        service.close()
+
+        assert status == 400
+        assert "shape" in payload["error"]
+
+    def test_metrics_and_health(self, server):
+        """Test that metrics and health endpoints respond."""
+        request(server, "POST", "/models/abc123/predict", {"instances": [[1]]})
+
+        status, metrics = request(server, "GET", "/metrics")
+        assert status == 200
+        assert metrics["requests"] == 1
+        assert "p99_ms" in metrics
+
+        assert request(server, "GET", "/health") == (200, {"status": "ok"})
@@ -0,0 +1,36 @@
+import uuid
+import pytest
+import numpy as np
+
+from src.model import DTO
+
+
+class TestDTO:
+
+    def test_dto_uses_slots(self, dummy_dto):
+        """Test that undeclared attributes can't be set on the DTO."""
+        with pytest.raises(AttributeError):
+            dummy_dto.unknown_field = 1
+
+    def test_transient_fields_are_declared(self):
+        """Test that every transient field is a DTO slot."""
+        assert set(DTO.TRANSIENT_FIELDS) <= set(DTO.__slots__)
+
+    def test_release_drops_references(self, dto_with_split_data):
+        """Test that release resets the given fields to None."""
+        dto_with_split_data.release("raw_data", "split_data")
+
+        assert dto_with_split_data.raw_data is None
+        assert dto_with_split_data.split_data is None
+        assert dto_with_split_data.class_names is not None
+
+    def test_memory_report_covers_every_field(self):
+        """Test that the memory report lists every field and measures arrays."""
+        dto = DTO(uuid=uuid.uuid4())
+        dto.processed_data = np.zeros(1024, dtype=np.float32)
+
+        report = dto.memory_report()
+
+        assert set(report) == set(DTO.__slots__)
+        assert report["processed_data"] == 4096
+        assert report["keras_model"] == 0
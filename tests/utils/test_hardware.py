@@ -0,0 +1,26 @@
+import os
+import tempfile
+
+from src.utils.hardware import cpu_flags, supports_bfloat16
+
+
+class TestHardware:
+
+    def test_cpu_flags_reads_first_cpu(self):
+        """Test that flags are read from an x86 style cpuinfo file."""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, "cpuinfo")
+            with open(path, "w") as f:
+                f.write("processor\t: 0\nflags\t\t: fpu AVX512_BF16 sse\n\nprocessor\t: 1\nflags\t\t: fpu\n")
+
+            assert cpu_flags(path) == frozenset({"fpu", "avx512_bf16", "sse"})
+
+    def test_cpu_flags_missing_file(self):
+        """Test that an unreadable cpuinfo yields no flags."""
+        assert cpu_flags("/nonexistent/cpuinfo") == frozenset()
+
+    def test_supports_bfloat16(self):
+        """Test that bfloat16 support needs one of the native bfloat16 instruction sets."""
+        assert supports_bfloat16(frozenset({"avx512f", "amx_bf16"}))
+        assert supports_bfloat16(frozenset({"asimd", "bf16"}))
+        assert not supports_bfloat16(frozenset({"avx2", "avx512f"}))
@@ -0,0 +1,42 @@
+import numpy as np
+import tensorflow as tf
+
+from src.utils.memory import estimate_size, format_size, format_memory_report
+
+
+class TestEstimateSize:
+
+    def test_none_is_empty(self):
+        """Test that None takes no memory."""
+        assert estimate_size(None) == 0
+
+    def test_numpy_array_uses_nbytes(self):
+        """Test that NumPy arrays report their buffer size."""
+        assert estimate_size(np.zeros((10, 10), dtype=np.float64)) == 800
+
+    def test_tensor_uses_element_count(self):
+        """Test that tensors report elements times dtype size."""
+        assert estimate_size(tf.zeros((4, 4), dtype=tf.float32)) == 64
+
+    def test_containers_are_summed_once(self):
+        """Test that shared objects in containers are only counted once."""
+        array = np.zeros(1000, dtype=np.uint8)
+        assert estimate_size({"a": array, "b": array}) < 2000
+
+    def test_keras_model_counts_weights(self):
+        """Test that Keras models report the size of their weights."""
+        model = tf.keras.Sequential([tf.keras.Input(shape=(4,)), tf.keras.layers.Dense(2)])
+        assert estimate_size(model) == (4 * 2 + 2) * 4
+
+
+class TestFormatting:
+
+    def test_format_size(self):
+        """Test that sizes get a binary unit."""
+        assert format_size(512) == "512 B"
+        assert format_size(1536) == "1.5 KB"
+        assert format_size(3 * 1024 * 1024) == "3.0 MB"
+
+    def test_format_memory_report_sorts_by_size(self):
+        """Test that the largest fields come first."""
+        assert format_memory_report({"a": 1, "b": 2048}) == "b=2.0 KB, a=1 B"
@@ -152,4 +152,112 @@ class TestModelCache:
         cache.clear_cache()
         
         # Verify metadata is empty
-        assert len(cache.metadata) == 0
\ No newline at end of file
+        assert len(cache.metadata) == 0
+
+class TestModelCacheDedupe:
+
+    def test_invalid_compression_raises(self, temp_cache_dir):
+        """Test that an unknown compression codec is rejected."""
+        with pytest.raises(ValueError, match="Unsupported compression"):
+            ModelCache(temp_cache_dir, dedupe=True, compression="lz4")
+
+    def test_save_and_get_chunked_model(self, temp_cache_dir, simple_model, model_config, layers_config,
+                                        dataset_info):
+        """Test that a chunked model is reassembled with identical weights."""
+        cache = ModelCache(temp_cache_dir, dedupe=True, chunk_size=64)
+
+        model_hash = cache.save_model(simple_model, layers_config, model_config, dataset_info)
+        assert cache.metadata[model_hash]["storage"] == "chunked"
+
+        loaded_model = cache.get_model(model_hash)
+        assert loaded_model is not None
+        for expected, actual in zip(simple_model.get_weights(), loaded_model.get_weights()):
+            assert (expected == actual).all()
+
+    def test_shared_weights_are_stored_once(self, temp_cache_dir, simple_model, model_config, layers_config,
+                                            dataset_info):
+        """Test that entries with identical weights do not add chunks to the store."""
+        cache = ModelCache(temp_cache_dir, dedupe=True)
+
+        cache.save_model(simple_model, layers_config, model_config, dataset_info)
+        chunks_after_first = cache.get_storage_stats()["chunks"]
+
+        modified_config = model_config.copy()
+        modified_config["epochs"] = 10
+        cache.save_model(simple_model, layers_config, modified_config, dataset_info)
+        stats = cache.get_storage_stats()
+
+        assert stats["entries"] == 2
+        assert stats["chunks"] == chunks_after_first
+
+    def test_zstd_compression_round_trip(self, temp_cache_dir, simple_model, model_config, layers_config,
+                                         dataset_info):
+        """Test that zstd-compressed chunks are decompressed on load."""
+        pytest.importorskip("zstandard")
+        cache = ModelCache(temp_cache_dir, dedupe=True, compression="zstd")
+
+        model_hash = cache.save_model(simple_model, layers_config, model_config, dataset_info)
+        loaded_model = cache.get_model(model_hash)
+
+        assert loaded_model is not None
+        for expected, actual in zip(simple_model.get_weights(), loaded_model.get_weights()):
+            assert (expected == actual).all()
+
+    def test_prune_chunks_removes_unreferenced(self, temp_cache_dir, simple_model, model_config, layers_config,
+                                               dataset_info):
+        """Test that chunks are pruned once no entry references them."""
+        cache = ModelCache(temp_cache_dir, dedupe=True)
+        model_hash = cache.save_model(simple_model, layers_config, model_config, dataset_info)
+
+        assert cache.prune_chunks() == 0
+
+        tf.io.gfile.rmtree(cache.get_model_path(model_hash))
+        del cache.metadata[model_hash]
+
+        assert cache.prune_chunks() > 0
+        assert cache.get_storage_stats()["chunks"] == 0
+
+
+class TestModelCacheNearest:
+
+    def test_find_nearest_with_fewer_epochs(self, temp_cache_dir, simple_model, model_config, layers_config,
+                                            dataset_info):
+        """Test that an entry with the same layers and fewer epochs can be trained further."""
+        cache = ModelCache(temp_cache_dir, dedupe=True)
+        model_hash = cache.save_model(simple_model, layers_config, model_config, dataset_info)
+
+        nearest = cache.find_nearest(layers_config, {**model_config, "epochs": 8}, dataset_info)
+
+        assert nearest == {"hash": model_hash, "shared_layers": 2, "epochs": 5}
+
+    def test_find_nearest_with_different_head(self, temp_cache_dir, simple_model, model_config, layers_config,
+                                              dataset_info):
+        """Test that an entry sharing the leading layers is found, ignoring auto-generated layer names."""
+        cache = ModelCache(temp_cache_dir, dedupe=True)
+        model_hash = cache.save_model(simple_model, layers_config, model_config, dataset_info)
+        new_layers = [{"class_name": "Dense", "config": {"units": 5, "activation": "relu", "name": "dense_7"}},
+                      {"class_name": "Dense", "config": {"units": 3, "activation": "softmax"}}]
+
+        nearest = cache.find_nearest(new_layers, model_config, {"class_count": 3, "input_shape": [10]})
+
+        assert nearest == {"hash": model_hash, "shared_layers": 1, "epochs": 0}
+
+    def test_find_nearest_requires_same_input_shape(self, temp_cache_dir, simple_model, model_config, layers_config,
+                                                    dataset_info):
+        """Test that entries trained on another input shape or without shared layers are not used."""
+        cache = ModelCache(temp_cache_dir, dedupe=True)
+        cache.save_model(simple_model, layers_config, model_config, dataset_info)
+
+        assert cache.find_nearest(layers_config, model_config, {"class_count": 2, "input_shape": [12]}) is None
+        assert cache.find_nearest([{"class_name": "Flatten", "config": {}}], model_config, dataset_info) is None
+
+    def test_find_nearest_ignores_warm_start_options(self, temp_cache_dir, simple_model, model_config, layers_config,
+                                                     dataset_info):
+        """Test that an entry saved with warm-start options can still be trained further."""
+        cache = ModelCache(temp_cache_dir, dedupe=True)
+        model_hash = cache.save_model(simple_model, layers_config, {**model_config, "warm_start": True},
+                                      dataset_info)
+
+        nearest = cache.find_nearest(layers_config, {**model_config, "epochs": 10}, dataset_info)
+
+        assert nearest == {"hash": model_hash, "shared_layers": 2, "epochs": 5}
@@ -0,0 +1,101 @@
+import struct
+
+import numpy as np
+
+from src.utils.mvt import encode_point_layer
+
+
+def read_varint(buf, pos):
+    result = shift = 0
+    while True:
+        byte = buf[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return result, pos
+        shift += 7
+
+
+def read_message(buf):
+    """Decode a protobuf message into {field: [values]}, length-delimited values as bytes."""
+    fields, pos = {}, 0
+    while pos < len(buf):
+        key, pos = read_varint(buf, pos)
+        number, wire_type = key >> 3, key & 7
+        if wire_type == 0:
+            value, pos = read_varint(buf, pos)
+        elif wire_type == 1:
+            value, pos = struct.unpack("<d", buf[pos:pos + 8])[0], pos + 8
+        else:
+            length, pos = read_varint(buf, pos)
+            value, pos = buf[pos:pos + length], pos + length
+        fields.setdefault(number, []).append(value)
+    return fields
+
+
+def read_packed(buf):
+    values, pos = [], 0
+    while pos < len(buf):
+        value, pos = read_varint(buf, pos)
+        values.append(value)
+    return values
+
+
+def unzigzag(value):
+    return (value >> 1) ^ -(value & 1)
+
+
+def decode_point_tile(tile):
+    """Decode a single-layer point tile into (layer name, extent, [(x, y, properties)])."""
+    layer = read_message(read_message(tile)[3][0])
+    keys = [k.decode() for k in layer.get(3, [])]
+    values = []
+    for raw in layer.get(4, []):
+        value = read_message(raw)
+        if 1 in value:
+            values.append(value[1][0].decode())
+        elif 3 in value:
+            values.append(value[3][0])
+        elif 6 in value:
+            values.append(unzigzag(value[6][0]))
+        else:
+            values.append(bool(value[7][0]))
+
+    features = []
+    for raw in layer.get(2, []):
+        feature = read_message(raw)
+        tags = read_packed(feature[2][0])
+        command, x, y = read_packed(feature[4][0])
+        assert command == 9 and feature[3] == [1]
+        properties = {keys[tags[i]]: values[tags[i + 1]] for i in range(0, len(tags), 2)}
+        features.append((unzigzag(x), unzigzag(y), properties))
+
+    return layer[1][0].decode(), layer[5][0], features
+
+
+class TestEncodePointLayer:
+
+    def test_round_trip(self):
+        """Test that points and properties decode back to their input."""
+        tile = encode_point_layer(
+            "predictions",
+            np.array([[0, 0], [4095, 10]]),
+            {"label": ["forest", "sea"], "count": [3, 1], "probability": [0.5, 0.25]},
+        )
+
+        name, extent, features = decode_point_tile(tile)
+
+        assert name == "predictions"
+        assert extent == 4096
+        assert features == [
+            (0, 0, {"label": "forest", "count": 3, "probability": 0.5}),
+            (4095, 10, {"label": "sea", "count": 1, "probability": 0.25}),
+        ]
+
+    def test_values_are_deduplicated(self):
+        """Test that repeated property values are stored once."""
+        tile = encode_point_layer("l", np.zeros((100, 2)), {"label": ["forest"] * 100})
+        layer = read_message(read_message(tile)[3][0])
+
+        assert len(layer[4]) == 1
+        assert len(layer[2]) == 100
@@ -0,0 +1,126 @@
+import asyncio
+import contextvars
+import json
+import os
+import tempfile
+import threading
+
+import numpy as np
+import pytest
+import tensorflow as tf
+
+from src.utils import tracing
+from src.utils.tracing import Tracer
+
+
+@pytest.fixture
+def trace_dir():
+    """Temporary trace directory."""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        yield temp_dir
+
+
+def read_spans(path):
+    with open(path) as f:
+        return [e for e in json.load(f)["traceEvents"] if e["ph"] == "X"]
+
+
+class TestTracer:
+
+    def test_invalid_sample_rate(self, trace_dir):
+        """Test that sample rates outside [0, 1] are rejected."""
+        with pytest.raises(ValueError):
+            Tracer(trace_dir, sample_rate=1.5)
+
+    def test_records_spans_across_threads(self, trace_dir):
+        """Test that spans from threads running in the run's context land in one trace with their thread names."""
+        tracer = Tracer(trace_dir)
+        tracer.start()
+
+        def work():
+            with tracer.span("worker"):
+                pass
+
+        thread = threading.Thread(target=contextvars.copy_context().run, args=(work,), name="sink-thread")
+        thread.start()
+        thread.join()
+        with tracer.span("main", answer=42):
+            pass
+        path = tracer.stop("run")
+
+        spans = read_spans(path)
+        assert {s["name"] for s in spans} == {"worker", "main"}
+        assert next(s for s in spans if s["name"] == "main")["args"] == {"answer": 42}
+        with open(path) as f:
+            names = {e["args"]["name"] for e in json.load(f)["traceEvents"] if e["ph"] == "M"}
+        assert "sink-thread" in names
+
+    def test_nested_runs_write_once(self, trace_dir):
+        """Test that a nested run joins the outer one and only the outer stop writes the trace."""
+        tracer = Tracer(trace_dir)
+        tracer.start()
+        tracer.start()
+
+        assert tracer.stop("inner") is None
+        assert tracer.stop("outer") == os.path.join(trace_dir, "trace-outer.json")
+
+    def test_min_span_drops_short_spans(self, trace_dir):
+        """Test that spans shorter than min_span_ms are not recorded."""
+        tracer = Tracer(trace_dir, min_span_ms=1000.0)
+        tracer.start()
+        with tracer.span("short"):
+            pass
+
+        assert read_spans(tracer.stop("run")) == []
+
+    def test_module_span_is_noop_without_recording(self, trace_dir):
+        """Test that module-level spans only record inside a traced run."""
+        assert tracing.active_trace() is None
+        with tracing.span("ignored"):
+            pass
+
+        tracer = Tracer(trace_dir)
+        tracer.start()
+        with tracing.span("sink_write", rows=3):
+            pass
+        spans = read_spans(tracer.stop("run"))
+
+        assert [(s["name"], s["cat"]) for s in spans] == [("sink_write", tracing.CATEGORY_IO)]
+        assert tracing.active_trace() is None
+
+    def test_concurrent_runs_get_their_own_trace(self, trace_dir):
+        """Test that runs in concurrent asyncio tasks sharing one tracer write separate traces."""
+        tracer = Tracer(trace_dir)
+
+        async def run(name, delay):
+            tracer.start()
+            with tracing.span(f"span-{name}"):
+                await asyncio.sleep(delay)
+            return tracer.stop(name)
+
+        async def run_both():
+            return await asyncio.gather(run("a", 0.05), run("b", 0.01))
+
+        path_a, path_b = asyncio.run(run_both())
+
+        assert [s["name"] for s in read_spans(path_a)] == ["span-a"]
+        assert [s["name"] for s in read_spans(path_b)] == ["span-b"]
+
+
+class TestTraceCallback:
+
+    def test_records_epochs_and_batches(self, trace_dir):
+        """Test that training records a span per epoch and per batch."""
+        model = tf.keras.Sequential([tf.keras.Input(shape=(4,)), tf.keras.layers.Dense(2, activation="softmax")])
+        model.compile(optimizer="adam", loss="sparse_categorical_crossentropy")
+        dataset = tf.data.Dataset.from_tensor_slices((np.zeros((8, 4)), np.zeros(8))).batch(4)
+
+        tracer = Tracer(trace_dir)
+        tracer.start()
+        model.fit(dataset, epochs=2, verbose=0, callbacks=tracing.training_callbacks())
+        spans = read_spans(tracer.stop("run"))
+
+        names = [s["name"] for s in spans]
+        assert names.count("epoch") == 2
+        assert names.count("train_batch") == 4
+        assert tracing.training_callbacks() == []